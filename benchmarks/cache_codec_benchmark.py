@@ -0,0 +1,57 @@
+"""
+Reports the size / speed tradeoff of the cache entry codecs in
+`chaiverse.lib.cache_tools` on feedback data. Uses the feedback entries
+already cached under GUANACO_DATA_DIR when there are any, otherwise a
+synthetic payload shaped like the `/feedback/{submission_id}` response.
+
+    python benchmarks/cache_codec_benchmark.py --conversations 2000
+"""
+import argparse
+import glob
+import os
+import timeit
+
+from chaiverse import utils
+from chaiverse.feedback import Feedback
+from chaiverse.lib import cache_tools
+
+from json_codec_benchmark import make_feedback_payload
+
+
+def load_feedback_samples(num_conversations, max_samples):
+    cache_dir = os.path.join(utils.guanaco_data_dir(), 'cache')
+    samples = []
+    for path in sorted(glob.glob(os.path.join(cache_dir, '*.pkl'))):
+        try:
+            data = utils._load_from_cache(path)
+        except Exception:
+            continue
+        if isinstance(data, Feedback):
+            samples.append(data)
+        if len(samples) >= max_samples:
+            break
+    if not samples:
+        print('no cached feedback found, using a synthetic payload')
+        samples = [Feedback(make_feedback_payload(num_conversations))]
+    return samples
+
+
+def run(num_conversations, max_samples, repeat):
+    samples = load_feedback_samples(num_conversations, max_samples)
+    raw_size = sum(len(cache_tools.encode_cache_entry(sample)) for sample in samples)
+    print(f'{len(samples)} feedback entries, {raw_size / 2 ** 20:.1f} MiB pickled')
+    for codec in cache_tools.get_available_cache_codecs():
+        blobs = [cache_tools.encode_cache_entry(sample, codec) for sample in samples]
+        size = sum(len(blob) for blob in blobs)
+        encode = min(timeit.repeat(lambda: [cache_tools.encode_cache_entry(sample, codec) for sample in samples], number=1, repeat=repeat))
+        decode = min(timeit.repeat(lambda: [cache_tools.decode_cache_entry(blob) for blob in blobs], number=1, repeat=repeat))
+        print(f'{codec:>5}: {size / 2 ** 20:8.2f} MiB ({size / raw_size:6.1%})  encode {encode * 1000:8.1f} ms  decode {decode * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--conversations', type=int, default=2000)
+    parser.add_argument('--max-samples', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run(args.conversations, args.max_samples, args.repeat)
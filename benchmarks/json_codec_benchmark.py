@@ -0,0 +1,73 @@
+"""
+Compares the JSON codecs in `chaiverse.lib.json_tools` on a synthetic
+feedback payload shaped like the `/feedback/{submission_id}` response.
+
+    python benchmarks/json_codec_benchmark.py --conversations 5000
+"""
+import argparse
+import random
+import string
+import timeit
+
+from chaiverse.lib import json_tools
+
+
+def make_feedback_payload(num_conversations, messages_per_conversation=20, seed=0):
+    rng = random.Random(seed)
+    feedback = {}
+    for i in range(num_conversations):
+        bot_id = f'_bot_{rng.randrange(10 ** 6)}'
+        user_id = f'user-{rng.randrange(10 ** 6)}'
+        convo_id = f'{bot_id}_{user_id}_{1687485384266 + i}_{i}'
+        messages = [
+            {
+                'content': _random_text(rng, rng.randint(5, 60)),
+                'conversation_id': convo_id,
+                'deleted': rng.random() < 0.05,
+                'sender': {'name': 'Bot' if j % 2 == 0 else 'User', 'uid': bot_id if j % 2 == 0 else user_id},
+                'sent_date': f'2023-06-23T02:{j // 60:02d}:{j % 60:02d}.266',
+            }
+            for j in range(messages_per_conversation)
+        ]
+        feedback[convo_id] = {
+            'conversation_id': convo_id,
+            'messages': messages,
+            'model_name': 'chaiverse_model_v1',
+            'text': _random_text(rng, rng.randint(0, 20)),
+            'thumbs_up': rng.random() < 0.6,
+            'user_id': user_id,
+        }
+    thumbs_up = sum(item['thumbs_up'] for item in feedback.values())
+    return {'feedback': feedback, 'thumbs_up': thumbs_up, 'thumbs_down': num_conversations - thumbs_up}
+
+
+def _random_text(rng, num_words):
+    words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(1, 9))) for _ in range(num_words)]
+    return ' '.join(words)
+
+
+def get_codecs():
+    codecs = [json_tools.StdlibJSONCodec()]
+    if json_tools.orjson:
+        codecs.append(json_tools.OrjsonCodec())
+    return codecs
+
+
+def run(num_conversations, repeat):
+    payload = make_feedback_payload(num_conversations)
+    data = json_tools.StdlibJSONCodec().dumps(payload)
+    print(f'payload: {num_conversations} conversations, {len(data) / 2 ** 20:.1f} MiB')
+    for codec in get_codecs():
+        decode = min(timeit.repeat(lambda: codec.loads(data), number=1, repeat=repeat))
+        encode = min(timeit.repeat(lambda: codec.dumps(payload), number=1, repeat=repeat))
+        print(f'{codec.name:>8}: decode {decode * 1000:8.1f} ms  encode {encode * 1000:8.1f} ms')
+    if not json_tools.orjson:
+        print('orjson is not installed, install it to compare against the stdlib codec')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--conversations', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.conversations, args.repeat)
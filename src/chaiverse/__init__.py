@@ -1,5 +1,5 @@
 from chaiverse.chat import SubmissionChatbot
-from chaiverse.feedback import get_feedback
+from chaiverse.feedback import get_feedback, get_feedback_async, warm_feedback_cache
 from chaiverse.login_cli import developer_login
 from chaiverse.metrics.leaderboard_cli import (
     display_leaderboard,
@@ -11,5 +11,8 @@ from chaiverse.submit import (
     deactivate_model,
     evaluate_model,
     get_model_info,
+    get_model_info_async,
+    get_models_info,
     get_my_submissions,
+    get_my_submissions_async,
 )
@@ -0,0 +1,273 @@
+import asyncio
+import threading
+import time
+
+import aiohttp
+
+from chaiverse.login_cli import auto_authenticate
+from chaiverse.config import BASE_SUBMITTER_URL, BASE_FEEDBACK_URL
+from chaiverse.constants import DEFAULT_SESSION_POOL_SIZE
+from chaiverse.http_client import (
+    RetryPolicy,
+    _get_host_key,
+    _get_request_key,
+    _get_rate_limits,
+    _get_retry_after,
+    _get_retry_delay,
+    _record_status,
+    get_circuit_breaker,
+    get_request_metrics,
+)
+from chaiverse.lib import json_tools
+from chaiverse.utils import CachedResponse, get_url
+
+
+class AsyncSessionPool():
+    """
+    Asyncio counterpart of `SessionPool`.
+
+    aiohttp sessions are bound to the event loop they were created in, so
+    sessions are keyed by both the running loop and the hostname. The
+    sessions of a loop are closed when `asyncio.run` shuts it down, and
+    dropped if the loop was closed some other way.
+    """
+    def __init__(self, pool_size=DEFAULT_SESSION_POOL_SIZE):
+        self.pool_size = pool_size
+        self._sessions = {}
+        self._shutdown_watchers = {}
+        self._closing_tasks = set()
+        self._lock = threading.Lock()
+
+    def get_session(self, hostname):
+        loop = asyncio.get_running_loop()
+        key = (loop, _get_host_key(hostname))
+        with self._lock:
+            self._discard_closed_loops()
+            session = self._sessions.get(key)
+            if session is None or session.closed:
+                session = self._create_session()
+                self._sessions[key] = session
+            if loop not in self._shutdown_watchers:
+                self._shutdown_watchers[loop] = self._watch_loop_shutdown(loop)
+        return session
+
+    async def close(self):
+        await self._close_loop_sessions(asyncio.get_running_loop())
+
+    async def _close_loop_sessions(self, loop):
+        with self._lock:
+            keys = [key for key in self._sessions.keys() if key[0] is loop]
+            sessions = [self._sessions.pop(key) for key in keys]
+        for session in sessions:
+            await session.close()
+
+    def _watch_loop_shutdown(self, loop):
+        # asyncio.run closes the async generators of its loop before closing
+        # the loop, so the finally block runs while sessions can still close
+        async def close_at_shutdown():
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self._shutdown_watchers.pop(loop, None)
+                await self._close_loop_sessions(loop)
+
+        watcher = close_at_shutdown()
+        asyncio.ensure_future(watcher.__anext__())
+        return watcher
+
+    def _discard_closed_loops(self):
+        # aiohttp skips closing the transports of a closed loop, so the
+        # sessions of closed loops are closed from the running loop
+        for key in [key for key in self._sessions.keys() if key[0].is_closed()]:
+            task = asyncio.ensure_future(self._sessions.pop(key).close())
+            self._closing_tasks.add(task)
+            task.add_done_callback(self._closing_tasks.discard)
+        for loop in [loop for loop in self._shutdown_watchers.keys() if loop.is_closed()]:
+            self._shutdown_watchers.pop(loop)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _create_session(self):
+        connector = aiohttp.TCPConnector(limit_per_host=self.pool_size)
+        # sessions are shared between developer keys, so cookies must not persist
+        return aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar())
+
+
+_default_async_session_pool = AsyncSessionPool()
+
+
+def get_default_async_session_pool():
+    return _default_async_session_pool
+
+
+class AsyncSingleFlight():
+    """
+    Asyncio counterpart of `SingleFlight`: concurrent coroutines of the same
+    event loop asking for the same key await a single in-flight call.
+    """
+    def __init__(self):
+        self._futures = {}
+
+    async def do(self, key, coroutine_func):
+        key = (asyncio.get_running_loop(), key)
+        future = self._futures.get(key)
+        if future is None:
+            future = asyncio.ensure_future(coroutine_func())
+            self._futures[key] = future
+            future.add_done_callback(lambda _: self._futures.pop(key, None))
+        # shielded so that a cancelled waiter does not cancel the shared call
+        return await asyncio.shield(future)
+
+
+_async_single_flight = AsyncSingleFlight()
+
+
+DEFAULT_ASYNC_RETRY_POLICY = RetryPolicy(
+    retryable_exceptions=(aiohttp.ClientConnectionError, asyncio.TimeoutError),
+    unprocessed_exceptions=(aiohttp.ClientConnectorError,),
+)
+
+
+class _AsyncChaiverseHTTPClient():
+    def __init__(self, developer_key=None, hostname=None, session_pool=None, retry_policy=None):
+        self.developer_key = developer_key
+        self.hostname = hostname
+        self.retry_policy = retry_policy or DEFAULT_ASYNC_RETRY_POLICY
+        self._session_pool = session_pool
+
+    @property
+    def headers(self):
+        return {"Authorization": f"Bearer {self.developer_key}"}
+
+    @property
+    def session(self):
+        session_pool = self._session_pool or get_default_async_session_pool()
+        return session_pool.get_session(self.hostname)
+
+    async def get(self, endpoint, submission_id=None, **kwargs):
+        url = get_url(endpoint, hostname=self.hostname, submission_id=submission_id)
+        key = _get_request_key('GET', url, self.developer_key, **kwargs)
+        response = await _async_single_flight.do(key, lambda: self._request('GET', url=url, endpoint=endpoint, **kwargs))
+        return response
+
+    async def get_conditional(self, endpoint, cached_response=None, submission_id=None, **kwargs):
+        """
+        Asyncio counterpart of `get_conditional`: returns `cached_response`
+        itself when the server replies 304 Not Modified, otherwise a new
+        `CachedResponse` carrying the ETag / Last-Modified validators.
+        """
+        url = get_url(endpoint, hostname=self.hostname, submission_id=submission_id)
+        headers = cached_response.conditional_headers if cached_response else {}
+        key = _get_request_key('GET', url, self.developer_key, headers=headers, **kwargs)
+        return await _async_single_flight.do(key, lambda: self._get_conditional(url, endpoint, headers, cached_response, **kwargs))
+
+    async def _get_conditional(self, url, endpoint, headers, cached_response, **kwargs):
+        status, response_headers, body = await self._send_with_retries('GET', url, endpoint, headers=headers, **kwargs)
+        if status == 304 and cached_response:
+            return cached_response
+        payload = self._decode(status, body, 'GET', endpoint)
+        return CachedResponse(payload, response_headers.get('ETag'), response_headers.get('Last-Modified'))
+
+    async def post(self, endpoint, data, submission_id=None, **kwargs):
+        url = get_url(endpoint, hostname=self.hostname, submission_id=submission_id)
+        headers = {'Content-Type': 'application/json'}
+        response = await self._request('POST', url=url, endpoint=endpoint, data=json_tools.dumps(data), headers=headers, **kwargs)
+        return response
+
+    async def _request(self, method, url, endpoint=None, **kwargs):
+        status, _, body = await self._send_with_retries(method, url, endpoint, **kwargs)
+        return self._decode(status, body, method, endpoint)
+
+    def _decode(self, status, body, method='GET', endpoint=None):
+        # decoded only once the status is known, error pages are rarely JSON
+        assert status == 200, _get_error_detail(body)
+        start_time = time.perf_counter()
+        payload = json_tools.loads(body) if body else None
+        get_request_metrics().record_decode(method, endpoint, len(body), time.perf_counter() - start_time)
+        return payload
+
+    async def _send_with_retries(self, method, url, endpoint=None, **kwargs):
+        circuit_breaker = get_circuit_breaker(self.hostname)
+        rate_limits = _get_rate_limits(self.hostname, endpoint)
+        start_time = time.monotonic()
+        attempt = 0
+        while True:
+            circuit_breaker.before_request()
+            for rate_limit in rate_limits:
+                await _acquire_rate_limit(rate_limit)
+            try:
+                status, headers, body = await self._timed_send(method, url, endpoint, **kwargs)
+            except self.retry_policy.retryable_exceptions as ex:
+                circuit_breaker.record_failure()
+                delay = _get_retry_delay(self.retry_policy, attempt, start_time)
+                if delay is None or not self.retry_policy.is_retryable_exception(method, ex):
+                    raise
+            except Exception:
+                circuit_breaker.cancel_trial()
+                raise
+            else:
+                _record_status(circuit_breaker, status)
+                if not self.retry_policy.is_retryable_status(method, status):
+                    return status, headers, body
+                delay = _get_retry_delay(self.retry_policy, attempt, start_time, _get_retry_after(headers))
+                if delay is None:
+                    return status, headers, body
+            get_request_metrics().record_retry(method, endpoint)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _timed_send(self, method, url, endpoint=None, **kwargs):
+        start_time = time.perf_counter()
+        status = 'error'
+        try:
+            status, headers, body = await self._send(method, url, **kwargs)
+        finally:
+            get_request_metrics().record_response(method, endpoint, status, time.perf_counter() - start_time)
+        return status, headers, body
+
+    async def _send(self, method, url, timeout=None, headers=None, **kwargs):
+        timeout = aiohttp.ClientTimeout(total=timeout)
+        headers = {**self.headers, **(headers or {})}
+        async with self.session.request(method, url, headers=headers, timeout=timeout, **kwargs) as response:
+            body = await response.read()
+        return response.status, response.headers, body
+
+
+def _get_error_detail(body):
+    try:
+        detail = json_tools.loads(body)
+    except ValueError:
+        detail = body.decode('UTF-8', errors='replace')
+    return detail
+
+
+async def _acquire_rate_limit(rate_limit):
+    wait = rate_limit.try_acquire()
+    while wait > 0:
+        await asyncio.sleep(wait)
+        wait = rate_limit.try_acquire()
+
+
+@auto_authenticate
+class AsyncSubmitterClient(_AsyncChaiverseHTTPClient):
+    def __init__(self,
+            developer_key=None,
+            hostname=BASE_SUBMITTER_URL,
+            session_pool=None,
+            retry_policy=None):
+        super().__init__(developer_key, hostname, session_pool, retry_policy)
+
+
+@auto_authenticate
+class AsyncFeedbackClient(_AsyncChaiverseHTTPClient):
+    def __init__(self,
+            developer_key=None,
+            hostname=BASE_FEEDBACK_URL,
+            session_pool=None,
+            retry_policy=None):
+        super().__init__(developer_key, hostname, session_pool, retry_policy)
@@ -1,11 +1,12 @@
 from dataclasses import dataclass
-import json
 import os
 from pathlib import Path
 
 from chaiverse.login_cli import auto_authenticate
+from chaiverse.lib import json_tools
 from chaiverse.utils import print_color
 from chaiverse.http_client import SubmitterClient
+from chaiverse.async_http_client import AsyncSubmitterClient
 from chaiverse.config import BASE_SUBMITTER_URL, CHAT_ENDPOINT
 
 
@@ -90,8 +91,8 @@ class BotConfig:
 
     @classmethod
     def from_json(cls, path):
-        with open(path, 'r') as f:
-            data = json.load(f)
+        with open(path, 'rb') as f:
+            data = json_tools.loads(f.read())
         return cls(**data)
 
 
@@ -109,6 +110,8 @@ class Bot:
         self.bot_config = bot_config
         self.endpoint = endpoint
         self._chat_history = self._init_chat_history()
+        self._http_client = SubmitterClient(developer_key)
+        self._async_http_client = AsyncSubmitterClient(developer_key)
 
     def get_response(self, user_input):
         response = self._get_raw_response(user_input)
@@ -116,8 +119,25 @@ class Bot:
         self._update_chat_history(model_output, self.bot_config.bot_label)
         return response
 
+    async def get_response_async(self, user_input):
+        response = await self._get_raw_response_async(user_input)
+        model_output = response['model_output']
+        self._update_chat_history(model_output, self.bot_config.bot_label)
+        return response
+
     def _get_raw_response(self, user_input):
         self._update_chat_history(user_input, 'user')
+        payload = self._get_payload()
+        response = self._http_client.post(endpoint=self.endpoint, submission_id=self.submission_id, timeout=20, data=payload)
+        return response
+
+    async def _get_raw_response_async(self, user_input):
+        self._update_chat_history(user_input, 'user')
+        payload = self._get_payload()
+        response = await self._async_http_client.post(endpoint=self.endpoint, submission_id=self.submission_id, timeout=20, data=payload)
+        return response
+
+    def _get_payload(self):
         payload = {
             "memory": self.bot_config.memory,
             "prompt": self.bot_config.prompt,
@@ -125,9 +145,7 @@ class Bot:
             "bot_name": self.bot_config.bot_label,
             "user_name": "You"
         }
-        http_client = SubmitterClient(self.developer_key)
-        response = http_client.post(endpoint=self.endpoint, submission_id=self.submission_id, timeout=20, data=payload)
-        return response
+        return payload
 
     def _update_chat_history(self, message, sender):
         message = {"sender": sender, "message": message}
@@ -162,3 +180,12 @@ def get_bot_response(messages, submission_id, bot_config, developer_key):
     content, sender = messages[-1]
     response = chai_bot.get_response(content)["model_output"]
     return response
+
+
+async def get_bot_response_async(messages, submission_id, bot_config, developer_key):
+    chai_bot = Bot(submission_id, developer_key, bot_config)
+    for content, sender in messages[:-1]:
+        chai_bot._update_chat_history(content, sender)
+    content, sender = messages[-1]
+    response = await chai_bot.get_response_async(content)
+    return response["model_output"]
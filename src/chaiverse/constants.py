@@ -4,6 +4,12 @@ import os
 DEFAULT_MAX_WORKERS = 1
 
 
+DEFAULT_SESSION_POOL_SIZE = 10
+
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
 PUBLIC_LEADERBOARD_MINIMUM_FEEDBACK_COUNT = 0
 
 
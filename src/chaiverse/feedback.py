@@ -1,23 +1,141 @@
+import asyncio
+import functools
+from operator import itemgetter
+import os
 from pathlib import Path
+import shutil
+import threading
+import time
 
+import numpy as np
 import pandas as pd
 
-from chaiverse import utils
+from chaiverse import constants, utils
+from chaiverse.lib import date_tools, file_tools, json_tools, parquet_tools
 from chaiverse.login_cli import auto_authenticate
 from chaiverse.http_client import FeedbackClient
+from chaiverse.async_http_client import AsyncFeedbackClient
 from chaiverse.utils import print_color
 from chaiverse.config import BASE_FEEDBACK_URL, FEEDBACK_ENDPOINT
 
 
+# incremental syncs ask again for this many seconds before the newest cached
+# feedback, so that feedback stored late on the server is not skipped
+FEEDBACK_SYNC_OVERLAP_SECONDS = 3600
+
+FEEDBACK_COLUMN_TYPES = {
+    'conversation_id': 'object',
+    'bot_id': 'category',
+    'user_id': 'object',
+    'thumbs_up': 'bool',
+    'feedback': 'object',
+    'model_name': 'category',
+    'public': 'bool',
+    'server_epoch_time': 'int64',
+}
+
+# rendered conversation text, only built for the rows that are viewed
+RENDERED_FEEDBACK_COLUMN_TYPES = {**FEEDBACK_COLUMN_TYPES, 'conversation': 'object'}
+
+# Parquet tables of the cached feedback, one row per conversation and one per
+# message, written with every save when GUANACO_FEEDBACK_TABLES is set
+FEEDBACK_TABLES_ENABLED = os.environ.get('GUANACO_FEEDBACK_TABLES', '').lower() in ('1', 'true')
+
+CONVERSATION_COLUMN_TYPES = FEEDBACK_COLUMN_TYPES
+
+MESSAGE_COLUMN_TYPES = {
+    'conversation_id': 'category',
+    'position': 'int32',
+    'sender_name': 'object',
+    'sender_uid': 'category',
+    'content': 'object',
+    'deleted': 'bool',
+    'sent_date': 'object',
+}
+
+
 class Feedback():
-    def __init__(self, raw_data):
+    def __init__(self, raw_data, etag=None, last_modified=None):
         self.raw_data = raw_data
+        self.etag = etag
+        self.last_modified = last_modified
+        self._df = None
+        self._index = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_index'] = None
+        if self._has_raw_feedback():
+            # the table is cheaper to rebuild than to store next to its source
+            state['_df'] = None
+        return state
+
+    @property
+    def cached_response(self):
+        # pickles written before validators were stored lack these attributes
+        etag = getattr(self, 'etag', None)
+        last_modified = getattr(self, 'last_modified', None)
+        return utils.CachedResponse(self.raw_data, etag, last_modified)
 
     @property
     def df(self):
-        raw_feedback = self.raw_data['feedback']
-        feedback = self._extract_feedback_as_rows(raw_feedback)
-        return pd.DataFrame(feedback)
+        """
+        One row per conversation, built on first access and reused after.
+        The conversation text is not stored as a column but rendered on
+        access with `df.conversations.text`, or see `with_conversations`.
+        """
+        # pickles written before the table was memoized lack the attribute
+        if getattr(self, '_df', None) is None:
+            columns = self._extract_feedback_as_columns(self.raw_data['feedback'])
+            self._df = _get_typed_feedback_df(columns)
+            self._df.attrs['feedback'] = _FeedbackReference(self)
+        return self._df
+
+    def without_raw_data(self):
+        """
+        Returns a copy keeping the table and the thumbs up / down totals but
+        not the raw conversations, for analyses that only need `df`. The
+        copy shares the table, so the original is left untouched.
+        """
+        df = self.df.copy(deep=False)
+        # the copy must not keep the raw conversations alive through the table
+        df.attrs = {}
+        raw_data = {key: value for key, value in self.raw_data.items() if key != 'feedback'}
+        feedback = Feedback(raw_data, getattr(self, 'etag', None), getattr(self, 'last_modified', None))
+        feedback._df = df
+        return feedback
+
+    def query(self, thumbs_up=None, public=None, user_id=None, bot_id=None, date_range=None, model_name=None, limit=None):
+        """
+        Returns the positions in `df` of the conversations matching every
+        given filter, in row order and at most `limit` of them, e.g.
+        `feedback.df.iloc[feedback.query(user_id=user_id)]`. `date_range`
+        takes the `start_date` / `end_date` form of the leaderboard. Filters
+        go through a `FeedbackIndex` built on the first query, so lookups
+        only touch the matching rows.
+        """
+        # pickles written before queries were indexed lack the attribute
+        if getattr(self, '_index', None) is None:
+            self._index = FeedbackIndex(self.df)
+        return self._index.query(thumbs_up, public, user_id, bot_id, date_range, model_name, limit)
+
+    def get_conversation(self, conversation_id):
+        """
+        Renders the messages of a conversation as text, oldest first.
+        """
+        messages = self.raw_data['feedback'][conversation_id]['messages']
+        return self._extract_conversation_from_messages(messages)
+
+    def with_conversations(self, df=None):
+        """
+        Returns a copy of `df` (defaults to `self.df`), which must hold rows
+        of `self.df`, with the rendered `conversation` text of each row.
+        Render only the rows that are viewed or exported, e.g.
+        `feedback.with_conversations(feedback.df[feedback.df.public])`.
+        """
+        df = self.df if df is None else df
+        df = df.assign(conversation=[self.get_conversation(convo_id) for convo_id in df.conversation_id])
+        return df.astype({'conversation': 'object'})
 
     def sample(self):
         df = self.df
@@ -26,8 +144,9 @@ class Feedback():
 
     def pprint_row(self, row):
         data = row.to_dict(orient='records')[0]
+        conversation = data['conversation'] if 'conversation' in data else self.get_conversation(data['conversation_id'])
         print_color('### Conversation ###', 'yellow')
-        print(data['conversation'])
+        print(conversation)
         print_color('###', 'yellow')
         thumbs_up = "👍" if data['thumbs_up'] else "👎"
         print_color(f'Feedback {thumbs_up}: {data["feedback"]}', 'green')
@@ -35,31 +154,52 @@ class Feedback():
         print_color(f'User ID: {data["user_id"]}', 'blue')
         print_color(f'Bot ID: {data["bot_id"]}', 'blue')
 
-    def _extract_feedback_as_rows(self, feedback):
+    def _extract_feedback_as_columns(self, feedback):
         rows = [self._extract_feedback_data(cid, data) for cid, data in feedback.items()]
-        return rows
+        columns = {column: [row[column] for row in rows] for column in FEEDBACK_COLUMN_TYPES}
+        return columns
+
+    def _extract_feedback_as_tables(self):
+        conversations = {column: [] for column in CONVERSATION_COLUMN_TYPES}
+        messages = {column: [] for column in MESSAGE_COLUMN_TYPES}
+        for convo_id, message_data in self.raw_data['feedback'].items():
+            conversation = self._extract_feedback_data(convo_id, message_data)
+            for column, value in conversation.items():
+                conversations[column].append(value)
+            for position, message in enumerate(self._get_sorted_messages(message_data['messages'])):
+                messages['conversation_id'].append(convo_id)
+                messages['position'].append(position)
+                messages['sender_name'].append(message['sender']['name'])
+                messages['sender_uid'].append(message['sender'].get('uid'))
+                messages['content'].append(message['content'])
+                messages['deleted'].append(message['deleted'])
+                messages['sent_date'].append(message['sent_date'])
+        return conversations, messages
+
+    def _has_raw_feedback(self):
+        return isinstance(self.raw_data, dict) and 'feedback' in self.raw_data
 
     def _extract_feedback_data(self, convo_id, message_data):
-        convo = self._extract_conversation_from_messages(message_data['messages'])
-        bot_id = self._extract_bot_id(convo_id)
-        user_id = self._extract_user_id(convo_id)
+        bot_id, user_id, server_epoch_time = self._split_convo_id(convo_id)
         data = {
                 'conversation_id': convo_id,
                 'bot_id': bot_id,
                 'user_id': user_id,
-                'conversation': convo,
                 'thumbs_up': message_data['thumbs_up'],
                 'feedback': message_data['text'],
                 'model_name': message_data['model_name'],
                 'public': message_data.get('public', False),
+                'server_epoch_time': server_epoch_time,
         }
         return data
 
-    def _extract_bot_id(self, convo_id):
-        return '_'.join(convo_id.split('_')[:3])
-
-    def _extract_user_id(self, convo_id):
-        return convo_id.split('_')[3]
+    def _split_convo_id(self, convo_id):
+        # ids read _bot_<bot>_<user>_..._<server epoch time>
+        parts = convo_id.split('_')
+        bot_id = '_'.join(parts[:3])
+        user_id = parts[3]
+        server_epoch_time = int(parts[-1])
+        return bot_id, user_id, server_epoch_time
 
     def _extract_conversation_from_messages(self, messages):
         conversation = []
@@ -71,7 +211,7 @@ class Feedback():
         return '\n'.join(conversation)
 
     def _get_sorted_messages(self, messages):
-        sorted_messages = sorted(messages, key=lambda x: x['sent_date'])
+        sorted_messages = sorted(messages, key=itemgetter('sent_date'))
         return sorted_messages
 
     def _get_sender_tag(self, message):
@@ -81,42 +221,443 @@ class Feedback():
         return sender
 
 
+class _FeedbackReference():
+    # frames deep copy their attrs into every derived frame, so the feedback
+    # is shared rather than copied, and left out when the frame is pickled
+    def __init__(self, feedback):
+        self.feedback = feedback
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __getstate__(self):
+        return {'feedback': None}
+
+
+@pd.api.extensions.register_dataframe_accessor('conversations')
+class ConversationsAccessor():
+    """
+    Renders the conversation of each row of a `Feedback.df` table, or of
+    rows selected from it, e.g. `df[df.public].conversations.text`.
+    """
+    def __init__(self, df):
+        self._df = df
+
+    @property
+    def text(self):
+        reference = self._df.attrs.get('feedback')
+        assert reference is not None and reference.feedback is not None, 'Conversations are only available on tables of a Feedback with raw data'
+        conversations = [reference.feedback.get_conversation(convo_id) for convo_id in self._df.conversation_id]
+        return pd.Series(conversations, index=self._df.index, name='conversation', dtype='object')
+
+
+class FeedbackIndex():
+    """
+    Row positions of a feedback table by user, bot and model, and its rows
+    ordered by time, so that queries look rows up instead of scanning.
+    """
+    def __init__(self, df):
+        self.rows_by_user = _get_rows_by_value(df.user_id)
+        self.rows_by_bot = _get_rows_by_value(df.bot_id)
+        self.rows_by_model = _get_rows_by_value(df.model_name)
+        self.thumbs_up = df.thumbs_up.to_numpy()
+        self.public = df.public.to_numpy()
+        self.epoch_times = df.server_epoch_time.to_numpy()
+        self.rows_by_time = np.argsort(self.epoch_times, kind='stable')
+        self.sorted_epoch_times = self.epoch_times[self.rows_by_time]
+
+    def query(self, thumbs_up=None, public=None, user_id=None, bot_id=None, date_range=None, model_name=None, limit=None):
+        rows = None
+        for rows_by_value, value in [(self.rows_by_user, user_id), (self.rows_by_bot, bot_id), (self.rows_by_model, model_name)]:
+            if value is not None:
+                value_rows = rows_by_value.get(value, np.array([], dtype=np.intp))
+                rows = value_rows if rows is None else np.intersect1d(rows, value_rows, assume_unique=True)
+        if date_range is not None:
+            rows = self._filter_by_date_range(rows, date_range)
+        if rows is None:
+            rows = np.arange(len(self.epoch_times))
+        if thumbs_up is not None:
+            rows = rows[self.thumbs_up[rows] == thumbs_up]
+        if public is not None:
+            rows = rows[self.public[rows] == public]
+        return rows[:limit]
+
+    def _filter_by_date_range(self, rows, date_range):
+        start_epoch_time, end_epoch_time = date_tools.get_epoch_time_range(date_range)
+        if rows is None:
+            # bounds are exclusive, as in date_tools.is_epoch_time_in_date_range
+            start = np.searchsorted(self.sorted_epoch_times, start_epoch_time, side='right')
+            end = np.searchsorted(self.sorted_epoch_times, end_epoch_time, side='left')
+            rows = np.sort(self.rows_by_time[start:end])
+        else:
+            epoch_times = self.epoch_times[rows]
+            rows = rows[(start_epoch_time < epoch_times) & (epoch_times < end_epoch_time)]
+        return rows
+
+
+def _get_rows_by_value(column):
+    codes, values = pd.factorize(column)
+    rows = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[rows], np.arange(len(values) + 1))
+    return {value: rows[bounds[i]:bounds[i + 1]] for i, value in enumerate(values)}
+
+
+class FeedbackRowExtractor():
+    """
+    Streaming consumer for `stream_feedback` that keeps only the extracted
+    row and rendered text of each conversation instead of its raw messages.
+    """
+    def __init__(self):
+        self.rows = []
+        self._feedback = Feedback({'feedback': {}})
+
+    def __call__(self, convo_id, message_data):
+        row = self._feedback._extract_feedback_data(convo_id, message_data)
+        row['conversation'] = self._feedback._extract_conversation_from_messages(message_data['messages'])
+        self.rows.append(row)
+
+    @property
+    def df(self):
+        return _get_typed_feedback_df(self.rows, RENDERED_FEEDBACK_COLUMN_TYPES)
+
+
+def _get_typed_feedback_df(data, column_types=FEEDBACK_COLUMN_TYPES):
+    df = pd.DataFrame(data, columns=list(column_types))
+    return df.astype(column_types)
+
+
 @auto_authenticate
-def get_feedback(submission_id: str, developer_key=None, reload=True):
-    load_feedback = _get_latest_feedback if reload else _get_cached_feedback
-    feedback = load_feedback(submission_id, developer_key)
+def get_feedback(submission_id: str, developer_key=None, reload=True, incremental=True):
+    """
+    With `incremental`, a reload only asks for the conversations newer than
+    the cached ones and merges them into the cached feedback.
+    """
+    if reload:
+        feedback = _get_latest_feedback(submission_id, developer_key, incremental)
+    else:
+        feedback = _get_cached_feedback(submission_id, developer_key)
     return feedback
 
 
-def is_submission_updated(submission_id: str, submission_feedback_total : int) -> bool:
-    filename = Path(utils.guanaco_data_dir()) / 'cache' / f'{submission_id}.pkl'
+@auto_authenticate
+async def get_feedback_async(submission_id: str, developer_key=None, reload=True, incremental=True):
+    if reload:
+        feedback = await _get_latest_feedback_async(submission_id, developer_key, incremental)
+    else:
+        feedback = await _get_cached_feedback_async(submission_id, developer_key)
+    return feedback
+
+
+@auto_authenticate
+def stream_feedback(submission_id: str, consumer, developer_key=None):
+    """
+    Downloads feedback as a compressed stream and calls
+    `consumer(conversation_id, conversation)` once per conversation, so peak
+    memory is bounded by what the consumer keeps. Returns the remaining
+    fields of the response, i.e. the thumbs up / down totals.
+    """
+    http_client = FeedbackClient(developer_key)
+    fields = http_client.stream_mapping(FEEDBACK_ENDPOINT, 'feedback', consumer, submission_id=submission_id)
+    return fields
+
+
+@auto_authenticate
+def warm_feedback_cache(submission_ids=None, max_workers=constants.DEFAULT_SESSION_POOL_SIZE, developer_key=None):
+    """
+    Downloads and caches the feedback of every submission whose cached
+    feedback is missing or behind its feedback count on the leaderboard, so
+    that `get_feedback(reload=False)` and leaderboards read from the cache.
+    Submissions default to all those returned by `get_submissions`. Returns
+    the cached metadata of each refreshed submission keyed by submission id,
+    or the raised exception if its download failed.
+    """
+    submissions = utils.get_submissions(developer_key)
+    submission_ids = list(submissions) if submission_ids is None else list(submission_ids)
+    stale_submission_ids = [
+        submission_id for submission_id in submission_ids
+        if _is_feedback_cache_stale(submission_id, submissions.get(submission_id))
+    ]
+    results = utils.distribute_to_workers(
+        _warm_feedback_or_error,
+        stale_submission_ids,
+        max_workers=max_workers,
+        worker_type='thread',
+        developer_key=developer_key,
+    )
+    return dict(zip(stale_submission_ids, results))
+
+
+def _is_feedback_cache_stale(submission_id, submission_data):
+    if submission_data is None:
+        # submissions missing from the leaderboard are only fetched once
+        is_stale = get_cached_feedback_metadata(submission_id) is None
+    else:
+        submission_feedback_total = submission_data['thumbs_up'] + submission_data['thumbs_down']
+        is_stale = is_submission_updated(submission_id, submission_feedback_total)
+    return is_stale
+
+
+def _warm_feedback_or_error(submission_id, developer_key):
     try:
-        feedback = utils._load_from_cache(filename)
-        cached_feedback_total = int(feedback.raw_data.get("thumbs_up", 0)) + int(feedback.raw_data.get("thumbs_down", 0))
-        submission_updated = cached_feedback_total < submission_feedback_total
-    except FileNotFoundError:
+        _get_latest_feedback(submission_id, developer_key, incremental=True)
+    except Exception as ex:
+        return ex
+    return get_cached_feedback_metadata(submission_id)
+
+
+def is_submission_updated(submission_id: str, submission_feedback_total : int) -> bool:
+    metadata = get_cached_feedback_metadata(submission_id)
+    if metadata is None:
         submission_updated = True
+    else:
+        cached_feedback_total = metadata['thumbs_up'] + metadata['thumbs_down']
+        submission_updated = cached_feedback_total < submission_feedback_total
     return submission_updated
 
 
+def get_cached_feedback_metadata(submission_id):
+    """
+    Returns the counts, fetch time, size and validators of the cached
+    feedback of a submission without unpickling it, or None when nothing is
+    cached.
+    """
+    filename = _get_cached_feedback_filename(submission_id)
+    try:
+        utils.get_cache_backend().get_info(os.fspath(filename))
+        metadata = get_feedback_index().get(submission_id)
+        if metadata is None:
+            # feedback cached before the index existed
+            metadata = _update_feedback_index(submission_id, utils._load_from_cache(filename))
+    except FileNotFoundError:
+        metadata = None
+    return metadata
+
+
+def get_feedback_index():
+    """
+    Metadata of every cached feedback keyed by submission id, read with a
+    single file open and reused until the index file changes.
+    """
+    global _feedback_index
+    index_path = _get_feedback_index_path()
+    try:
+        stat = os.stat(index_path)
+    except FileNotFoundError:
+        return {}
+    version = (index_path, stat.st_mtime_ns, stat.st_size)
+    with _feedback_index_lock:
+        if _feedback_index[0] != version:
+            with open(index_path, 'rb') as f:
+                _feedback_index = (version, json_tools.loads(f.read()))
+        return _feedback_index[1]
+
+
+_feedback_index = (None, {})
+_feedback_index_lock = threading.Lock()
+
+
+def save_feedback_tables(submission_id, feedback):
+    """
+    Writes `feedback` as the Parquet tables read by `load_feedback_table`.
+    Needs pyarrow.
+    """
+    conversations, messages = feedback._extract_feedback_as_tables()
+    tables_dir = _get_feedback_tables_dir(submission_id)
+    os.makedirs(tables_dir, exist_ok=True)
+    parquet_tools.write_parquet_table(os.path.join(tables_dir, 'conversations.parquet'), conversations, CONVERSATION_COLUMN_TYPES)
+    parquet_tools.write_parquet_table(os.path.join(tables_dir, 'messages.parquet'), messages, MESSAGE_COLUMN_TYPES)
+
+
+def load_feedback_table(submission_id, table='conversations', columns=None):
+    """
+    Reads the `conversations` or `messages` table of the cached feedback of
+    a submission as a `pyarrow.Table`, through a memory map and decoding
+    only `columns`, so that e.g. thumbs up ratios never touch the messages.
+    Messages link to their conversation by `conversation_id` and are
+    numbered by `position`. Tables missing for cached feedback are written
+    on first use and kept up to date by every later save. Needs pyarrow.
+    """
+    assert table in ('conversations', 'messages'), f'Unknown feedback table {table}, expecting conversations or messages'
+    table_path = os.path.join(_get_feedback_tables_dir(submission_id), f'{table}.parquet')
+    if not os.path.exists(table_path):
+        feedback = utils._load_from_cache(_get_cached_feedback_filename(submission_id))
+        save_feedback_tables(submission_id, feedback)
+    return parquet_tools.read_parquet_table(table_path, columns)
+
+
+def _remove_pruned_feedback_tables(cache_dir, removed_keys):
+    # tables of evicted feedback, or of feedback pruned before this ran
+    tables_root = os.path.join(cache_dir, 'feedback_tables')
+    try:
+        submission_ids = os.listdir(tables_root)
+    except FileNotFoundError:
+        submission_ids = []
+    removed_keys = set(removed_keys)
+    for submission_id in submission_ids:
+        filename = os.path.join(cache_dir, f'{submission_id}.pkl')
+        if filename in removed_keys or not _is_cached(filename):
+            shutil.rmtree(os.path.join(tables_root, submission_id), ignore_errors=True)
+
+
+def _is_cached(filename):
+    try:
+        utils.get_cache_backend().get_info(os.fspath(filename))
+    except FileNotFoundError:
+        return False
+    return True
+
+
+utils.register_cache_prune_callback(_remove_pruned_feedback_tables)
+
+
+def _save_feedback(submission_id, feedback):
+    filename = _get_cached_feedback_filename(submission_id)
+    utils._save_to_cache(filename, feedback)
+    _update_feedback_index(submission_id, feedback)
+    has_tables = os.path.isdir(_get_feedback_tables_dir(submission_id))
+    if (FEEDBACK_TABLES_ENABLED or has_tables) and feedback._has_raw_feedback():
+        save_feedback_tables(submission_id, feedback)
+
+
+def _update_feedback_index(submission_id, feedback):
+    filename = _get_cached_feedback_filename(submission_id)
+    try:
+        size = utils.get_cache_backend().get_info(os.fspath(filename)).size
+    except FileNotFoundError:
+        size = None
+    raw_data = feedback.raw_data if isinstance(feedback.raw_data, dict) else {}
+    metadata = {
+        'thumbs_up': int(raw_data.get('thumbs_up', 0)),
+        'thumbs_down': int(raw_data.get('thumbs_down', 0)),
+        'fetched_at': time.time(),
+        'size': size,
+        'etag': getattr(feedback, 'etag', None),
+        'last_modified': getattr(feedback, 'last_modified', None),
+    }
+    return _write_feedback_index_entry(submission_id, **metadata)
+
+
+def _touch_feedback(submission_id):
+    utils._touch_cache(_get_cached_feedback_filename(submission_id))
+    if submission_id in get_feedback_index():
+        _write_feedback_index_entry(submission_id, fetched_at=time.time())
+
+
+def _write_feedback_index_entry(submission_id, **fields):
+    index_path = _get_feedback_index_path()
+    with file_tools.file_lock(f'{index_path}.lock'):
+        index = dict(get_feedback_index())
+        index[submission_id] = {**index.get(submission_id, {}), **fields}
+        file_tools.write_file_atomically(index_path, json_tools.dumps(index))
+    return index[submission_id]
+
+
+def _get_feedback_index_path():
+    return os.path.join(utils.guanaco_data_dir(), 'cache', 'feedback_index.json')
+
+
 @auto_authenticate
-def _get_latest_feedback(submission_id, developer_key):
+def _get_latest_feedback(submission_id, developer_key, incremental=False):
+    filename = _get_cached_feedback_filename(submission_id)
+    cached_feedback = _load_cached_feedback(filename)
+    cached_response = _get_revalidated_response(cached_feedback)
+    kwargs = _get_sync_params(cached_feedback) if incremental else {}
     http_client = FeedbackClient(developer_key)
-    response = http_client.get(endpoint=FEEDBACK_ENDPOINT, submission_id=submission_id)
-    feedback = Feedback(response)
+    response = http_client.get_conditional(FEEDBACK_ENDPOINT, cached_response, submission_id=submission_id, **kwargs)
+    return _update_cached_feedback(submission_id, cached_feedback, cached_response, response, merge=bool(kwargs))
+
+
+@auto_authenticate
+async def _get_latest_feedback_async(submission_id, developer_key, incremental=False):
+    # cache I/O may wait on other processes' locks, so it runs off the event loop
+    loop = asyncio.get_running_loop()
     filename = _get_cached_feedback_filename(submission_id)
-    utils._save_to_cache(filename, feedback)
+    cached_feedback = await loop.run_in_executor(None, _load_cached_feedback, filename)
+    cached_response = _get_revalidated_response(cached_feedback)
+    kwargs = _get_sync_params(cached_feedback) if incremental else {}
+    http_client = AsyncFeedbackClient(developer_key)
+    response = await http_client.get_conditional(FEEDBACK_ENDPOINT, cached_response, submission_id=submission_id, **kwargs)
+    update_cached_feedback = functools.partial(
+        _update_cached_feedback, submission_id, cached_feedback, cached_response, response, merge=bool(kwargs))
+    return await loop.run_in_executor(None, update_cached_feedback)
+
+
+def _update_cached_feedback(submission_id, cached_feedback, cached_response, response, merge):
+    utils._record_revalidation('feedback', cached_feedback is not None, response is cached_response)
+    if response is cached_response:
+        feedback = cached_feedback
+        _touch_feedback(submission_id)
+    else:
+        raw_data = _merge_feedback(cached_feedback, response.payload) if merge else response.payload
+        feedback = Feedback(raw_data, response.etag, response.last_modified)
+        _save_feedback(submission_id, feedback)
     return feedback
 
 
+def _get_sync_params(cached_feedback):
+    # ids end in the server epoch time the feedback was stored at
+    sync_params = {}
+    if cached_feedback is not None and cached_feedback._has_raw_feedback():
+        epoch_times = [
+            int(feedback_id.rsplit('_', 1)[-1]) for feedback_id in cached_feedback.raw_data['feedback']
+            if feedback_id.rsplit('_', 1)[-1].isdigit()
+        ]
+        if epoch_times:
+            sync_params = {'params': {'since': max(epoch_times) - FEEDBACK_SYNC_OVERLAP_SECONDS}}
+    return sync_params
+
+
+def _merge_feedback(cached_feedback, raw_data):
+    # servers without support for `since` send the whole history again,
+    # which merging by feedback id deduplicates
+    merged_raw_data = raw_data
+    if isinstance(raw_data, dict):
+        merged_raw_feedback = {**cached_feedback.raw_data['feedback'], **raw_data.get('feedback', {})}
+        merged_raw_data = {**raw_data, 'feedback': merged_raw_feedback}
+    return merged_raw_data
+
+
 def _get_cached_feedback(submission_id, developer_key):
     filename = _get_cached_feedback_filename(submission_id)
     try:
         feedback = utils._load_from_cache(filename)
+        utils.get_cache_stats().record_hit('feedback')
     except FileNotFoundError:
-        feedback = _get_latest_feedback(submission_id, developer_key)
+        with utils.cache_lock(filename):
+            try:
+                feedback = utils._load_from_cache(filename)
+                utils.get_cache_stats().record_hit('feedback')
+            except FileNotFoundError:
+                feedback = _get_latest_feedback(submission_id, developer_key)
     return feedback
 
 
+async def _get_cached_feedback_async(submission_id, developer_key):
+    filename = _get_cached_feedback_filename(submission_id)
+    try:
+        feedback = await asyncio.get_running_loop().run_in_executor(None, utils._load_from_cache, filename)
+        utils.get_cache_stats().record_hit('feedback')
+    except FileNotFoundError:
+        feedback = await _get_latest_feedback_async(submission_id, developer_key)
+    return feedback
+
+
+def _load_cached_feedback(filename):
+    try:
+        feedback = utils._load_from_cache(filename)
+    except FileNotFoundError:
+        feedback = None
+    return feedback
+
+
+def _get_revalidated_response(cached_feedback):
+    has_validators = cached_feedback is not None and cached_feedback.cached_response.has_validators
+    return cached_feedback.cached_response if has_validators else None
+
+
+def _get_feedback_tables_dir(submission_id):
+    return os.path.join(utils.guanaco_data_dir(), 'cache', 'feedback_tables', submission_id)
+
+
 def _get_cached_feedback_filename(submission_id):
     return Path(utils.guanaco_data_dir()) / 'cache' / f'{submission_id}.pkl'
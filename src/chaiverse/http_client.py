@@ -1,47 +1,630 @@
+from http.cookiejar import DefaultCookiePolicy
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
 import requests
+from requests.adapters import HTTPAdapter
 
 from chaiverse.login_cli import auto_authenticate
 from chaiverse.config import BASE_SUBMITTER_URL, BASE_FEEDBACK_URL
-from chaiverse.utils import get_url
+from chaiverse.constants import DEFAULT_SESSION_POOL_SIZE, STREAM_CHUNK_SIZE
+from chaiverse.lib import json_tools, rate_limit_tools
+from chaiverse.lib.json_tools import stream_json_mapping
+from chaiverse.utils import CachedResponse, get_hexdigest, get_url, guanaco_data_dir
+
+
+class SessionPool():
+    """
+    Process-wide pool of keep-alive sessions, one per hostname.
+
+    Sessions are created lazily and shared between threads, each one holding
+    up to `pool_size` open connections so that concurrent workers reuse TCP
+    and TLS connections instead of opening a new one for every request.
+    """
+    def __init__(self, pool_size=DEFAULT_SESSION_POOL_SIZE):
+        self.pool_size = pool_size
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get_session(self, hostname):
+        key = _get_host_key(hostname)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._create_session()
+                self._sessions[key] = session
+        return session
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _create_session(self):
+        session = requests.Session()
+        # sessions are shared between developer keys, so cookies must not persist
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+
+_default_session_pool = SessionPool()
+
+
+def get_default_session_pool():
+    return _default_session_pool
+
+
+def set_default_session_pool(session_pool):
+    global _default_session_pool
+    previous_session_pool = _default_session_pool
+    _default_session_pool = session_pool
+    return previous_session_pool
+
+
+def _reset_default_session_pool_after_fork():
+    # connections inherited from the parent process must not be shared with it
+    global _default_session_pool
+    _default_session_pool = SessionPool(_default_session_pool.pool_size)
+
+
+def _get_host_key(hostname):
+    parsed = urlparse(hostname)
+    return parsed.netloc or hostname
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_default_session_pool_after_fork)
+
+
+RETRYABLE_STATUS_CODES = (429, 502, 503, 504)
+# status codes for which the server guarantees the request was not processed
+UNPROCESSED_STATUS_CODES = (429, 503)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+
+class RetryPolicy():
+    """
+    Decides whether a failed request should be retried and how long to wait.
+
+    Waits follow exponential backoff with full jitter, capped at `backoff_max`
+    seconds, and retrying stops after `max_attempts` attempts or once the
+    next wait would exceed the `deadline` (in seconds since the first attempt).
+    Non-idempotent requests are only retried when the server cannot have
+    processed them.
+    """
+    def __init__(
+            self,
+            max_attempts=4,
+            backoff_base=0.5,
+            backoff_max=8.0,
+            deadline=60.0,
+            retryable_status_codes=RETRYABLE_STATUS_CODES,
+            retryable_exceptions=(requests.ConnectionError, requests.Timeout),
+            unprocessed_exceptions=(requests.ConnectTimeout,)):
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self.retryable_status_codes = retryable_status_codes
+        self.retryable_exceptions = retryable_exceptions
+        self.unprocessed_exceptions = unprocessed_exceptions
+
+    def is_retryable_status(self, method, status_code):
+        retryable = status_code in self.retryable_status_codes
+        if method.upper() not in IDEMPOTENT_METHODS:
+            retryable = retryable and status_code in UNPROCESSED_STATUS_CODES
+        return retryable
+
+    def is_retryable_exception(self, method, exception):
+        is_idempotent = method.upper() in IDEMPOTENT_METHODS
+        retryable_exceptions = self.retryable_exceptions if is_idempotent else self.unprocessed_exceptions
+        return isinstance(exception, retryable_exceptions)
+
+    def get_delay(self, attempt, elapsed, retry_after=None):
+        delay = None
+        if attempt + 1 < self.max_attempts:
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, self.backoff_max))
+            delay = delay if elapsed + delay <= self.deadline else None
+        return delay
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+NO_RETRY_POLICY = RetryPolicy(max_attempts=1)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker():
+    """
+    Fails fast while a host keeps failing.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    requests raise `CircuitOpenError` without touching the network. Once
+    `reset_timeout` seconds have passed a single trial request is let
+    through, closing the circuit again if it succeeds.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failure_count = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        state = 'closed'
+        if self._opened_at is not None:
+            is_cooling_down = time.monotonic() - self._opened_at < self.reset_timeout
+            state = 'open' if is_cooling_down or self._trial_in_flight else 'half-open'
+        return state
+
+    def before_request(self):
+        with self._lock:
+            state = self.state
+            if state == 'open':
+                raise CircuitOpenError(f'Circuit open after {self._failure_count} consecutive failures')
+            if state == 'half-open':
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self._failure_count = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failure_count += 1
+            if self._failure_count >= self.failure_threshold or self._trial_in_flight:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def cancel_trial(self):
+        with self._lock:
+            self._trial_in_flight = False
+
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(hostname):
+    key = _get_host_key(hostname)
+    with _circuit_breakers_lock:
+        circuit_breaker = _circuit_breakers.get(key)
+        if circuit_breaker is None:
+            circuit_breaker = CircuitBreaker()
+            _circuit_breakers[key] = circuit_breaker
+    return circuit_breaker
+
+
+def reset_circuit_breakers():
+    with _circuit_breakers_lock:
+        _circuit_breakers.clear()
+
+
+def _record_status(circuit_breaker, status_code):
+    if status_code >= 500:
+        circuit_breaker.record_failure()
+    else:
+        circuit_breaker.record_success()
+
+
+def _get_retry_delay(retry_policy, attempt, start_time, retry_after=None):
+    elapsed = time.monotonic() - start_time
+    return retry_policy.get_delay(attempt, elapsed, retry_after)
+
+
+def _get_retry_after(headers):
+    retry_after = headers.get('Retry-After')
+    try:
+        retry_after = float(retry_after) if retry_after is not None else None
+    except ValueError:
+        retry_after = None
+    return retry_after
+
+
+class SingleFlight():
+    """
+    Coalesces identical concurrent calls: while a call for `key` is in
+    flight, other threads asking for the same key wait for it and receive
+    its result (or exception) instead of repeating the work. The result
+    object is shared between all callers.
+    """
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+        if is_leader:
+            try:
+                call.result = func()
+            except BaseException as ex:
+                call.exception = ex
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+        if call.exception is not None:
+            raise call.exception
+        return call.result
+
+
+class _Call():
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+_single_flight = SingleFlight()
+
+
+def _get_request_key(method, url, developer_key, **kwargs):
+    developer_key_hash = get_hexdigest(developer_key or '')
+    return f'{method} {url} {developer_key_hash} {sorted(kwargs.items())!r}'
+
+
+def configure_rate_limit(hostname, rate, burst=None, endpoint=None, shared=True):
+    """
+    Limits requests to `hostname` (or only to one `endpoint` template on it)
+    to `rate` requests per second with bursts of up to `burst`. Shared limits
+    keep their state in a lock file under the data directory, so they are
+    enforced across all threads and processes of the machine.
+    """
+    key = _get_rate_limit_key(hostname, endpoint)
+    state_path = _get_rate_limit_state_path(key) if shared else None
+    rate_limit_tools.configure_rate_limit(key, rate, burst, state_path)
+
+
+def remove_rate_limit(hostname, endpoint=None):
+    rate_limit_tools.remove_rate_limit(_get_rate_limit_key(hostname, endpoint))
+
+
+def _get_rate_limits(hostname, endpoint=None):
+    keys = {_get_rate_limit_key(hostname), _get_rate_limit_key(hostname, endpoint)}
+    rate_limits = [rate_limit_tools.get_rate_limit(key) for key in sorted(keys)]
+    return [rate_limit for rate_limit in rate_limits if rate_limit]
+
+
+def _get_rate_limit_key(hostname, endpoint=None):
+    return _get_host_key(hostname) + (endpoint or '')
+
+
+def _get_rate_limit_state_path(key):
+    return os.path.join(guanaco_data_dir(), 'rate_limits', f'{get_hexdigest(key)}.lock')
+
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class RequestMetrics():
+    """
+    Thread-safe registry of per-endpoint request statistics.
+
+    Requests are keyed by method and endpoint template (e.g.
+    `FEEDBACK_ENDPOINT`) rather than the formatted URL, so the number of
+    series stays bounded. Latency covers the network round trip of each
+    attempt, while decode time covers turning the response body into Python
+    objects, making it possible to tell the two apart.
+    """
+    def __init__(self, latency_buckets=LATENCY_BUCKETS):
+        self.latency_buckets = tuple(latency_buckets)
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def record_response(self, method, endpoint, status, latency):
+        with self._lock:
+            stats = self._get_stats(method, endpoint)
+            status = str(status)
+            stats['status_codes'][status] = stats['status_codes'].get(status, 0) + 1
+            stats['latency']['count'] += 1
+            stats['latency']['sum'] += latency
+            for i, bucket in enumerate(self.latency_buckets):
+                if latency <= bucket:
+                    stats['latency']['buckets'][i] += 1
+                    break
+
+    def record_decode(self, method, endpoint, response_bytes, decode_time=None):
+        with self._lock:
+            stats = self._get_stats(method, endpoint)
+            stats['response_bytes'] += response_bytes
+            if decode_time is not None:
+                stats['decode_time']['count'] += 1
+                stats['decode_time']['sum'] += decode_time
+
+    def record_retry(self, method, endpoint):
+        with self._lock:
+            self._get_stats(method, endpoint)['retries'] += 1
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+    def as_dict(self):
+        metrics = {}
+        with self._lock:
+            for (method, endpoint), stats in self._endpoints.items():
+                latency = stats['latency']
+                metrics.setdefault(endpoint, {})[method] = {
+                    'requests': latency['count'],
+                    'status_codes': dict(stats['status_codes']),
+                    'retries': stats['retries'],
+                    'response_bytes': stats['response_bytes'],
+                    'latency': {
+                        'count': latency['count'],
+                        'sum': latency['sum'],
+                        'buckets': dict(zip(self.latency_buckets, _accumulate(latency['buckets']))),
+                    },
+                    'decode_time': dict(stats['decode_time']),
+                }
+        return metrics
+
+    def to_prometheus(self):
+        lines = []
+        metrics = self.as_dict()
+        series = [
+            (endpoint, method, stats)
+            for endpoint, methods in sorted(metrics.items())
+            for method, stats in sorted(methods.items())
+        ]
+
+        def add_metric(name, metric_type, description, get_samples):
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for endpoint, method, stats in series:
+                labels = {'endpoint': endpoint, 'method': method}
+                for suffix, extra_labels, value in get_samples(stats):
+                    label_text = _format_prometheus_labels({**labels, **extra_labels})
+                    lines.append(f'{name}{suffix}{{{label_text}}} {_format_prometheus_value(value)}')
+
+        add_metric(
+            'chaiverse_http_requests_total', 'counter', 'Completed request attempts by status code.',
+            lambda stats: [('', {'status': status}, count) for status, count in sorted(stats['status_codes'].items())])
+        add_metric(
+            'chaiverse_http_request_duration_seconds', 'histogram', 'Latency of each request attempt.',
+            _get_latency_samples)
+        add_metric(
+            'chaiverse_http_response_bytes_total', 'counter', 'Response body bytes received.',
+            lambda stats: [('', {}, stats['response_bytes'])])
+        add_metric(
+            'chaiverse_http_decode_duration_seconds', 'summary', 'Time spent decoding response bodies.',
+            lambda stats: [('_sum', {}, stats['decode_time']['sum']), ('_count', {}, stats['decode_time']['count'])])
+        add_metric(
+            'chaiverse_http_retries_total', 'counter', 'Request attempts that were retried.',
+            lambda stats: [('', {}, stats['retries'])])
+        return '\n'.join(lines) + '\n'
+
+    def _get_stats(self, method, endpoint):
+        key = (method.upper(), endpoint or '')
+        stats = self._endpoints.get(key)
+        if stats is None:
+            stats = {
+                'status_codes': {},
+                'retries': 0,
+                'response_bytes': 0,
+                'latency': {'count': 0, 'sum': 0.0, 'buckets': [0] * len(self.latency_buckets)},
+                'decode_time': {'count': 0, 'sum': 0.0},
+            }
+            self._endpoints[key] = stats
+        return stats
+
+
+def _accumulate(counts):
+    total = 0
+    cumulative = []
+    for count in counts:
+        total += count
+        cumulative.append(total)
+    return cumulative
+
+
+def _get_latency_samples(stats):
+    latency = stats['latency']
+    samples = [('_bucket', {'le': _format_prometheus_value(bucket)}, count) for bucket, count in latency['buckets'].items()]
+    samples.append(('_bucket', {'le': '+Inf'}, latency['count']))
+    samples.append(('_sum', {}, latency['sum']))
+    samples.append(('_count', {}, latency['count']))
+    return samples
+
+
+def _format_prometheus_labels(labels):
+    escaped = {
+        name: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        for name, value in labels.items()
+    }
+    return ','.join(f'{name}="{value}"' for name, value in escaped.items())
+
+
+def _format_prometheus_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+_request_metrics = RequestMetrics()
+
+
+def get_request_metrics():
+    return _request_metrics
 
 
 class _ChaiverseHTTPClient():
-    def __init__(self, developer_key=None, hostname=None):
+    def __init__(self, developer_key=None, hostname=None, session_pool=None, retry_policy=None):
         self.developer_key = developer_key
         self.hostname = hostname
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self._session_pool = session_pool
 
     @property
     def headers(self):
         return {"Authorization": f"Bearer {self.developer_key}"}
 
+    @property
+    def session(self):
+        session_pool = self._session_pool or get_default_session_pool()
+        return session_pool.get_session(self.hostname)
+
     def get(self, endpoint, submission_id=None, **kwargs):
         url = get_url(endpoint, hostname=self.hostname, submission_id=submission_id)
-        response = self._request(requests.get, url=url, **kwargs)
+        key = _get_request_key('GET', url, self.developer_key, **kwargs)
+        response = _single_flight.do(key, lambda: self._request('GET', url=url, endpoint=endpoint, **kwargs))
         return response
 
+    def get_conditional(self, endpoint, cached_response=None, submission_id=None, **kwargs):
+        """
+        Revalidates `cached_response` against the server using its ETag /
+        Last-Modified validators. Returns `cached_response` itself when the
+        server replies 304 Not Modified, otherwise a new `CachedResponse`.
+        """
+        url = get_url(endpoint, hostname=self.hostname, submission_id=submission_id)
+        headers = cached_response.conditional_headers if cached_response else {}
+        key = _get_request_key('GET', url, self.developer_key, headers=headers, **kwargs)
+        return _single_flight.do(key, lambda: self._get_conditional(url, endpoint, headers, cached_response, **kwargs))
+
+    def _get_conditional(self, url, endpoint, headers, cached_response, **kwargs):
+        response = self._send_with_retries('GET', url=url, endpoint=endpoint, headers=headers, **kwargs)
+        if response.status_code == 304 and cached_response:
+            return cached_response
+        payload = self._decode(response, 'GET', endpoint)
+        return CachedResponse.from_response(response, payload)
+
+    def stream_mapping(self, endpoint, key, consumer, submission_id=None, **kwargs):
+        """
+        Streams a (gzip or deflate compressed) JSON response, handing each
+        item of the mapping under `key` to `consumer(name, value)` as soon as
+        it is decoded. Returns the remaining top-level fields.
+        """
+        url = get_url(endpoint, hostname=self.hostname, submission_id=submission_id)
+        headers = {'Accept-Encoding': 'gzip, deflate'}
+        response = self._send_with_retries('GET', url=url, endpoint=endpoint, headers=headers, stream=True, **kwargs)
+        try:
+            assert response.status_code == 200, _get_error_detail(response)
+            chunks = response.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+            chunks = _count_chunk_bytes(chunks, 'GET', endpoint)
+            fields = stream_json_mapping(chunks, key, consumer)
+        finally:
+            response.close()
+        return fields
+
     def post(self, endpoint, data, submission_id=None, **kwargs):
         url = get_url(endpoint, hostname=self.hostname, submission_id=submission_id)
-        response = self._request(requests.post, url=url, json=data, **kwargs)
+        headers = {'Content-Type': 'application/json'}
+        response = self._request('POST', url=url, endpoint=endpoint, data=json_tools.dumps(data), headers=headers, **kwargs)
         return response
 
-    def _request(self, func, url, **kwargs):
-        response = func(url=url, headers=self.headers, **kwargs)
-        assert response.status_code == 200, response.json()
-        return response.json()
+    def _request(self, method, url, endpoint=None, **kwargs):
+        response = self._send_with_retries(method, url=url, endpoint=endpoint, **kwargs)
+        return self._decode(response, method, endpoint)
+
+    def _decode(self, response, method='GET', endpoint=None):
+        assert response.status_code == 200, _get_error_detail(response)
+        content = response.content
+        start_time = time.perf_counter()
+        payload = json_tools.loads(content)
+        get_request_metrics().record_decode(method, endpoint, len(content), time.perf_counter() - start_time)
+        return payload
+
+    def _send_with_retries(self, method, url, endpoint=None, headers=None, **kwargs):
+        func = getattr(self.session, method.lower())
+        headers = {**self.headers, **(headers or {})}
+        circuit_breaker = get_circuit_breaker(self.hostname)
+        rate_limits = _get_rate_limits(self.hostname, endpoint)
+        start_time = time.monotonic()
+        attempt = 0
+        while True:
+            circuit_breaker.before_request()
+            for rate_limit in rate_limits:
+                rate_limit.acquire()
+            try:
+                response = _timed_send(func, method, endpoint, url=url, headers=headers, **kwargs)
+            except self.retry_policy.retryable_exceptions as ex:
+                circuit_breaker.record_failure()
+                delay = _get_retry_delay(self.retry_policy, attempt, start_time)
+                if delay is None or not self.retry_policy.is_retryable_exception(method, ex):
+                    raise
+            except Exception:
+                circuit_breaker.cancel_trial()
+                raise
+            else:
+                _record_status(circuit_breaker, response.status_code)
+                if not self.retry_policy.is_retryable_status(method, response.status_code):
+                    return response
+                delay = _get_retry_delay(self.retry_policy, attempt, start_time, _get_retry_after(response.headers))
+                if delay is None:
+                    return response
+                # streamed responses hold their connection until closed
+                response.close()
+            get_request_metrics().record_retry(method, endpoint)
+            time.sleep(delay)
+            attempt += 1
+
+
+def _timed_send(func, method, endpoint, **kwargs):
+    start_time = time.perf_counter()
+    status = 'error'
+    try:
+        response = func(**kwargs)
+        status = response.status_code
+    finally:
+        get_request_metrics().record_response(method, endpoint, status, time.perf_counter() - start_time)
+    return response
+
+
+def _count_chunk_bytes(chunks, method, endpoint):
+    for chunk in chunks:
+        get_request_metrics().record_decode(method, endpoint, len(chunk))
+        yield chunk
+
+
+def _get_error_detail(response):
+    try:
+        detail = response.json()
+    except ValueError:
+        detail = response.text
+    return detail
 
 
 @auto_authenticate
 class SubmitterClient(_ChaiverseHTTPClient):
     def __init__(self,
             developer_key=None,
-            hostname=BASE_SUBMITTER_URL):
-        super().__init__(developer_key, hostname)
+            hostname=BASE_SUBMITTER_URL,
+            session_pool=None,
+            retry_policy=None):
+        super().__init__(developer_key, hostname, session_pool, retry_policy)
 
 
 @auto_authenticate
 class FeedbackClient(_ChaiverseHTTPClient):
     def __init__(self,
             developer_key=None,
-            hostname=BASE_FEEDBACK_URL):
-        super().__init__(developer_key, hostname)
-
+            hostname=BASE_FEEDBACK_URL,
+            session_pool=None,
+            retry_policy=None):
+        super().__init__(developer_key, hostname, session_pool, retry_policy)
@@ -0,0 +1,513 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import hashlib
+import lzma
+import os
+import pickle
+import sqlite3
+import threading
+from time import time, time_ns
+import zlib
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from chaiverse.lib import file_tools, json_tools
+
+
+SQLITE_CACHE_SCHEMA_VERSION = 1
+
+# eviction only needs coarse access times, so recent ones are not rewritten
+SQLITE_CACHE_ATIME_RESOLUTION_NS = 60 * 10 ** 9
+
+# compressed entries start with this magic followed by a one byte codec id,
+# uncompressed entries are plain pickles so that older readers can load them
+CACHE_ENTRY_MAGIC = b'CVC'
+CACHE_CODEC_IDS = {'zlib': 1, 'lzma': 2, 'lz4': 3, 'zstd': 4}
+CACHE_CODEC_NAMES = {codec_id: name for name, codec_id in CACHE_CODEC_IDS.items()}
+
+
+def get_available_cache_codecs():
+    codecs = ['none', 'zlib', 'lzma']
+    codecs += ['lz4'] if lz4 else []
+    codecs += ['zstd'] if zstandard else []
+    return codecs
+
+
+def encode_cache_entry(data, codec='none'):
+    return _encode_cache_entry(data, codec)[0]
+
+
+def decode_cache_entry(blob):
+    return _decode_cache_entry(blob)[0]
+
+
+def _encode_cache_entry(data, codec):
+    # also returns the length of the uncompressed pickle
+    assert codec in get_available_cache_codecs(), f'Unavailable cache codec {codec}, expecting one of {get_available_cache_codecs()}'
+    pickled = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    blob = pickled
+    if codec != 'none':
+        header = CACHE_ENTRY_MAGIC + bytes([CACHE_CODEC_IDS[codec]])
+        blob = header + _compress(pickled, codec)
+    return blob, len(pickled)
+
+
+def _decode_cache_entry(blob):
+    # also returns the length of the uncompressed pickle
+    if blob[:len(CACHE_ENTRY_MAGIC)] == CACHE_ENTRY_MAGIC:
+        codec = CACHE_CODEC_NAMES.get(blob[len(CACHE_ENTRY_MAGIC)])
+        assert codec in get_available_cache_codecs(), f'Cache entry uses an unavailable codec {codec}'
+        blob = _decompress(memoryview(blob)[len(CACHE_ENTRY_MAGIC) + 1:], codec)
+    return pickle.loads(blob), len(blob)
+
+
+def _compress(blob, codec):
+    if codec == 'zlib':
+        compressed = zlib.compress(blob, 6)
+    elif codec == 'lzma':
+        compressed = lzma.compress(blob, preset=1)
+    elif codec == 'lz4':
+        compressed = lz4.frame.compress(blob)
+    else:
+        compressed = zstandard.ZstdCompressor(level=3).compress(blob)
+    return compressed
+
+
+def _decompress(blob, codec):
+    if codec == 'zlib':
+        decompressed = zlib.decompress(blob)
+    elif codec == 'lzma':
+        decompressed = lzma.decompress(blob)
+    elif codec == 'lz4':
+        decompressed = lz4.frame.decompress(blob)
+    else:
+        decompressed = zstandard.ZstdDecompressor().decompress(blob)
+    return decompressed
+
+
+class LRUCache():
+    """
+    Thread-safe least-recently-used cache bounded both by number of entries
+    and by the total `nbytes` reported for the stored values.
+    """
+    def __init__(self, max_bytes, max_entries):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, nbytes):
+        with self._lock:
+            self._pop(key)
+            if nbytes > self.max_bytes or self.max_entries < 1:
+                return
+            self._entries[key] = (value, nbytes)
+            self._nbytes += nbytes
+            while len(self._entries) > self.max_entries or self._nbytes > self.max_bytes:
+                _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+                self._nbytes -= evicted_nbytes
+
+    def pop(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._nbytes -= entry[1]
+
+
+class CacheStats():
+    """
+    Thread-safe counters of cache lookups and I/O, keyed by cache name.
+
+    A lookup is a hit when a fresh entry was used, stale when the entry had
+    expired and a miss when there was no entry at all. Bytes read and load
+    time only count entries loaded from the backend, reads served from the
+    memory tier are counted as `memory_hits`.
+
+    Counts are kept for this process and, when `get_path` is given, merged
+    into the JSON file it returns by `flush`, at most every
+    `flush_interval` seconds while recording, so that other processes can
+    read them with `read_cache_stats`.
+    """
+    def __init__(self, get_path=None, flush_interval=None):
+        self.get_path = get_path
+        self.flush_interval = flush_interval
+        self._caches = {}
+        self._pending = {}
+        self._flushed_at = time()
+        self._lock = threading.Lock()
+
+    def record_hit(self, name):
+        self._increment(name, 'hits')
+
+    def record_stale(self, name):
+        self._increment(name, 'stale')
+
+    def record_miss(self, name):
+        self._increment(name, 'misses')
+
+    def record_memory_hit(self, name):
+        self._increment(name, 'memory_hits')
+
+    def record_read(self, name, nbytes, load_time):
+        with self._lock:
+            for caches in (self._caches, self._pending):
+                stats = _get_cache_stats(caches, name)
+                stats['bytes_read'] += nbytes
+                stats['load_time']['count'] += 1
+                stats['load_time']['sum'] += load_time
+        self._flush_if_due()
+
+    def record_write(self, name, nbytes):
+        self._increment(name, 'bytes_written', nbytes)
+
+    def reset(self):
+        with self._lock:
+            self._caches.clear()
+            self._pending.clear()
+
+    def as_dict(self):
+        with self._lock:
+            return _copy_cache_stats(self._caches)
+
+    def flush(self):
+        if self.get_path is None:
+            return
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._flushed_at = time()
+        if pending:
+            path = self.get_path()
+            with file_tools.file_lock(f'{path}.lock'):
+                stored = read_cache_stats(path)
+                _merge_cache_stats(stored, pending)
+                file_tools.write_file_atomically(path, json_tools.dumps(stored))
+
+    def _increment(self, name, counter, amount=1):
+        with self._lock:
+            for caches in (self._caches, self._pending):
+                _get_cache_stats(caches, name)[counter] += amount
+        self._flush_if_due()
+
+    def _flush_if_due(self):
+        if self.flush_interval is not None and time() - self._flushed_at >= self.flush_interval:
+            try:
+                self.flush()
+            except OSError:
+                # counters must never break the caching they describe
+                pass
+
+
+def read_cache_stats(path):
+    """
+    Reads the counts that `CacheStats.flush` stored at `path`, in the form
+    of `CacheStats.as_dict`.
+    """
+    try:
+        with open(path, 'rb') as f:
+            stored = json_tools.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        stored = {}
+    caches = {}
+    _merge_cache_stats(caches, stored)
+    return caches
+
+
+def _get_cache_stats(caches, name):
+    stats = caches.get(name)
+    if stats is None:
+        stats = {
+            'hits': 0,
+            'stale': 0,
+            'misses': 0,
+            'memory_hits': 0,
+            'bytes_read': 0,
+            'bytes_written': 0,
+            'load_time': {'count': 0, 'sum': 0.0},
+        }
+        caches[name] = stats
+    return stats
+
+
+def _merge_cache_stats(caches, other_caches):
+    for name, other_stats in other_caches.items():
+        stats = _get_cache_stats(caches, name)
+        for counter, value in other_stats.items():
+            if counter == 'load_time':
+                stats['load_time']['count'] += value['count']
+                stats['load_time']['sum'] += value['sum']
+            elif counter in stats:
+                stats[counter] += value
+
+
+def _copy_cache_stats(caches):
+    return {name: {**stats, 'load_time': dict(stats['load_time'])} for name, stats in caches.items()}
+
+
+@dataclass(frozen=True)
+class CacheEntryInfo:
+    key: str
+    mtime_ns: int
+    atime_ns: int
+    size: int
+
+    @property
+    def mtime(self):
+        return self.mtime_ns / 1e9
+
+    @property
+    def version(self):
+        # changes whenever the entry is rewritten or refreshed
+        return self.mtime_ns, self.size
+
+
+class CacheFileLocks():
+    """
+    One advisory lock file per cache key in `lock_dir`, so that refreshes
+    of unrelated keys never wait on each other. Lock files of keys that are
+    no longer stored are removed with `remove_unused_lock_files`.
+    """
+    def __init__(self, lock_dir):
+        self.lock_dir = lock_dir
+
+    def lock(self, key):
+        return file_tools.file_lock(os.path.join(self.lock_dir, self._get_lock_name(key)))
+
+    def remove_unused_lock_files(self, keys):
+        # held locks are skipped, which keeps the lock of an entry being written
+        lock_names = {self._get_lock_name(key) for key in keys}
+        try:
+            stored_lock_names = os.listdir(self.lock_dir)
+        except FileNotFoundError:
+            stored_lock_names = []
+        for lock_name in stored_lock_names:
+            if lock_name.endswith('.lock') and lock_name not in lock_names:
+                file_tools.remove_lock_file(os.path.join(self.lock_dir, lock_name))
+
+    def _get_lock_name(self, key):
+        return f'{hashlib.md5(os.path.abspath(key).encode("UTF-8")).hexdigest()}.lock'
+
+
+class PickleCacheBackend():
+    """
+    Stores every cache entry as its own pickle file, the key being the file
+    path. Access times order entries for eviction while modification times
+    track freshness. Entries are written with `codec` and read with whichever
+    codec their header names. `load` and `save` also return the length of
+    the uncompressed pickle, which approximates the size of the data in
+    memory.
+    """
+    def __init__(self, codec='none'):
+        self.codec = codec
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def get_info(self, key):
+        stat = os.stat(key)
+        return CacheEntryInfo(key, stat.st_mtime_ns, stat.st_atime_ns, stat.st_size)
+
+    def load(self, key):
+        with open(key, 'rb') as f:
+            return _decode_cache_entry(f.read())
+
+    def save(self, key, data, codec=None):
+        blob, nbytes = _encode_cache_entry(data, codec or self.codec)
+        file_tools.write_file_atomically(key, blob)
+        return self.get_info(key), nbytes
+
+    def mark_access(self, key, info):
+        try:
+            file_tools.mark_file_access(key)
+        except OSError:
+            pass
+
+    def touch(self, key):
+        file_tools.touch_file(key)
+        return self.get_info(key)
+
+    def lock(self, key):
+        return self._get_locks(os.path.dirname(key)).lock(key)
+
+    def list_entries(self, cache_dir):
+        entries = []
+        try:
+            with os.scandir(cache_dir) as it:
+                for entry in it:
+                    if entry.name.endswith('.pkl') and entry.is_file():
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append(CacheEntryInfo(entry.path, stat.st_mtime_ns, stat.st_atime_ns, stat.st_size))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def prune(self, max_bytes, cache_dir):
+        entries = self.list_entries(cache_dir)
+        total_bytes = sum(entry.size for entry in entries)
+        removed = []
+        for entry in sorted(entries, key=lambda entry: entry.atime_ns):
+            if total_bytes <= max_bytes:
+                break
+            try:
+                os.remove(entry.key)
+            except FileNotFoundError:
+                continue
+            total_bytes -= entry.size
+            removed.append(entry)
+        removed_keys = {entry.key for entry in removed}
+        self._get_locks(cache_dir).remove_unused_lock_files([entry.key for entry in entries if entry.key not in removed_keys])
+        return removed
+
+    def _get_locks(self, cache_dir):
+        # lock files live next to the entries they guard
+        lock_dir = os.path.join(os.path.abspath(cache_dir), 'locks')
+        with self._locks_lock:
+            locks = self._locks.get(lock_dir)
+            if locks is None:
+                locks = CacheFileLocks(lock_dir)
+                self._locks[lock_dir] = locks
+        return locks
+
+
+class SQLiteCacheBackend():
+    """
+    Stores all cache entries as rows of a single indexed SQLite database,
+    so that freshness lookups and eviction are queries rather than a stat
+    of every file. Keys keep the form of the pickle file paths, which lets
+    callers scope listings and pruning by directory prefix.
+    """
+    def __init__(self, db_path, codec='none'):
+        self.db_path = db_path
+        self.codec = codec
+        self._local = threading.local()
+        self._locks = CacheFileLocks(f'{db_path}.locks')
+
+    def get_info(self, key):
+        row = self._execute(
+            'SELECT mtime_ns, atime_ns, size FROM cache_entries WHERE key = ? AND schema_version = ?',
+            (key, SQLITE_CACHE_SCHEMA_VERSION)).fetchone()
+        if row is None:
+            raise FileNotFoundError(key)
+        return CacheEntryInfo(key, *row)
+
+    def load(self, key):
+        row = self._execute(
+            'SELECT blob FROM cache_entries WHERE key = ? AND schema_version = ?',
+            (key, SQLITE_CACHE_SCHEMA_VERSION)).fetchone()
+        if row is None:
+            raise FileNotFoundError(key)
+        return _decode_cache_entry(row[0])
+
+    def save(self, key, data, codec=None):
+        blob, nbytes = _encode_cache_entry(data, codec or self.codec)
+        now = time_ns()
+        self._execute(
+            'INSERT OR REPLACE INTO cache_entries (key, blob, mtime_ns, atime_ns, size, schema_version) VALUES (?, ?, ?, ?, ?, ?)',
+            (key, blob, now, now, len(blob), SQLITE_CACHE_SCHEMA_VERSION))
+        return CacheEntryInfo(key, now, now, len(blob)), nbytes
+
+    def mark_access(self, key, info):
+        now = time_ns()
+        if now - info.atime_ns >= SQLITE_CACHE_ATIME_RESOLUTION_NS:
+            self._execute('UPDATE cache_entries SET atime_ns = ? WHERE key = ?', (now, key))
+
+    def touch(self, key):
+        now = time_ns()
+        cursor = self._execute('UPDATE cache_entries SET mtime_ns = ?, atime_ns = ? WHERE key = ?', (now, now, key))
+        if cursor.rowcount == 0:
+            raise FileNotFoundError(key)
+        return self.get_info(key)
+
+    def lock(self, key):
+        return self._locks.lock(key)
+
+    def list_entries(self, cache_dir):
+        prefix = os.path.join(cache_dir, '')
+        rows = self._execute(
+            'SELECT key, mtime_ns, atime_ns, size FROM cache_entries WHERE substr(key, 1, ?) = ?',
+            (len(prefix), prefix)).fetchall()
+        return [CacheEntryInfo(*row) for row in rows]
+
+    def prune(self, max_bytes, cache_dir):
+        prefix = os.path.join(cache_dir, '')
+        connection = self._get_connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            rows = connection.execute(
+                """
+                SELECT key, mtime_ns, atime_ns, size FROM (
+                    SELECT key, mtime_ns, atime_ns, size, SUM(size) OVER (ORDER BY atime_ns DESC, key) AS newer_bytes
+                    FROM cache_entries WHERE substr(key, 1, ?) = ?
+                ) WHERE newer_bytes > ?
+                """,
+                (len(prefix), prefix, max_bytes)).fetchall()
+            connection.executemany('DELETE FROM cache_entries WHERE key = ?', [(row[0],) for row in rows])
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        keys = [row[0] for row in self._execute('SELECT key FROM cache_entries').fetchall()]
+        self._locks.remove_unused_lock_files(keys)
+        return [CacheEntryInfo(*row) for row in rows]
+
+    def _execute(self, query, params=()):
+        return self._get_connection().execute(query, params)
+
+    def _get_connection(self):
+        # sqlite connections can be shared neither across threads nor forked processes
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # in WAL mode this only risks losing the latest commits on power loss
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY,
+                    blob BLOB NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    atime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    schema_version INTEGER NOT NULL
+                )
+                """)
+            connection.execute('CREATE INDEX IF NOT EXISTS cache_entries_atime ON cache_entries (atime_ns)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
@@ -8,12 +8,17 @@ UTC = pytz.timezone('UTC')
 
 
 def is_epoch_time_in_date_range(epoch_time, date_range):
-    start_epoch_time = _get_date_range_field(date_range, 'start_date') or 0
-    end_epoch_time = _get_date_range_field(date_range, 'end_date') or float('inf')
+    start_epoch_time, end_epoch_time = get_epoch_time_range(date_range)
     is_in = start_epoch_time < epoch_time < end_epoch_time
     return is_in
 
 
+def get_epoch_time_range(date_range):
+    start_epoch_time = _get_date_range_field(date_range, 'start_date') or 0
+    end_epoch_time = _get_date_range_field(date_range, 'end_date') or float('inf')
+    return start_epoch_time, end_epoch_time
+
+
 def us_pacific_string(date_string):
     return _create_date_string_in_timezone(date_string, US_PACIFIC)
 
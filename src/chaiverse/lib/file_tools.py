@@ -0,0 +1,123 @@
+from contextlib import contextmanager
+import os
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # advisory locks are unavailable on Windows, where locking is per process only
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Holds an exclusive advisory lock on `path` (created if missing) for the
+    duration of the block and yields the open file, so that the lock file
+    itself can carry small pieces of shared state.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    f = _open_locked_file(path)
+    with f:
+        try:
+            f.seek(0)
+            yield f
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def remove_lock_file(path):
+    """
+    Removes the lock file at `path` unless it is held. Returns whether the
+    file was removed.
+    """
+    try:
+        f = open(path, 'r')
+    except FileNotFoundError:
+        return False
+    with f:
+        if fcntl:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def mark_file_access(path):
+    """
+    Sets the access time of `path` to now, keeping its modification time.
+    Times are read and written through one descriptor, so a file replaced
+    meanwhile is left untouched, and the update is skipped while another
+    process changes the file's times.
+    """
+    _update_file_times(path, blocking=False, update_mtime=False)
+
+
+def touch_file(path):
+    """
+    Sets both the access and the modification time of `path` to now.
+    """
+    _update_file_times(path, blocking=True, update_mtime=True)
+
+
+def _update_file_times(path, blocking, update_mtime):
+    if not fcntl or os.utime not in os.supports_fd:
+        mtime_ns = time.time_ns() if update_mtime else os.stat(path).st_mtime_ns
+        os.utime(path, ns=(time.time_ns(), mtime_ns))
+        return
+    with open(path, 'rb') as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return
+        now = time.time_ns()
+        mtime_ns = now if update_mtime else os.fstat(f.fileno()).st_mtime_ns
+        os.utime(f.fileno(), ns=(now, mtime_ns))
+
+
+def _open_locked_file(path):
+    while True:
+        f = open(path, 'a+')
+        if not fcntl:
+            return f
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        # the file may have been removed by `remove_lock_file` while waiting,
+        # in which case the lock no longer excludes anyone
+        try:
+            is_current = os.stat(path).st_ino == os.fstat(f.fileno()).st_ino
+        except FileNotFoundError:
+            is_current = False
+        if is_current:
+            return f
+        f.close()
+
+
+def read_locked_file(f):
+    f.seek(0)
+    return f.read()
+
+
+def write_locked_file(f, text):
+    f.seek(0)
+    f.truncate()
+    f.write(text)
+    f.flush()
+
+
+def write_file_atomically(path, data):
+    # readers must never see a partially written file, so write aside and rename
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
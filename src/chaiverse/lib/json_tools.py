@@ -0,0 +1,147 @@
+import codecs
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+WHITESPACE = ' \t\n\r'
+
+
+class StdlibJSONCodec():
+    name = 'json'
+
+    def dumps(self, obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec():
+    name = 'orjson'
+
+    def dumps(self, obj):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+_json_codec = OrjsonCodec() if orjson else StdlibJSONCodec()
+
+
+def get_json_codec():
+    return _json_codec
+
+
+def set_json_codec(codec):
+    """
+    Replaces the codec used by `dumps` / `loads`, returning the previous one.
+    A codec is any object with `dumps(obj) -> bytes` and `loads(bytes | str)`.
+    """
+    global _json_codec
+    previous_codec = _json_codec
+    _json_codec = codec
+    return previous_codec
+
+
+def dumps(obj):
+    return _json_codec.dumps(obj)
+
+
+def loads(data):
+    return _json_codec.loads(data)
+
+
+def stream_json_mapping(chunks, key, consumer):
+    """
+    Incrementally decodes a JSON object read from `chunks` (an iterable of
+    bytes) and passes every `(name, value)` pair of the mapping stored under
+    the top-level `key` to `consumer`, one at a time. Only a single value of
+    that mapping is held in memory at once. Returns the remaining top-level
+    fields as a dict.
+    """
+    reader = _JSONStreamReader(chunks)
+    fields = {}
+    reader.expect('{')
+    for name in reader.iter_object_keys():
+        if name == key:
+            reader.expect('{')
+            for item_name in reader.iter_object_keys():
+                consumer(item_name, reader.read_value())
+        else:
+            fields[name] = reader.read_value()
+    return fields
+
+
+class _JSONStreamReader():
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json_decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._exhausted = False
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise json.JSONDecodeError(f'Expecting {char!r}', self._buffer, self._pos)
+        self._pos += 1
+
+    def peek(self):
+        self._skip_whitespace()
+        while self._pos >= len(self._buffer):
+            if not self._fill():
+                raise json.JSONDecodeError('Unexpected end of stream', self._buffer, self._pos)
+            self._skip_whitespace()
+        return self._buffer[self._pos]
+
+    def iter_object_keys(self):
+        # assumes the opening brace has been consumed, stops after the closing one
+        if self.peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            name = self.read_value()
+            self.expect(':')
+            yield name
+            separator = self.peek()
+            self._pos += 1
+            if separator == '}':
+                return
+            if separator != ',':
+                raise json.JSONDecodeError("Expecting ',' delimiter", self._buffer, self._pos - 1)
+
+    def read_value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(self._buffer, self._pos)
+                # a number may continue in the next chunk
+                is_complete = end < len(self._buffer) or self._exhausted
+            except json.JSONDecodeError:
+                is_complete = False
+                if self._exhausted:
+                    raise
+            if is_complete:
+                self._pos = end
+                return value
+            self._fill()
+
+    def _skip_whitespace(self):
+        buffer, pos = self._buffer, self._pos
+        while pos < len(buffer) and buffer[pos] in WHITESPACE:
+            pos += 1
+        self._pos = pos
+
+    def _fill(self):
+        chunk = next(self._chunks, None)
+        self._exhausted = chunk is None
+        text = self._decoder.decode(chunk or b'', final=self._exhausted)
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+        return not self._exhausted
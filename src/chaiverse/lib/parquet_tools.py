@@ -0,0 +1,51 @@
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from chaiverse.lib import file_tools
+
+
+def is_parquet_available():
+    return pq is not None
+
+
+def write_parquet_table(path, columns, column_types):
+    """
+    Atomically writes `columns`, a dict of equally long lists, as a Parquet
+    file. `column_types` maps every column to one of `object` (strings),
+    `category` (dictionary encoded strings), `bool`, `int32` or `int64`.
+    """
+    _assert_parquet_available()
+    schema = pa.schema([(column, _get_arrow_type(column_type)) for column, column_type in column_types.items()])
+    table = pa.Table.from_pydict(columns, schema=schema)
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink)
+    file_tools.write_file_atomically(path, sink.getvalue().to_pybytes())
+
+
+def read_parquet_table(path, columns=None):
+    """
+    Reads a Parquet file through a memory map, decoding only `columns`
+    (every column when None). Returns a `pyarrow.Table`.
+    """
+    _assert_parquet_available()
+    return pq.read_table(path, columns=columns, memory_map=True)
+
+
+def _get_arrow_type(column_type):
+    arrow_types = {
+        'object': pa.string(),
+        'category': pa.dictionary(pa.int32(), pa.string()),
+        'bool': pa.bool_(),
+        'int32': pa.int32(),
+        'int64': pa.int64(),
+    }
+    assert column_type in arrow_types, f'Unsupported column type {column_type}, expecting one of {list(arrow_types)}'
+    return arrow_types[column_type]
+
+
+def _assert_parquet_available():
+    assert pq is not None, 'Columnar feedback tables need pyarrow, install it with `pip install pyarrow`'
@@ -0,0 +1,93 @@
+import threading
+import time
+
+from chaiverse.lib import file_tools
+
+
+class TokenBucket():
+    """
+    Token bucket allowing `rate` requests per second with bursts of up to
+    `burst` requests. When `state_path` is given the bucket state lives in
+    that lock file, so every thread and process using the same path shares
+    a single budget.
+    """
+    def __init__(self, rate, burst=None, state_path=None):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.state_path = state_path
+        self._tokens = self.burst
+        self._updated_at = time.time()
+        self._lock = threading.Lock()
+
+    @property
+    def config(self):
+        return dict(rate=self.rate, burst=self.burst, state_path=self.state_path)
+
+    def acquire(self):
+        wait = self.try_acquire()
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.try_acquire()
+
+    def try_acquire(self):
+        """
+        Takes a token if one is available and returns 0, otherwise returns
+        the number of seconds to wait before trying again.
+        """
+        with self._lock:
+            if self.state_path:
+                with file_tools.file_lock(self.state_path) as f:
+                    tokens, updated_at = self._parse_state(file_tools.read_locked_file(f))
+                    wait, tokens, updated_at = self._take_token(tokens, updated_at)
+                    file_tools.write_locked_file(f, f'{tokens} {updated_at}')
+            else:
+                wait, self._tokens, self._updated_at = self._take_token(self._tokens, self._updated_at)
+        return wait
+
+    def _take_token(self, tokens, updated_at):
+        now = time.time()
+        tokens = min(self.burst, tokens + max(0, now - updated_at) * self.rate)
+        wait = 0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        return wait, tokens, now
+
+    def _parse_state(self, state):
+        try:
+            tokens, updated_at = state.split()
+            tokens, updated_at = float(tokens), float(updated_at)
+        except ValueError:
+            tokens, updated_at = self.burst, time.time()
+        return tokens, updated_at
+
+
+_rate_limits = {}
+_rate_limits_lock = threading.Lock()
+
+
+def configure_rate_limit(key, rate, burst=None, state_path=None):
+    with _rate_limits_lock:
+        _rate_limits[key] = TokenBucket(rate, burst, state_path)
+
+
+def remove_rate_limit(key):
+    with _rate_limits_lock:
+        _rate_limits.pop(key, None)
+
+
+def get_rate_limit(key):
+    return _rate_limits.get(key)
+
+
+def get_rate_limit_config():
+    with _rate_limits_lock:
+        return {key: bucket.config for key, bucket in _rate_limits.items()}
+
+
+def set_rate_limit_config(config):
+    # used as process pool initializer so that spawned workers share the limits
+    with _rate_limits_lock:
+        _rate_limits.clear()
+        _rate_limits.update({key: TokenBucket(**bucket_config) for key, bucket_config in config.items()})
@@ -1,9 +1,11 @@
 import functools
 import inspect
 import os
+import time
 
 import click
 
+from chaiverse import constants, utils
 from chaiverse.utils import guanaco_data_dir
 
 
@@ -25,6 +27,63 @@ def logout():
     print('Logged out!')
 
 
+@cli.group(name='cache')
+def cache_cli():
+    pass
+
+
+@cache_cli.command()
+@click.option('--max-bytes', type=int, default=None, help='Cache size to prune down to, defaults to GUANACO_CACHE_MAX_BYTES.')
+def prune(max_bytes):
+    removed_count, removed_bytes = utils.prune_cache(max_bytes)
+    print(f'Removed {removed_count} cache entries ({removed_bytes / 1024 ** 2:.1f} MB)')
+
+
+@cache_cli.command()
+def stats():
+    usage = utils.get_cache_usage()
+    counters = utils.get_stored_cache_stats()
+    for name in sorted(set(usage) | set(counters)):
+        cache_usage = usage.get(name, {'entries': 0, 'bytes': 0, 'expired': 0})
+        line = f'{name}: {cache_usage["entries"]} entries ({cache_usage["bytes"] / 1024 ** 2:.1f} MB), {cache_usage["expired"]} expired'
+        if name in counters:
+            cache_counters = counters[name]
+            load_time = cache_counters['load_time']
+            mean_load_ms = 1000 * load_time['sum'] / load_time['count'] if load_time['count'] else 0
+            line += (
+                f', {cache_counters["hits"]} hits, {cache_counters["stale"]} stale, {cache_counters["misses"]} misses'
+                f', {cache_counters["memory_hits"]} memory hits'
+                f', {cache_counters["bytes_read"] / 1024 ** 2:.1f} MB read, {cache_counters["bytes_written"] / 1024 ** 2:.1f} MB written'
+                f', {load_time["count"]} loads averaging {mean_load_ms:.1f} ms'
+            )
+        print(line)
+    total_bytes = sum(cache_usage['bytes'] for cache_usage in usage.values())
+    print(f'Total: {total_bytes / 1024 ** 2:.1f} MB of {utils.CACHE_MAX_BYTES / 1024 ** 2:.1f} MB')
+
+
+@cache_cli.command()
+@click.option('--submission-id', 'submission_ids', multiple=True, help='Submission to warm, defaults to every submission on the leaderboard.')
+@click.option('--max-workers', type=int, default=constants.DEFAULT_SESSION_POOL_SIZE, help='Number of concurrent downloads.')
+def warm(submission_ids, max_workers):
+    # feedback depends on this module for authentication
+    from chaiverse.feedback import warm_feedback_cache
+    results = warm_feedback_cache(submission_ids or None, max_workers=max_workers)
+    failures = {submission_id: result for submission_id, result in results.items() if isinstance(result, Exception)}
+    print(f'Refreshed feedback of {len(results) - len(failures)} submissions')
+    for submission_id, error in failures.items():
+        print(f'Failed to refresh feedback of {submission_id}: {error}')
+    if failures:
+        raise SystemExit(1)
+
+
+@cache_cli.command(name='ls')
+def list_entries():
+    now = time.time()
+    for entry in utils.list_cache_entries():
+        age_hours = (now - entry.mtime) / 3600
+        print(f'{entry.size:>12}  {age_hours:>8.1f}h  {utils._get_cache_name(entry.key):<24}  {os.path.basename(entry.key)}')
+
+
 def developer_login():
     cached_key_path = _get_cached_key_path()
     text = f"""Welcome to Chaiverse 🚀!
@@ -10,11 +10,16 @@ from chaiverse.metrics.conversation_metrics import ConversationMetrics
 
 
 class FeedbackMetrics():
-    def __init__(self, feedback_data):
-        feedback_dict = feedback_data['feedback']
+    def __init__(self, feedback_data=None):
+        feedback_dict = feedback_data['feedback'] if feedback_data else {}
         feedback_dict = _insert_server_epoch_time(feedback_dict)
         self.feedbacks = list(feedback_dict.values())
 
+    def add_feedback(self, feedback_id, feedback):
+        # streaming consumer for chaiverse.feedback.stream_feedback
+        feedback = _insert_server_epoch_time({feedback_id: feedback})[feedback_id]
+        self.feedbacks.append(feedback)
+
     def filter_duplicated_uid(self):
         self.feedbacks = _filter_duplicated_uid_feedbacks(self.feedbacks)
 
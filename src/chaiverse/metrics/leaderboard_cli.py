@@ -25,6 +25,7 @@ def display_leaderboard(
     regenerate=False,
     detailed=False,
     max_workers=constants.DEFAULT_MAX_WORKERS,
+    stale_while_revalidate=False,
 ):
     default_competition = {
         'id': 'Default',
@@ -40,6 +41,7 @@ def display_leaderboard(
         regenerate=regenerate,
         developer_key=developer_key,
         max_workers=max_workers,
+        stale_while_revalidate=stale_while_revalidate,
     )
     return df
 
@@ -49,7 +51,8 @@ def display_competition_leaderboard(
     detailed=False,
     regenerate=False, 
     developer_key=None,
-    max_workers=constants.DEFAULT_MAX_WORKERS
+    max_workers=constants.DEFAULT_MAX_WORKERS,
+    stale_while_revalidate=False,
 ):
     competition = competition if competition else get_competitions()[-1]
     competition_type = competition.get('type') or 'submission_closed_feedback_round_robin'
@@ -58,10 +61,12 @@ def display_competition_leaderboard(
     submission_date_range = competition.get('submission_date_range')
     evaluation_date_range = competition.get('evaluation_date_range')
     submission_ids = competition.get('submissions')
+    # the leaderboard only tests membership, so any order shares a cache entry
+    submission_ids = sorted(submission_ids) if submission_ids is not None else None
     competition_id = competition.get('id')
     display_title = f'{competition_id} Leaderboard'
 
-    df = cache(get_leaderboard, regenerate)(
+    df = cache(get_leaderboard, regenerate, stale_while_revalidate)(
         developer_key=developer_key,
         max_workers=max_workers,
         submission_date_range=submission_date_range,
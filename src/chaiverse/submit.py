@@ -6,7 +6,8 @@ import time
 from chaiverse import utils
 from chaiverse.login_cli import auto_authenticate
 from chaiverse.http_client import SubmitterClient
-from chaiverse import config
+from chaiverse.async_http_client import AsyncSubmitterClient
+from chaiverse import config, constants
 
 if 'ipykernel' in sys.modules:
     from IPython.core.display import display
@@ -141,6 +142,45 @@ def get_model_info(submission_id, developer_key=None):
     return response
 
 
+@auto_authenticate
+def get_models_info(submission_ids, fields=None, max_workers=constants.DEFAULT_SESSION_POOL_SIZE, developer_key=None):
+    """
+    Fetches the info of many submissions concurrently over pooled
+    connections, returning a dict keyed by submission id. A submission whose
+    request failed maps to the raised exception instead of aborting the
+    batch. When `fields` is given only those keys are kept, so that large
+    entries such as `logs` are dropped as soon as each response is decoded.
+    """
+    http_client = SubmitterClient(developer_key)
+    submission_ids = list(submission_ids)
+    infos = utils.distribute_to_workers(
+        _get_model_info_or_error,
+        submission_ids,
+        max_workers=max_workers,
+        worker_type='thread',
+        http_client=http_client,
+        fields=fields,
+    )
+    return dict(zip(submission_ids, infos))
+
+
+def _get_model_info_or_error(submission_id, http_client, fields=None):
+    try:
+        info = http_client.get(endpoint=config.INFO_ENDPOINT, submission_id=submission_id)
+    except Exception as ex:
+        return ex
+    if fields is not None:
+        info = {field: info[field] for field in fields if field in info}
+    return info
+
+
+@auto_authenticate
+async def get_model_info_async(submission_id, developer_key=None):
+    http_client = AsyncSubmitterClient(developer_key)
+    response = await http_client.get(endpoint=config.INFO_ENDPOINT, submission_id=submission_id)
+    return response
+
+
 @auto_authenticate
 def evaluate_model(submission_id, developer_key=None):
     http_client = SubmitterClient(developer_key)
@@ -155,6 +195,13 @@ def get_my_submissions(developer_key=None):
     return response
 
 
+@auto_authenticate
+async def get_my_submissions_async(developer_key=None):
+    http_client = AsyncSubmitterClient(developer_key)
+    response = await http_client.get(endpoint=config.ALL_SUBMISSION_STATUS_ENDPOINT)
+    return response
+
+
 @auto_authenticate
 def deactivate_model(submission_id, developer_key=None):
     http_client = SubmitterClient(developer_key)
@@ -1,18 +1,31 @@
-from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, ALL_COMPLETED
+import atexit
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, ALL_COMPLETED
+from collections.abc import Mapping
+from dataclasses import dataclass
 from datetime import datetime
+import functools
 import hashlib
 import inspect
 import os
-import pickle
+import threading
 from typing import Literal
-from time import time
+from time import perf_counter, time
 
 import requests
 from tqdm import tqdm
 
 from chaiverse.config import BASE_SUBMITTER_URL, LEADERBOARD_ENDPOINT
+from chaiverse.lib import json_tools, rate_limit_tools
+from chaiverse.lib.cache_tools import CacheStats, LRUCache, PickleCacheBackend, SQLiteCacheBackend, read_cache_stats
 
 CACHE_UPDATE_HOURS = 6
+CACHE_MAX_STALE_HOURS = 24
+CACHE_MAX_BYTES = int(os.environ.get('GUANACO_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+CACHE_CODEC = os.environ.get('GUANACO_CACHE_CODEC', 'none')
+CACHE_SIZE_RECOUNT_SECONDS = 300
+CACHE_STATS_FLUSH_SECONDS = 60
+MEMORY_CACHE_MAX_BYTES = 256 * 1024 ** 2
+MEMORY_CACHE_MAX_ENTRIES = 128
 
 
 def get_url(endpoint, hostname=BASE_SUBMITTER_URL, **kwarg):
@@ -44,60 +57,432 @@ def get_all_historical_submissions(developer_key):
     return get_submissions(developer_key=developer_key)
 
 
+@dataclass
+class CachedResponse:
+    payload: object
+    etag: str = None
+    last_modified: str = None
+
+    @classmethod
+    def from_response(cls, response, payload):
+        return cls(payload, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+
+    @property
+    def has_validators(self):
+        return bool(self.etag or self.last_modified)
+
+    @property
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
 def get_submissions(developer_key=None, params=None):
-    headers = {"developer_key": developer_key}
     url = get_url(LEADERBOARD_ENDPOINT)
+    file_path = _get_http_cache_file_path(url, developer_key, params)
+    cached_response = _load_cached_response(file_path)
+    headers = {"developer_key": developer_key}
+    headers.update(cached_response.conditional_headers if cached_response else {})
     resp = requests.get(url, headers=headers, params=params)
+    not_modified = resp.status_code == 304 and cached_response is not None
+    _record_revalidation('http', cached_response is not None, not_modified)
+    if not_modified:
+        return cached_response.payload
     assert resp.status_code == 200, resp.text
-    return resp.json()
-
-
-def cache(func, regenerate=False):
+    cached_response = CachedResponse.from_response(resp, json_tools.loads(resp.content))
+    if cached_response.has_validators:
+        _save_to_cache(file_path, cached_response)
+    return cached_response.payload
+
+
+def cache(func, regenerate=False, stale_while_revalidate=False, max_stale_hours=None):
+    """
+    Caches the results of `func` on disk for `CACHE_UPDATE_HOURS`.
+
+    With `stale_while_revalidate`, an expired result that is at most
+    `max_stale_hours` (defaults to `CACHE_MAX_STALE_HOURS`) past its expiry
+    is returned at once while a background thread refreshes it. The refresh
+    can be awaited through `wrapper.get_pending_refresh(*args, **kwargs)`,
+    which returns a `Future` of the fresh result (None if none is running).
+    """
     def wrapper(*args, **kwargs):
         file_path = _get_cache_file_path(func, args, kwargs)
+        requested_at = time()
         try:
-            result = _load_from_cache(file_path)
+            result = _load_fresh_from_cache(file_path)
             assert not regenerate
-            # ensuring file is less than N hours old, otherwise regenerate
-            assert (time() - os.path.getmtime(file_path)) < 3600 * CACHE_UPDATE_HOURS
+            _cache_stats.record_hit(_get_cache_name(file_path))
+        except (FileNotFoundError, AssertionError) as ex:
+            _record_cache_lookup_failure(file_path, ex)
+            try:
+                assert stale_while_revalidate and not regenerate
+                result = _load_fresh_from_cache(file_path, max_age_hours=_get_max_age_hours(max_stale_hours))
+                _refresh_cache_in_background(file_path, func, args, kwargs)
+            except (FileNotFoundError, AssertionError):
+                result = _refresh_cache(file_path, func, args, kwargs, not_before=requested_at if regenerate else None)
+        return result
+
+    def get_pending_refresh(*args, **kwargs):
+        with _pending_refreshes_lock:
+            return _pending_refreshes.get(_get_cache_file_path(func, args, kwargs))
+
+    wrapper.get_pending_refresh = get_pending_refresh
+    return wrapper
+
+
+def wait_for_cache_refreshes(timeout=None):
+    with _pending_refreshes_lock:
+        futures = list(_pending_refreshes.values())
+    wait(futures, timeout=timeout, return_when=ALL_COMPLETED)
+
+
+def _record_cache_lookup_failure(file_path, ex):
+    # an entry that exists but fails the freshness checks is stale
+    if isinstance(ex, FileNotFoundError):
+        _cache_stats.record_miss(_get_cache_name(file_path))
+    else:
+        _cache_stats.record_stale(_get_cache_name(file_path))
+
+
+def _record_revalidation(cache_name, is_cached, not_modified):
+    if not_modified:
+        _cache_stats.record_hit(cache_name)
+    elif is_cached:
+        _cache_stats.record_stale(cache_name)
+    else:
+        _cache_stats.record_miss(cache_name)
+
+
+def _refresh_cache(file_path, func, args, kwargs, not_before=None):
+    with cache_lock(file_path):
+        try:
+            # another caller may have refreshed the entry while this one waited
+            result = _load_fresh_from_cache(file_path, not_before=not_before)
         except (FileNotFoundError, AssertionError):
             result = func(*args, **kwargs)
             _save_to_cache(file_path, result)
-        return result
-    return wrapper
+    return result
+
+
+_pending_refreshes = {}
+_pending_refreshes_lock = threading.Lock()
+
+
+def _refresh_cache_in_background(file_path, func, args, kwargs):
+    with _pending_refreshes_lock:
+        future = _pending_refreshes.get(file_path)
+        if future is None:
+            future = Future()
+            _pending_refreshes[file_path] = future
+            thread = threading.Thread(
+                target=_run_background_refresh,
+                args=(future, file_path, func, args, kwargs),
+                daemon=True,
+            )
+            thread.start()
+    return future
+
+
+def _run_background_refresh(future, file_path, func, args, kwargs):
+    try:
+        result = _refresh_cache(file_path, func, args, kwargs)
+    except BaseException as ex:
+        future.set_exception(ex)
+    else:
+        future.set_result(result)
+    finally:
+        with _pending_refreshes_lock:
+            _pending_refreshes.pop(file_path, None)
+
+
+def _get_max_age_hours(max_stale_hours=None):
+    max_stale_hours = CACHE_MAX_STALE_HOURS if max_stale_hours is None else max_stale_hours
+    return CACHE_UPDATE_HOURS + max_stale_hours
+
+
+def _load_fresh_from_cache(file_path, not_before=None, max_age_hours=None):
+    max_age_hours = CACHE_UPDATE_HOURS if max_age_hours is None else max_age_hours
+    result = _load_from_cache(file_path)
+    mtime = get_cache_backend().get_info(os.fspath(file_path)).mtime
+    # ensuring file is less than N hours old, otherwise regenerate
+    assert (time() - mtime) < 3600 * max_age_hours
+    assert not_before is None or mtime >= not_before
+    return result
+
+
+def cache_lock(file_path):
+    """
+    Advisory lock serialising the processes and threads that refresh the
+    cache entry at `file_path`.
+    """
+    return get_cache_backend().lock(os.fspath(file_path))
 
 
 def _get_cache_file_path(func, args, kwargs):
     cache_dir = os.path.join(guanaco_data_dir(), 'cache')
-    os.makedirs(cache_dir, exist_ok=True)
-    func_name = func.__name__
-    signature = _func_call_as_string(func, args, kwargs)
-    signature_hexdigest = get_hexdigest(signature)
-    fname = f'cache-{func_name}-{signature_hexdigest}'
+    fname = f'cache-{func.__name__}-{_get_cache_key(func, args, kwargs)}'
     return os.path.join(cache_dir, f'{fname}.pkl')
 
 
+def _get_cache_key(func, args, kwargs):
+    # equal calls share a key however their arguments were passed
+    signature = _get_signature(func)
+    if signature is not None:
+        bound_arguments = signature.bind(*args, **kwargs)
+        bound_arguments.apply_defaults()
+        arguments = bound_arguments.arguments
+    else:
+        arguments = {'args': args, 'kwargs': kwargs}
+    canonical_arguments = _canonicalize(dict(arguments))
+    return hashlib.blake2b(canonical_arguments.encode('UTF-8'), digest_size=16).hexdigest()
+
+
+@functools.lru_cache(maxsize=1024)
+def _get_signature(func):
+    try:
+        signature = inspect.signature(func)
+    except (TypeError, ValueError):
+        signature = None
+    return signature
+
+
+def _canonicalize(value):
+    if isinstance(value, Mapping):
+        items = sorted(f'{_canonicalize(key)}:{_canonicalize(item)}' for key, item in value.items())
+        canonical = '{' + ','.join(items) + '}'
+    elif isinstance(value, (set, frozenset)):
+        canonical = 'set{' + ','.join(sorted(_canonicalize(item) for item in value)) + '}'
+    elif isinstance(value, list):
+        canonical = '[' + ','.join(_canonicalize(item) for item in value) + ']'
+    elif isinstance(value, tuple):
+        canonical = '(' + ','.join(_canonicalize(item) for item in value) + ')'
+    else:
+        canonical = repr(value)
+    return canonical
+
+
+def _get_cache_name(file_path):
+    # entries are named cache-<function>-<key>.pkl, http-<digest>.pkl or,
+    # for feedback, <submission_id>.pkl
+    basename = os.path.basename(os.fspath(file_path))
+    if basename.startswith('cache-'):
+        name = basename.split('-')[1]
+    elif basename.startswith('http-'):
+        name = 'http'
+    else:
+        name = 'feedback'
+    return name
+
+
+def _get_http_cache_file_path(url, developer_key, params):
+    cache_dir = os.path.join(guanaco_data_dir(), 'cache')
+    signature_hexdigest = get_hexdigest(f'{url}|{developer_key}|{params!r}')
+    return os.path.join(cache_dir, f'http-{signature_hexdigest}.pkl')
+
+
+def _load_cached_response(file_path):
+    try:
+        cached_response = _load_from_cache(file_path)
+    except FileNotFoundError:
+        cached_response = None
+    return cached_response
+
+
 def get_hexdigest(input_string):
     hexdigest = hashlib.md5(input_string.encode('UTF-8')).hexdigest()
     return hexdigest
 
 
-def _load_from_cache(file_path):
-    with open(file_path, 'rb') as f:
-        return pickle.load(f)
+_cache_backend = None
+
+
+def get_cache_backend():
+    global _cache_backend
+    if _cache_backend is None:
+        _cache_backend = _create_default_cache_backend()
+    return _cache_backend
+
+
+def set_cache_backend(backend):
+    """
+    Replaces the store behind the cache functions, returning the previous
+    one. Backends are `PickleCacheBackend` (the default) and
+    `SQLiteCacheBackend`, or any object with the same methods.
+    """
+    global _cache_backend
+    previous_backend = _cache_backend
+    _cache_backend = backend
+    _memory_cache.clear()
+    with _cache_sizes_lock:
+        _cache_sizes.clear()
+    return previous_backend
+
+
+def _create_default_cache_backend():
+    backend_name = os.environ.get('GUANACO_CACHE_BACKEND', 'pickle')
+    assert backend_name in ('pickle', 'sqlite'), f'Unknown cache backend {backend_name}, expecting pickle or sqlite'
+    if backend_name == 'sqlite':
+        backend = SQLiteCacheBackend(os.path.join(guanaco_data_dir(), 'cache.sqlite3'), codec=CACHE_CODEC)
+    else:
+        backend = PickleCacheBackend(codec=CACHE_CODEC)
+    return backend
 
 
-def _save_to_cache(file_path, data):
-    with open(file_path, 'wb') as f:
-        pickle.dump(data, f)
+def get_cache_stats():
+    """
+    Hit, stale and miss counts, bytes read and written and load time of
+    the caches used by this process, keyed by cache name: the name of the
+    function for `cache`, `http` for cached API responses and `feedback`.
+    """
+    return _cache_stats
 
 
-def _func_call_as_string(func, args, kwargs):
-    func_name = func.__name__
-    param_names = list(inspect.signature(func).parameters.keys())
-    arg_strs = [f'{name}={value!r}' for name, value in zip(param_names, args)]
-    arg_strs += [f'{name}={value!r}' for name, value in kwargs.items()]
-    return f"{func_name}({', '.join(arg_strs)})"
+def get_stored_cache_stats():
+    """
+    The counts of `get_cache_stats` summed over every process that used
+    the cache, this one included.
+    """
+    _cache_stats.flush()
+    return read_cache_stats(_get_cache_stats_path())
+
+
+def _get_cache_stats_path():
+    return os.path.join(guanaco_data_dir(), 'cache', 'cache_stats.json')
+
+
+def _flush_cache_stats():
+    try:
+        _cache_stats.flush()
+    except OSError:
+        pass
+
+
+_cache_stats = CacheStats(_get_cache_stats_path, CACHE_STATS_FLUSH_SECONDS)
+atexit.register(_flush_cache_stats)
+
+
+def list_cache_entries(cache_dir=None):
+    """
+    Returns the `CacheEntryInfo` of every stored cache entry, most recently
+    used first.
+    """
+    cache_dir = cache_dir or os.path.join(guanaco_data_dir(), 'cache')
+    entries = get_cache_backend().list_entries(cache_dir)
+    return sorted(entries, key=lambda entry: entry.atime_ns, reverse=True)
+
+
+def get_cache_usage(cache_dir=None):
+    """
+    Summarises the stored cache entries by cache name: the number of
+    entries, their total size and how many are past `CACHE_UPDATE_HOURS`.
+    """
+    usage = {}
+    now = time()
+    for entry in list_cache_entries(cache_dir):
+        cache_usage = usage.setdefault(_get_cache_name(entry.key), {'entries': 0, 'bytes': 0, 'expired': 0})
+        cache_usage['entries'] += 1
+        cache_usage['bytes'] += entry.size
+        cache_usage['expired'] += int(now - entry.mtime >= 3600 * CACHE_UPDATE_HOURS)
+    return usage
+
+
+# unpickled cache entries, keyed by path and only valid while the stored entry
+# keeps the modification time and size it had when read. Entries are charged
+# the length of their uncompressed pickle.
+_memory_cache = LRUCache(MEMORY_CACHE_MAX_BYTES, MEMORY_CACHE_MAX_ENTRIES)
+
+
+def _load_from_cache(file_path):
+    file_path = os.fspath(file_path)
+    backend = get_cache_backend()
+    info = backend.get_info(file_path)
+    version, data, nbytes = _memory_cache.get(file_path, (None, None, None))
+    if version != info.version:
+        started_at = perf_counter()
+        data, nbytes = backend.load(file_path)
+        _cache_stats.record_read(_get_cache_name(file_path), info.size, perf_counter() - started_at)
+        _memory_cache.put(file_path, (info.version, data, nbytes), nbytes)
+    else:
+        _cache_stats.record_memory_hit(_get_cache_name(file_path))
+    backend.mark_access(file_path, info)
+    return data
+
+
+def _save_to_cache(file_path, data, codec=None):
+    file_path = os.fspath(file_path)
+    backend = get_cache_backend()
+    try:
+        previous_size = backend.get_info(file_path).size
+    except FileNotFoundError:
+        previous_size = 0
+    info, nbytes = backend.save(file_path, data, codec)
+    _cache_stats.record_write(_get_cache_name(file_path), info.size)
+    _memory_cache.put(file_path, (info.version, data, nbytes), nbytes)
+    cache_dir = os.path.dirname(file_path)
+    if _update_cache_size(cache_dir, info.size - previous_size) > CACHE_MAX_BYTES:
+        prune_cache(CACHE_MAX_BYTES, cache_dir=cache_dir)
+
+
+# running size of each cache directory, so that writes list and prune its
+# entries only once the budget is exceeded. Sizes are recounted every
+# `CACHE_SIZE_RECOUNT_SECONDS` to account for writes of other processes.
+_cache_sizes = {}
+_cache_sizes_lock = threading.Lock()
+
+
+def _update_cache_size(cache_dir, added_bytes):
+    cache_dir = os.path.abspath(cache_dir)
+    with _cache_sizes_lock:
+        counted_at, nbytes = _cache_sizes.get(cache_dir, (None, None))
+        if counted_at is None or time() - counted_at > CACHE_SIZE_RECOUNT_SECONDS:
+            counted_at = time()
+            nbytes = sum(entry.size for entry in get_cache_backend().list_entries(cache_dir))
+        else:
+            nbytes += added_bytes
+        _cache_sizes[cache_dir] = (counted_at, nbytes)
+    return nbytes
+
+
+def prune_cache(max_bytes=None, cache_dir=None):
+    """
+    Removes least recently used cache entries until the cache directory
+    holds at most `max_bytes` (defaults to `CACHE_MAX_BYTES`). Returns the
+    number of removed entries and the number of bytes freed.
+    """
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    cache_dir = cache_dir or os.path.join(guanaco_data_dir(), 'cache')
+    removed = get_cache_backend().prune(max_bytes, cache_dir)
+    for entry in removed:
+        _memory_cache.pop(entry.key)
+    for callback in _cache_prune_callbacks:
+        callback(cache_dir, [entry.key for entry in removed])
+    with _cache_sizes_lock:
+        _cache_sizes.pop(os.path.abspath(cache_dir), None)
+    return len(removed), sum(entry.size for entry in removed)
+
+
+# called by prune_cache with the cache directory and the keys of the removed
+# entries, so that files derived from cache entries are removed with them
+_cache_prune_callbacks = []
+
+
+def register_cache_prune_callback(callback):
+    _cache_prune_callbacks.append(callback)
+
+
+def _touch_cache(file_path):
+    # marks a cache entry as fresh without dropping it from the memory tier
+    file_path = os.fspath(file_path)
+    backend = get_cache_backend()
+    version, data, nbytes = _memory_cache.get(file_path, (None, None, None))
+    previous_info = backend.get_info(file_path)
+    info = backend.touch(file_path)
+    if version == previous_info.version:
+        _memory_cache.put(file_path, (info.version, data, nbytes), nbytes)
 
 
 def get_localised_timestamp(timestamp, timezone=None):
@@ -119,8 +504,8 @@ def parse_log_entry(log, timezone=None):
 def _distribute_to_multiple_workers(func, *args_iter, max_workers=2, worker_type: Literal['process', 'thread']='process', **kwargs):
     futures = []
     with tqdm(total=None) as progress:
-        PoolExecutor = ProcessPoolExecutor if worker_type == 'process' else ThreadPoolExecutor
-        with PoolExecutor(max_workers) as executor:
+        executor = _get_pool_executor(max_workers, worker_type)
+        with executor:
             for func_args in zip(*args_iter):
                 future = executor.submit(func, *func_args, **kwargs)
                 future.add_done_callback(lambda p: progress.update(1))
@@ -131,6 +516,16 @@ def _distribute_to_multiple_workers(func, *args_iter, max_workers=2, worker_type
     return results
 
 
+def _get_pool_executor(max_workers, worker_type):
+    if worker_type == 'process':
+        # workers may be spawned rather than forked, so hand them the rate limits explicitly
+        rate_limit_config = rate_limit_tools.get_rate_limit_config()
+        executor = ProcessPoolExecutor(max_workers, initializer=rate_limit_tools.set_rate_limit_config, initargs=(rate_limit_config,))
+    else:
+        executor = ThreadPoolExecutor(max_workers)
+    return executor
+
+
 def _distribute_to_single_worker(func, *args_iter, **kwargs):
     args_list = list(zip(*args_iter))
     results = [func(*args, **kwargs) for args in tqdm(args_list, total=len(args_list))]
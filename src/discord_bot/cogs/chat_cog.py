@@ -118,7 +118,7 @@ async def _reply_chat_message(message):
             if not message.is_system()
         ]
         messages = messages[::-1]
-        response = chai_chat.get_bot_response(messages, submission_id, bot_config, developer_key=config.DEVELOPER_KEY)
+        response = await chai_chat.get_bot_response_async(messages, submission_id, bot_config, developer_key=config.DEVELOPER_KEY)
         await message.reply(f"{bot_config.bot_label}: {response}")
 
 
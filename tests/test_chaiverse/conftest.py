@@ -0,0 +1,40 @@
+import pytest
+
+from chaiverse import http_client, utils
+
+
+@pytest.fixture(autouse=True)
+def reset_circuit_breakers():
+    http_client.reset_circuit_breakers()
+    yield
+    http_client.reset_circuit_breakers()
+
+
+@pytest.fixture(autouse=True)
+def reset_request_metrics():
+    http_client.get_request_metrics().reset()
+    yield
+    http_client.get_request_metrics().reset()
+
+
+@pytest.fixture(autouse=True)
+def clear_memory_cache():
+    utils._memory_cache.clear()
+    yield
+    utils._memory_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_cache_sizes():
+    utils._cache_sizes.clear()
+    yield
+    utils._cache_sizes.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_cache_stats(monkeypatch):
+    # counters are only flushed to disk by the tests that ask for it
+    monkeypatch.setattr(utils.get_cache_stats(), 'flush_interval', None)
+    utils.get_cache_stats().reset()
+    yield
+    utils.get_cache_stats().reset()
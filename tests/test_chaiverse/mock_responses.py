@@ -0,0 +1,22 @@
+import json
+
+from mock import Mock
+
+
+class MockJSONResponse(Mock):
+    """
+    Mocked requests.Response whose raw `content` follows the payload
+    configured through `json.return_value`.
+    """
+    def __init__(self, status_code=200, payload=None, headers=None, **kwargs):
+        super().__init__(**kwargs)
+        self.status_code = status_code
+        self.headers = headers if headers is not None else {}
+        self.json.return_value = payload
+
+    @property
+    def content(self):
+        return json.dumps(self.json.return_value).encode()
+
+    def _get_child_mock(self, **kwargs):
+        return Mock(**kwargs)
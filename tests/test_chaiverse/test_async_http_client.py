@@ -0,0 +1,332 @@
+import asyncio
+import functools
+import threading
+from mock import patch, AsyncMock
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+import pytest
+
+from chaiverse import chat, feedback, submit
+from chaiverse.http_client import get_request_metrics
+from chaiverse.async_http_client import AsyncSessionPool, AsyncSubmitterClient, AsyncFeedbackClient
+from chaiverse.utils import CachedResponse
+
+
+@pytest.fixture()
+def data_dir(tmpdir):
+    with patch('chaiverse.utils.get_guanaco_data_dir_env', return_value=str(tmpdir)):
+        yield tmpdir
+
+
+def run_with_server(routes, coroutine_func):
+    async def run():
+        app = web.Application()
+        app.add_routes(routes)
+        async with TestServer(app) as server:
+            hostname = str(server.make_url('')).rstrip('/')
+            async with AsyncSessionPool() as session_pool:
+                return await coroutine_func(hostname, session_pool)
+    return asyncio.run(run())
+
+
+async def echo_handler(request):
+    payload = await request.json() if request.can_read_body else None
+    return web.json_response({
+        'path': request.path,
+        'authorization': request.headers.get('Authorization'),
+        'payload': payload,
+    })
+
+
+async def error_handler(request):
+    return web.json_response({'error': 'some error'}, status=500)
+
+
+def test_async_submitter_client_gets_correct_authentication_header():
+    http_client = AsyncSubmitterClient(developer_key="CR_test")
+    assert http_client.headers == {"Authorization": "Bearer CR_test"}
+
+
+def test_async_feedback_client_gets_correct_authentication_header():
+    http_client = AsyncFeedbackClient(developer_key="CR_test")
+    assert http_client.headers == {"Authorization": "Bearer CR_test"}
+
+
+def test_async_client_get_formats_endpoint():
+    async def get(hostname, session_pool):
+        http_client = AsyncFeedbackClient("CR_test", hostname=hostname, session_pool=session_pool)
+        return await http_client.get("/feedback/{submission_id}", submission_id="test_model")
+
+    response = run_with_server([web.get('/feedback/{submission_id}', echo_handler)], get)
+    assert response == {'path': '/feedback/test_model', 'authorization': 'Bearer CR_test', 'payload': None}
+
+
+def test_async_client_post_sends_json_payload():
+    async def post(hostname, session_pool):
+        http_client = AsyncSubmitterClient("CR_test", hostname=hostname, session_pool=session_pool)
+        return await http_client.post("/models/{submission_id}/chat", data={'a': 1}, submission_id="test_model", timeout=20)
+
+    response = run_with_server([web.post('/models/{submission_id}/chat', echo_handler)], post)
+    assert response == {'path': '/models/test_model/chat', 'authorization': 'Bearer CR_test', 'payload': {'a': 1}}
+
+
+def test_async_client_raises_for_bad_request():
+    async def get(hostname, session_pool):
+        http_client = AsyncSubmitterClient("CR_test", hostname=hostname, session_pool=session_pool)
+        return await http_client.get("/models/bad_endpoint")
+
+    with pytest.raises(AssertionError) as ex:
+        run_with_server([web.get('/models/bad_endpoint', error_handler)], get)
+    assert "some error" in str(ex)
+
+
+def test_async_client_requests_run_concurrently():
+    async def slow_handler(request):
+        await asyncio.sleep(0.2)
+        return web.json_response({})
+
+    async def gather(hostname, session_pool):
+        http_client = AsyncSubmitterClient("CR_test", hostname=hostname, session_pool=session_pool)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await asyncio.gather(*[http_client.get("/slow") for _ in range(5)])
+        return loop.time() - start
+
+    elapsed = run_with_server([web.get('/slow', slow_handler)], gather)
+    assert elapsed < 0.2 * 5
+
+
+def test_async_session_pool_does_not_share_cookies_between_developer_keys():
+    async def set_cookie_handler(request):
+        response = web.json_response({'cookie': request.headers.get('Cookie')})
+        response.set_cookie('session', 'CR_test')
+        return response
+
+    async def get_with_two_keys(hostname, session_pool):
+        # cookies set by IP address hosts are never stored, so use a host name
+        hostname = hostname.replace('127.0.0.1', 'localhost')
+        await AsyncSubmitterClient("CR_test", hostname=hostname, session_pool=session_pool).get('/models')
+        return await AsyncSubmitterClient("CR_other", hostname=hostname, session_pool=session_pool).get('/models')
+
+    response = run_with_server([web.get('/models', set_cookie_handler)], get_with_two_keys)
+    assert response == {'cookie': None}
+
+
+def test_async_session_pool_reuses_session_within_event_loop():
+    async def get_sessions():
+        async with AsyncSessionPool() as session_pool:
+            session = session_pool.get_session("https://guanaco-submitter.chai-research.com")
+            assert session is session_pool.get_session("https://guanaco-submitter.chai-research.com")
+            assert session is not session_pool.get_session("https://guanaco-feedback.chai-research.com")
+        return session
+
+    session = asyncio.run(get_sessions())
+    assert session.closed
+
+
+def test_async_session_pool_closes_sessions_when_asyncio_run_ends():
+    session_pool = AsyncSessionPool()
+
+    async def get(hostname):
+        http_client = AsyncSubmitterClient("CR_test", hostname=hostname, session_pool=session_pool)
+        return await http_client.get("/models/{submission_id}", submission_id="test_model")
+
+    async def run():
+        app = web.Application()
+        app.add_routes([web.get('/models/{submission_id}', echo_handler)])
+        async with TestServer(app) as server:
+            await get(str(server.make_url('')).rstrip('/'))
+            return list(session_pool._sessions.values())
+
+    sessions = [session for _ in range(3) for session in asyncio.run(run())]
+    assert len(sessions) == 3
+    assert all(session.closed for session in sessions)
+    assert session_pool._sessions == {}
+
+
+def test_async_session_pool_discards_sessions_of_closed_loops():
+    session_pool = AsyncSessionPool()
+
+    async def get_session():
+        return session_pool.get_session("https://guanaco-submitter.chai-research.com")
+
+    loop = asyncio.new_event_loop()
+    session = loop.run_until_complete(get_session())
+    loop.close()
+    asyncio.run(get_session())
+    assert session.closed
+    assert session not in session_pool._sessions.values()
+    assert len(session_pool._sessions) == 0
+
+
+@patch("chaiverse.feedback.utils._save_to_cache")
+@patch("chaiverse.async_http_client._AsyncChaiverseHTTPClient.get_conditional", new_callable=AsyncMock)
+def test_get_feedback_async(mock_get_conditional, save_to_cache_mock, data_dir):
+    mock_get_conditional.return_value = CachedResponse({"some": "feedback"}, '"v1"')
+    result = asyncio.run(feedback.get_feedback_async("test_model", "key"))
+    assert result.raw_data == {"some": "feedback"}
+    assert result.etag == '"v1"'
+    mock_get_conditional.assert_awaited_once_with("/feedback/{submission_id}", None, submission_id="test_model")
+    save_to_cache_mock.assert_called_once()
+
+
+@patch('chaiverse.async_http_client._AsyncChaiverseHTTPClient.get_conditional', new_callable=AsyncMock)
+def test_get_feedback_async_does_cache_io_off_the_event_loop(mock_get_conditional, data_dir):
+    mock_get_conditional.return_value = CachedResponse({"some": "feedback"}, '"v1"')
+    threads = []
+    save_to_cache = feedback.utils._save_to_cache
+
+    def record_thread(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return save_to_cache(*args, **kwargs)
+
+    with patch('chaiverse.utils._save_to_cache', side_effect=record_thread):
+        asyncio.run(feedback.get_feedback_async("test_model", "key"))
+    assert threads and threading.main_thread() not in threads
+
+
+def test_async_client_get_conditional_returns_cached_response_when_not_modified():
+    async def conditional_handler(request):
+        if request.headers.get('If-None-Match') == '"v1"':
+            return web.Response(status=304)
+        return web.json_response({'status': 'deployed'}, headers={'ETag': '"v1"', 'Last-Modified': 'Wed, 01 Jan 2025 00:00:00 GMT'})
+
+    async def get_twice(hostname, session_pool):
+        http_client = AsyncSubmitterClient("CR_test", hostname=hostname, session_pool=session_pool)
+        first_response = await http_client.get_conditional("/models/{submission_id}", submission_id="test_model")
+        second_response = await http_client.get_conditional("/models/{submission_id}", first_response, submission_id="test_model")
+        return first_response, second_response
+
+    first_response, second_response = run_with_server([web.get('/models/{submission_id}', conditional_handler)], get_twice)
+    assert first_response == CachedResponse({'status': 'deployed'}, '"v1"', 'Wed, 01 Jan 2025 00:00:00 GMT')
+    assert second_response is first_response
+
+
+def test_get_latest_feedback_async_revalidates_cached_feedback(data_dir):
+    requests = []
+
+    async def feedback_handler(request):
+        requests.append(request.headers.get('If-None-Match'))
+        if request.headers.get('If-None-Match') == '"v1"':
+            return web.Response(status=304)
+        return web.json_response({'some': 'feedback'}, headers={'ETag': '"v1"'})
+
+    async def get_twice(hostname, session_pool):
+        client = functools.partial(AsyncFeedbackClient, hostname=hostname, session_pool=session_pool)
+        with patch("chaiverse.feedback.AsyncFeedbackClient", client):
+            first_feedback = await feedback._get_latest_feedback_async("test_model", "key")
+            with patch("chaiverse.feedback.utils._save_to_cache") as save_to_cache_mock:
+                second_feedback = await feedback._get_latest_feedback_async("test_model", "key")
+        save_to_cache_mock.assert_not_called()
+        return first_feedback, second_feedback
+
+    first_feedback, second_feedback = run_with_server([web.get('/feedback/{submission_id}', feedback_handler)], get_twice)
+    assert requests == [None, '"v1"']
+    assert first_feedback.etag == '"v1"'
+    assert second_feedback.raw_data == {'some': 'feedback'}
+    assert second_feedback.etag == '"v1"'
+
+
+@patch("chaiverse.async_http_client._AsyncChaiverseHTTPClient.get", new_callable=AsyncMock)
+def test_get_model_info_async(mock_get):
+    mock_get.return_value = {"status": "deployed"}
+    result = asyncio.run(submit.get_model_info_async("test_model", "key"))
+    assert result == {"status": "deployed"}
+    mock_get.assert_awaited_once_with(endpoint="/models/{submission_id}", submission_id="test_model")
+
+
+@patch("chaiverse.async_http_client._AsyncChaiverseHTTPClient.get", new_callable=AsyncMock)
+def test_get_my_submissions_async(mock_get):
+    mock_get.return_value = {"test_model": "deployed"}
+    result = asyncio.run(submit.get_my_submissions_async("key"))
+    assert result == {"test_model": "deployed"}
+    mock_get.assert_awaited_once_with(endpoint="/models/")
+
+
+@patch("chaiverse.async_http_client._AsyncChaiverseHTTPClient.post", new_callable=AsyncMock)
+def test_bot_get_response_async(mock_post):
+    mock_post.return_value = {'model_input': 'some_input', 'model_output': 'how are you?'}
+    bot_config = chat.BotConfig(memory='Bot memory', prompt='Bot prompt', first_message='hi', bot_label='Bot name')
+    bot = chat.Bot("dummy_submission", "CR-devkey", bot_config)
+    response = asyncio.run(bot.get_response_async('hey!'))
+    assert response['model_output'] == 'how are you?'
+    expected_payload = {
+        "memory": 'Bot memory',
+        "prompt": 'Bot prompt',
+        "chat_history": [
+            {"sender": "Bot name", "message": "hi"},
+            {"sender": "user", "message": "hey!"}
+        ],
+        "bot_name": 'Bot name',
+        "user_name": "You",
+    }
+    mock_post.assert_awaited_once_with(
+        endpoint="/models/{submission_id}/chat",
+        submission_id="dummy_submission",
+        timeout=20,
+        data=expected_payload
+    )
+    assert bot._chat_history[-1] == {"sender": "Bot name", "message": "how are you?"}
+
+
+def test_async_client_retries_transient_server_errors():
+    attempts = []
+
+    async def flaky_handler(request):
+        attempts.append(request.path)
+        if len(attempts) < 3:
+            return web.Response(text='<html><body>502 Bad Gateway</body></html>', status=502, content_type='text/html')
+        return web.json_response({'attempt': len(attempts)})
+
+    async def get(hostname, session_pool):
+        http_client = AsyncSubmitterClient("CR_test", hostname=hostname, session_pool=session_pool)
+        return await http_client.get("/flaky")
+
+    with patch("chaiverse.async_http_client.asyncio.sleep", new_callable=AsyncMock):
+        response = run_with_server([web.get('/flaky', flaky_handler)], get)
+    assert response == {'attempt': 3}
+    assert len(attempts) == 3
+
+
+def test_async_client_raises_with_text_error_detail():
+    async def not_found_handler(request):
+        return web.Response(text='no such model', status=404)
+
+    async def get(hostname, session_pool):
+        http_client = AsyncSubmitterClient("CR_test", hostname=hostname, session_pool=session_pool)
+        return await http_client.get("/missing")
+
+    with pytest.raises(AssertionError) as ex:
+        run_with_server([web.get('/missing', not_found_handler)], get)
+    assert 'no such model' in str(ex.value)
+
+
+def test_async_client_records_request_metrics():
+    async def get(hostname, session_pool):
+        http_client = AsyncSubmitterClient("CR_test", hostname=hostname, session_pool=session_pool)
+        return await http_client.get("/models/{submission_id}", submission_id="test_model")
+
+    run_with_server([web.get('/models/{submission_id}', echo_handler)], get)
+    metrics = get_request_metrics().as_dict()["/models/{submission_id}"]["GET"]
+    assert metrics["status_codes"] == {"200": 1}
+    assert metrics["response_bytes"] > 0
+    assert metrics["decode_time"]["count"] == 1
+
+
+def test_async_client_coalesces_concurrent_identical_gets():
+    hits = []
+
+    async def slow_handler(request):
+        hits.append(request.path)
+        await asyncio.sleep(0.1)
+        return web.json_response({'status': 'deployed'})
+
+    async def gather(hostname, session_pool):
+        http_client = AsyncSubmitterClient("CR_test", hostname=hostname, session_pool=session_pool)
+        get_info = lambda: http_client.get("/models/{submission_id}", submission_id="test_model")
+        return await asyncio.gather(*[get_info() for _ in range(5)])
+
+    results = run_with_server([web.get('/models/{submission_id}', slow_handler)], gather)
+    assert results == [{'status': 'deployed'}] * 5
+    assert len(hits) == 1
@@ -2,16 +2,18 @@ import os
 import json
 import mock
 
+from chaiverse.lib import json_tools
 from chaiverse.chat import Bot, BotConfig, SubmissionChatbot, get_bot_names, get_bot_config, get_bot_response
 
+from mock_responses import MockJSONResponse
+
 
 @mock.patch('builtins.input')
-@mock.patch('chaiverse.http_client.requests.post')
+@mock.patch('chaiverse.http_client.requests.Session.post')
 def test_submission_chatbot(mock_post, mock_input, tmpdir):
     mock_input.side_effect = ['hello', 'how are you?', 'exit']
     response = {'model_input': 'some_input', 'model_output': 'whatsup?'}
-    mock_request = mock_post.return_value
-    mock_request.status_code = 200
+    mock_request = mock_post.return_value = MockJSONResponse()
     mock_request.json.return_value = response
 
     with mock.patch('chaiverse.chat.RESOURCE_DIR', str(tmpdir)):
@@ -21,8 +23,8 @@ def test_submission_chatbot(mock_post, mock_input, tmpdir):
 
     mock_post.assert_called_with(
         url="https://guanaco-submitter.chai-research.com/models/dummy_submission_id/chat",
-        headers={"Authorization": "Bearer CR-123"},
-        json={
+        headers={"Authorization": "Bearer CR-123", "Content-Type": "application/json"},
+        data=json_tools.dumps({
             'memory': 'He is from planet Earth',
             'prompt': 'Just another human',
             'chat_history': [
@@ -33,13 +35,13 @@ def test_submission_chatbot(mock_post, mock_input, tmpdir):
             ],
             'bot_name': 'Tom',
             'user_name': 'You'
-        },
+        }),
         timeout=20
     )
 
 
 
-@mock.patch('chaiverse.http_client.requests.post')
+@mock.patch('chaiverse.http_client.requests.Session.post')
 def test_chat(mock_post):
     url = 'https://guanaco-submitter.chai-research.com/models/dummy_submission/chat'
     submission_id = "dummy_submission"
@@ -54,8 +56,7 @@ def test_chat(mock_post):
     bot = Bot(submission_id, developer_key, config_bot)
 
     output = {'model_input': 'some_input', 'model_output': 'how are you?'}
-    response = mock_post.return_value
-    response.status_code = 200
+    response = mock_post.return_value = MockJSONResponse()
     response.json.return_value = output
 
     out = bot.get_response('hey!')
@@ -71,11 +72,11 @@ def test_chat(mock_post):
         "bot_name": 'Bot name',
         "user_name": "You",
     }
-    expected_headers = {"Authorization": "Bearer CR-devkey"}
+    expected_headers = {"Authorization": "Bearer CR-devkey", "Content-Type": "application/json"}
     mock_post.assert_called_once_with(
         url=url,
         headers=expected_headers,
-        json=expected_payload,
+        data=json_tools.dumps(expected_payload),
         timeout=20
     )
 
@@ -94,7 +95,7 @@ def test_chat(mock_post):
     }
     mock_post.assert_called_with(
         url=url,
-        json=expected_payload,
+        data=json_tools.dumps(expected_payload),
         headers=expected_headers,
         timeout=20
     )
@@ -134,15 +135,14 @@ def test_get_bot_config(tmpdir):
         assert result.bot_label == 'mock-label'
 
 
-@mock.patch('chaiverse.http_client.requests.post')
+@mock.patch('chaiverse.http_client.requests.Session.post')
 def test_get_bot_response(mock_post):
     bot_config = mock.Mock()
     bot_config.memory = 'mock-memory'
     bot_config.prompt = 'mock-prompt'
     bot_config.bot_label = 'mock-label'
     bot_config.first_message = 'mock-first-message'
-    http_response = mock.Mock()
-    http_response.status_code = 200
+    http_response = MockJSONResponse()
     http_response.text = 'dummy-resp-text'
     http_response.json.return_value = {'model_output': 'mock-response'}
     mock_post.return_value = http_response
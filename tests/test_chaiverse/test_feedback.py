@@ -1,50 +1,82 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import functools
 from mock import ANY, patch, Mock
+import json
 import os
+import pickle
+import threading
 
 import pytest
 
 from chaiverse import feedback
 
+from mock_responses import MockJSONResponse
+
 
 @pytest.fixture()
 def mock_get():
-    with patch("chaiverse.http_client.requests.get") as func:
-        func.return_value.status_code = 200
+    with patch("chaiverse.http_client.requests.Session.get") as func:
+        func.return_value = MockJSONResponse()
         func.return_value.json.return_value = {"some": "feedback"}
         yield func
 
 
-@patch('chaiverse.utils._load_from_cache')
-def test_is_submission_updated_new_submission(load_cache_mock):
-    load_cache_mock.side_effect = FileNotFoundError()
+@pytest.fixture()
+def data_dir(tmpdir):
+    with patch('chaiverse.utils.get_guanaco_data_dir_env', return_value=str(tmpdir)):
+        yield tmpdir
+
+
+def test_is_submission_updated_new_submission(data_dir):
     assert feedback.is_submission_updated("file_not_found", 10)
 
 
-@patch('chaiverse.utils._load_from_cache')
-def test_is_submission_updated_cache_contains_no_value(load_cache_mock):
-    load_cache_mock.return_value.raw_data = {}
+def test_is_submission_updated_cache_contains_no_value(data_dir):
+    feedback._save_feedback("mock_sub_id", feedback.Feedback({}))
     assert feedback.is_submission_updated("mock_sub_id", 1)
 
 
-@patch('chaiverse.utils._load_from_cache')
-def test_is_submission_updated_increase_total(load_cache_mock):
-    load_cache_mock.return_value.raw_data = {'thumbs_up' : 10, 'thumbs_down' : 10}
+def test_is_submission_updated_increase_total(data_dir):
+    feedback._save_feedback("mock_sub_id", feedback.Feedback({'thumbs_up' : 10, 'thumbs_down' : 10}))
     assert feedback.is_submission_updated("mock_sub_id", 21)
 
 
+def test_is_submission_updated_equal_total(data_dir):
+    feedback._save_feedback("mock_sub_id", feedback.Feedback({'thumbs_up' : 10, 'thumbs_down' : 10}))
+    assert not feedback.is_submission_updated("mock_sub_id", 20)
+
+
 @patch('chaiverse.utils._load_from_cache')
-def test_is_submission_updated_equal_total(load_cache_mock):
-    load_cache_mock.return_value.raw_data = {'thumbs_up' : 10, 'thumbs_down' : 10}
+def test_is_submission_updated_reads_metadata_index_only(load_cache_mock, data_dir):
+    feedback._save_feedback("mock_sub_id", feedback.Feedback({'thumbs_up' : 10, 'thumbs_down' : 10}, etag='"v1"'))
     assert not feedback.is_submission_updated("mock_sub_id", 20)
+    load_cache_mock.assert_not_called()
+    metadata = feedback.get_cached_feedback_metadata("mock_sub_id")
+    assert metadata['etag'] == '"v1"'
+    assert metadata['size'] > 0
+
+
+def test_is_submission_updated_indexes_feedback_cached_before_index(data_dir):
+    filename = feedback._get_cached_feedback_filename("mock_sub_id")
+    feedback.utils._save_to_cache(filename, feedback.Feedback({'thumbs_up' : 10, 'thumbs_down' : 10}))
+    assert not feedback.is_submission_updated("mock_sub_id", 20)
+    assert feedback.get_feedback_index()["mock_sub_id"]['thumbs_up'] == 10
+
+
+def test_is_submission_updated_ignores_index_entry_of_pruned_feedback(data_dir):
+    feedback._save_feedback("mock_sub_id", feedback.Feedback({'thumbs_up' : 10, 'thumbs_down' : 10}))
+    feedback.utils.prune_cache(0)
+    assert feedback.is_submission_updated("mock_sub_id", 20)
 
 
 def test_feedback_object(example_feedback):
     data = example_feedback
     user_feedback = feedback.Feedback(data)
-    expected_cols = ['conversation_id', 'bot_id', 'user_id', 'conversation', 'thumbs_up', 'feedback', 'model_name', 'public']
+    expected_cols = ['conversation_id', 'bot_id', 'user_id', 'thumbs_up', 'feedback', 'model_name', 'public', 'server_epoch_time']
     assert all(user_feedback.df.columns == expected_cols)
     expected_conversation = 'Bot: hello!\nUser: emmm hi?\nBot (deleted): I hate u!'
-    assert all(user_feedback.df.conversation == expected_conversation)
+    assert all(user_feedback.with_conversations().conversation == expected_conversation)
     expected_thumbs_up = [False, True]
     assert all(user_feedback.df.thumbs_up == expected_thumbs_up)
     expected_feedback = ['he didnt like me', 'he liked me']
@@ -55,6 +87,114 @@ def test_feedback_object(example_feedback):
     assert all(user_feedback.df.user_id == expected_user_id)
 
 
+def test_feedback_df_is_built_once_with_compact_types(example_feedback):
+    user_feedback = feedback.Feedback(example_feedback)
+    with patch.object(feedback.Feedback, '_extract_feedback_data', wraps=user_feedback._extract_feedback_data) as extract_mock:
+        df = user_feedback.df
+        assert user_feedback.df is df
+    assert extract_mock.call_count == 2
+    assert df.model_name.dtype == 'category'
+    assert df.bot_id.dtype == 'category'
+    assert df.thumbs_up.dtype == bool and df.public.dtype == bool
+    assert list(df.server_epoch_time) == [123, 234]
+
+
+def test_feedback_renders_conversations_of_selected_rows_only(example_feedback):
+    user_feedback = feedback.Feedback(example_feedback)
+    df = user_feedback.df
+    with patch.object(feedback.Feedback, '_get_sorted_messages', wraps=user_feedback._get_sorted_messages) as sort_mock:
+        assert 'conversation' not in df
+        rendered_df = user_feedback.with_conversations(df[df.thumbs_up])
+    assert sort_mock.call_count == 1
+    assert list(rendered_df.conversation_id) == ['_bot_demo-234_user-id-1234_1687485384266_234']
+    assert rendered_df.conversation.iloc[0] == user_feedback.get_conversation(rendered_df.conversation_id.iloc[0])
+
+
+def test_feedback_df_renders_conversations_on_access(example_feedback):
+    user_feedback = feedback.Feedback(example_feedback)
+    df = user_feedback.df
+    public_df = df[df.thumbs_up]
+    conversations = public_df.conversations.text
+    assert list(conversations.index) == list(public_df.index)
+    assert conversations.iloc[0] == user_feedback.get_conversation(public_df.conversation_id.iloc[0])
+    assert pickle.loads(pickle.dumps(df)).attrs['feedback'].feedback is None
+    with pytest.raises(AssertionError):
+        user_feedback.without_raw_data().df.conversations.text
+
+
+def test_feedback_sorts_messages_by_sent_date(example_feedback):
+    user_feedback = feedback.Feedback(example_feedback)
+    convo_id = next(iter(example_feedback['feedback']))
+    example_feedback['feedback'][convo_id]['messages'].reverse()
+    assert user_feedback.get_conversation(convo_id) == 'Bot: hello!\nUser: emmm hi?\nBot (deleted): I hate u!'
+
+
+@pytest.fixture
+def query_feedback():
+    raw_feedback = {}
+    for i in range(12):
+        convo_id = f'_bot_demo-{i % 3}_user-{i % 4}_0_{1000 + i}'
+        raw_feedback[convo_id] = {
+            'thumbs_up': i % 2 == 0, 'text': '', 'model_name': f'model-{i % 2}', 'public': i < 6, 'messages': [],
+        }
+    return feedback.Feedback({'feedback': raw_feedback})
+
+
+def test_feedback_query_combines_filters(query_feedback):
+    df = query_feedback.df
+    rows = query_feedback.query(user_id='user-1', public=True)
+    assert list(rows) == [1, 5]
+    assert list(query_feedback.query(bot_id='_bot_demo-0', thumbs_up=True)) == [0, 6]
+    assert list(query_feedback.query(model_name='model-1', user_id='user-3')) == [3, 7, 11]
+    assert list(query_feedback.query(thumbs_up=False, limit=2)) == [1, 3]
+    assert list(query_feedback.query(user_id='unknown-user')) == []
+    expected = df[(df.user_id == 'user-1') & df.public]
+    assert df.iloc[rows].equals(expected)
+
+
+def test_feedback_query_filters_by_exclusive_date_range(query_feedback):
+    date_range = {'start_date': '1970-01-01T00:16:42+00:00', 'end_date': '1970-01-01T00:16:47+00:00'}
+    assert list(query_feedback.query(date_range=date_range)) == [3, 4, 5, 6]
+    assert list(query_feedback.query(date_range=date_range, user_id='user-0')) == [4]
+    assert list(query_feedback.query(date_range={'start_date': '1970-01-01T00:16:49+00:00'})) == [10, 11]
+
+
+def test_feedback_query_index_is_built_once_and_not_pickled(query_feedback):
+    with patch('chaiverse.feedback.FeedbackIndex', wraps=feedback.FeedbackIndex) as index_mock:
+        query_feedback.query(user_id='user-1')
+        query_feedback.query(bot_id='_bot_demo-1')
+    assert index_mock.call_count == 1
+    restored_feedback = pickle.loads(pickle.dumps(query_feedback))
+    assert restored_feedback._index is None
+    assert list(restored_feedback.query(user_id='user-1')) == [1, 5, 9]
+
+
+def test_feedback_pprint_row_renders_conversation(example_feedback, capsys):
+    user_feedback = feedback.Feedback(example_feedback)
+    user_feedback.pprint_row(user_feedback.df.head(1))
+    assert 'Bot (deleted): I hate u!' in capsys.readouterr().out
+
+
+def test_feedback_without_raw_data_keeps_table_and_totals(example_feedback):
+    user_feedback = feedback.Feedback(example_feedback, etag='"v1"')
+    light_feedback = user_feedback.without_raw_data()
+    assert light_feedback.raw_data == {'thumbs_up': 20, 'thumbs_down': 10}
+    assert light_feedback.df.equals(user_feedback.df)
+    assert 'feedback' not in light_feedback.df.attrs
+    assert light_feedback.etag == '"v1"'
+    assert 'feedback' in user_feedback.raw_data
+    restored_feedback = pickle.loads(pickle.dumps(light_feedback))
+    assert restored_feedback.df.equals(user_feedback.df)
+
+
+def test_feedback_pickle_excludes_memoized_df(example_feedback):
+    user_feedback = feedback.Feedback(example_feedback)
+    user_feedback.df
+    restored_feedback = pickle.loads(pickle.dumps(user_feedback))
+    assert restored_feedback._df is None
+    assert restored_feedback.df.equals(user_feedback.df)
+
+
 def test_get_feedback_with_cache(tmpdir):
     submission_id = "test_submission"
     developer_key = "test_key"
@@ -64,12 +204,11 @@ def test_get_feedback_with_cache(tmpdir):
     }
     os.makedirs(os.path.join(tmpdir, 'cache'), exist_ok=True)
 
-    request_mock = Mock()
-    request_mock.get.return_value.status_code = 200
-    request_mock.get.return_value.json.return_value = 'mock-feedback'
+    get_mock = Mock(return_value=MockJSONResponse())
+    get_mock.return_value.json.return_value = 'mock-feedback'
 
     with patch.multiple("chaiverse.utils", **mock_methods):
-        with patch('chaiverse.http_client.requests', request_mock):
+        with patch('chaiverse.http_client.requests.Session.get', get_mock):
             result = feedback.get_feedback(submission_id, developer_key, reload=False)
             expected_path = tmpdir / "cache" / f"{submission_id}.pkl"
             assert expected_path.exists()
@@ -77,7 +216,7 @@ def test_get_feedback_with_cache(tmpdir):
 
 
 @patch("chaiverse.feedback.utils._save_to_cache")
-def test_get_latest_feedback(save_to_cache_mock, mock_get):
+def test_get_latest_feedback(save_to_cache_mock, mock_get, data_dir):
     result = feedback._get_latest_feedback(submission_id="test_model", developer_key="key")
     expected_headers = {'Authorization': 'Bearer key'}
     expected_url = "https://guanaco-feedback.chai-research.com/feedback/test_model"
@@ -85,7 +224,160 @@ def test_get_latest_feedback(save_to_cache_mock, mock_get):
     save_to_cache_mock.assert_called_once_with(ANY, result)
 
 
-def test_get_latest_feedback_raises_for_bad_request(mock_get):
+def test_get_latest_feedback_reuses_cached_feedback_when_not_modified(mock_get, tmpdir):
+    mock_get.return_value.headers = {'ETag': '"v1"'}
+    with patch("chaiverse.utils.guanaco_data_dir", Mock(return_value=str(tmpdir))):
+        os.makedirs(os.path.join(tmpdir, 'cache'), exist_ok=True)
+        first_feedback = feedback._get_latest_feedback(submission_id="test_model", developer_key="key")
+        assert first_feedback.etag == '"v1"'
+        mock_get.return_value.status_code = 304
+        with patch("chaiverse.feedback.utils._save_to_cache") as save_to_cache_mock:
+            second_feedback = feedback._get_latest_feedback(submission_id="test_model", developer_key="key")
+        save_to_cache_mock.assert_not_called()
+    assert second_feedback.raw_data == {"some": "feedback"}
+    mock_get.assert_called_with(
+        url="https://guanaco-feedback.chai-research.com/feedback/test_model",
+        headers={'Authorization': 'Bearer key', 'If-None-Match': '"v1"'}
+    )
+    stats = feedback.utils.get_cache_stats().as_dict()['feedback']
+    assert (stats['hits'], stats['misses']) == (1, 1)
+
+
+@patch('chaiverse.utils.get_submissions')
+def test_warm_feedback_cache_refreshes_only_stale_submissions(get_submissions_mock, mock_get, data_dir):
+    get_submissions_mock.return_value = {
+        'warm_model': {'thumbs_up': 10, 'thumbs_down': 10},
+        'stale_model': {'thumbs_up': 10, 'thumbs_down': 10},
+        'new_model': {'thumbs_up': 1, 'thumbs_down': 0},
+    }
+    feedback._save_feedback('warm_model', feedback.Feedback({'thumbs_up': 10, 'thumbs_down': 10}))
+    feedback._save_feedback('stale_model', feedback.Feedback({'thumbs_up': 5, 'thumbs_down': 5}))
+    mock_get.return_value.json.return_value = {'thumbs_up': 10, 'thumbs_down': 10, 'feedback': {}}
+
+    results = feedback.warm_feedback_cache(max_workers=2, developer_key='key')
+
+    assert sorted(results) == ['new_model', 'stale_model']
+    assert results['stale_model']['thumbs_up'] == 10
+    assert mock_get.call_count == 2
+    assert not feedback.is_submission_updated('stale_model', 20)
+    assert feedback.get_feedback('new_model', developer_key='key', reload=False).raw_data['thumbs_up'] == 10
+    assert mock_get.call_count == 2
+
+
+@patch('chaiverse.utils.get_submissions')
+def test_warm_feedback_cache_reports_failed_submissions(get_submissions_mock, mock_get, data_dir):
+    get_submissions_mock.return_value = {}
+    mock_get.return_value.status_code = 500
+    mock_get.return_value.json.return_value = {'error': 'some error'}
+    results = feedback.warm_feedback_cache(['bad_model'], max_workers=1, developer_key='key')
+    assert isinstance(results['bad_model'], AssertionError)
+
+
+class FeedbackServerHandler(BaseHTTPRequestHandler):
+    feedback = {}
+    supports_since = True
+    queries = []
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        self.queries.append(query)
+        since = int(query['since'][0]) if 'since' in query and self.supports_since else None
+        feedback = {
+            feedback_id: data for feedback_id, data in self.feedback.items()
+            if since is None or int(feedback_id.split('_')[-1]) > since
+        }
+        thumbs_up = sum(data['thumbs_up'] for data in self.feedback.values())
+        body = json.dumps({'feedback': feedback, 'thumbs_up': thumbs_up, 'thumbs_down': len(self.feedback) - thumbs_up}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(params=[True, False], ids=['supports_since', 'ignores_since'])
+def feedback_server(request, data_dir):
+    handler = type('Handler', (FeedbackServerHandler,), {'feedback': {}, 'supports_since': request.param, 'queries': []})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    hostname = f"http://127.0.0.1:{server.server_port}"
+    with patch('chaiverse.feedback.FeedbackClient', functools.partial(feedback.FeedbackClient, hostname=hostname)):
+        yield handler
+    server.shutdown()
+    server.server_close()
+
+
+def make_server_feedback(epoch_time, thumbs_up=True):
+    return {f'_bot_demo-{epoch_time}_user-{epoch_time}_0_{epoch_time}': {'thumbs_up': thumbs_up, 'messages': []}}
+
+
+def test_get_feedback_syncs_only_conversations_after_newest_cached(feedback_server):
+    feedback_server.feedback.update({**make_server_feedback(1000), **make_server_feedback(5000, False)})
+    first_feedback = feedback.get_feedback('test_model', developer_key='key')
+    assert len(first_feedback.raw_data['feedback']) == 2
+    assert feedback_server.queries[-1] == {}
+
+    feedback_server.feedback.update(make_server_feedback(9000))
+    second_feedback = feedback.get_feedback('test_model', developer_key='key')
+
+    assert feedback_server.queries[-1] == {'since': [str(5000 - feedback.FEEDBACK_SYNC_OVERLAP_SECONDS)]}
+    assert second_feedback.raw_data['feedback'] == feedback_server.feedback
+    assert (second_feedback.raw_data['thumbs_up'], second_feedback.raw_data['thumbs_down']) == (2, 1)
+    cached_feedback = feedback.get_feedback('test_model', developer_key='key', reload=False)
+    assert cached_feedback.raw_data['feedback'] == feedback_server.feedback
+
+
+def test_get_feedback_without_incremental_downloads_full_history(feedback_server):
+    feedback_server.feedback.update(make_server_feedback(1000))
+    feedback.get_feedback('test_model', developer_key='key')
+    feedback.get_feedback('test_model', developer_key='key', incremental=False)
+    assert feedback_server.queries[-1] == {}
+
+
+def test_load_feedback_table_reads_selected_columns_of_cached_feedback(example_feedback, data_dir):
+    pytest.importorskip('pyarrow')
+    feedback._save_feedback('test_model', feedback.Feedback(example_feedback))
+    conversations = feedback.load_feedback_table('test_model', columns=['thumbs_up', 'server_epoch_time'])
+    assert conversations.to_pydict() == {'thumbs_up': [False, True], 'server_epoch_time': [123, 234]}
+    messages = feedback.load_feedback_table('test_model', 'messages', columns=['conversation_id', 'position', 'content'])
+    assert messages.num_rows == 6
+    assert messages.column('content').to_pylist()[:3] == ['hello!', 'emmm hi?', 'I hate u!']
+    assert messages.column('position').to_pylist()[:3] == [0, 1, 2]
+
+
+def test_save_feedback_keeps_existing_tables_up_to_date(example_feedback, data_dir):
+    pytest.importorskip('pyarrow')
+    feedback._save_feedback('test_model', feedback.Feedback(example_feedback))
+    feedback.load_feedback_table('test_model')
+    cid = next(iter(example_feedback['feedback']))
+    example_feedback['feedback'] = {cid: example_feedback['feedback'][cid]}
+    feedback._save_feedback('test_model', feedback.Feedback(example_feedback))
+    assert feedback.load_feedback_table('test_model').num_rows == 1
+
+
+def test_prune_cache_removes_tables_of_pruned_feedback(example_feedback, data_dir):
+    pytest.importorskip('pyarrow')
+    for submission_id in ('old_model', 'new_model', 'orphaned_model'):
+        feedback._save_feedback(submission_id, feedback.Feedback(example_feedback))
+        feedback.load_feedback_table(submission_id)
+    cache_dir = os.path.join(data_dir, 'cache')
+    os.remove(os.path.join(cache_dir, 'orphaned_model.pkl'))
+    os.utime(os.path.join(cache_dir, 'old_model.pkl'), (0, 0))
+    feedback.utils.prune_cache(os.path.getsize(os.path.join(cache_dir, 'new_model.pkl')))
+    assert os.listdir(os.path.join(cache_dir, 'feedback_tables')) == ['new_model']
+
+
+def test_feedback_loaded_from_old_pickle_has_no_validators():
+    old_feedback = feedback.Feedback.__new__(feedback.Feedback)
+    old_feedback.raw_data = {'feedback': {}}
+    assert not old_feedback.cached_response.has_validators
+    assert len(old_feedback.df) == 0
+
+
+def test_get_latest_feedback_raises_for_bad_request(mock_get, data_dir):
     mock_get.return_value.status_code = 500
     mock_get.return_value.json.return_value = {"error": "some error"}
     with pytest.raises(AssertionError) as ex:
@@ -93,6 +385,22 @@ def test_get_latest_feedback_raises_for_bad_request(mock_get):
     assert "some error" in str(ex)
 
 
+@patch("chaiverse.http_client.requests.Session.get")
+def test_stream_feedback_extracts_rows_one_conversation_at_a_time(mock_get, example_feedback):
+    mock_get.return_value.status_code = 200
+    mock_get.return_value.iter_content.return_value = [json.dumps(example_feedback).encode()]
+    row_extractor = feedback.FeedbackRowExtractor()
+    fields = feedback.stream_feedback("test_model", row_extractor, developer_key="key")
+    assert fields == {'thumbs_up': 20, 'thumbs_down': 10}
+    expected_df = feedback.Feedback(example_feedback).with_conversations()
+    assert row_extractor.df.equals(expected_df)
+    mock_get.assert_called_once_with(
+        url="https://guanaco-feedback.chai-research.com/feedback/test_model",
+        headers={'Authorization': 'Bearer key', 'Accept-Encoding': 'gzip, deflate'},
+        stream=True,
+    )
+
+
 @pytest.fixture
 def example_feedback():
     messages = get_dummy_messages()
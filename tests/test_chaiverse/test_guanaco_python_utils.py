@@ -2,16 +2,19 @@ from datetime import datetime
 import os
 import pickle
 import sys
+import threading
 import time
 
 from freezegun import freeze_time
-from mock import patch, Mock
+from mock import ANY, patch, Mock
 import pytest
 import pytz
 import vcr
 
 from chaiverse import utils
 
+from mock_responses import MockJSONResponse
+
 
 RESOURCE_DIR = os.path.join(os.path.abspath(os.path.join(__file__, '..')), 'resources')
 MAX_RESPONSE_BODY_SIZE_FOR_URI_CHECKING_ONLY_VCR = 1024
@@ -35,16 +38,47 @@ def guanado_data_dir(tmpdir):
 
 @patch('chaiverse.utils.requests')
 def test_get_all_historical_submissions(requests):
-    mock_response = Mock()
+    mock_response = MockJSONResponse(payload='resp')
     requests.get.return_value = mock_response
-    mock_response.status_code = 200
-    mock_response.json.return_value = 'resp'
     result = utils.get_all_historical_submissions(developer_key='key')
     assert result == 'resp'
     expected_url = 'https://guanaco-submitter.chai-research.com/leaderboard'
     requests.get.assert_called_once_with(expected_url,headers={"developer_key": 'key'}, params=None)
 
 
+@patch('chaiverse.utils.requests')
+def test_get_submissions_revalidates_cached_leaderboard_with_etag(requests):
+    first_response = MockJSONResponse(200, {'submission': 'data'}, headers={'ETag': '"v1"'})
+    not_modified_response = Mock(status_code=304, headers={'ETag': '"v1"'})
+    not_modified_response.json.side_effect = AssertionError('304 body must not be decoded')
+    requests.get.side_effect = [first_response, not_modified_response]
+
+    assert utils.get_submissions(developer_key='key') == {'submission': 'data'}
+    assert utils.get_submissions(developer_key='key') == {'submission': 'data'}
+    expected_url = 'https://guanaco-submitter.chai-research.com/leaderboard'
+    requests.get.assert_called_with(expected_url, headers={"developer_key": 'key', 'If-None-Match': '"v1"'}, params=None)
+    stats = utils.get_cache_stats().as_dict()['http']
+    assert (stats['hits'], stats['misses']) == (1, 1)
+
+
+@patch('chaiverse.utils.requests')
+def test_get_submissions_does_not_share_validators_between_params(requests):
+    response = MockJSONResponse(200, {}, headers={'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+    requests.get.return_value = response
+    utils.get_submissions(developer_key='key', params={'start_date': 'from'})
+    utils.get_submissions(developer_key='key', params={'start_date': 'to'})
+    requests.get.assert_called_with(ANY, headers={"developer_key": 'key'}, params={'start_date': 'to'})
+
+
+def test_cached_response_conditional_headers():
+    cached_response = utils.CachedResponse('payload', etag='"v1"', last_modified='Wed, 21 Oct 2015 07:28:00 GMT')
+    assert cached_response.conditional_headers == {
+        'If-None-Match': '"v1"',
+        'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT',
+    }
+    assert utils.CachedResponse('payload').conditional_headers == {}
+
+
 @pytest.mark.parametrize("test_id, params, expected_uri", [
     (1, dict(start_date='from', end_date='to'), 'https://guanaco-submitter.chai-research.com/leaderboard?start_date=from&end_date=to'),
     (2, dict(start_date='from', end_date=None), 'https://guanaco-submitter.chai-research.com/leaderboard?start_date=from'),
@@ -95,8 +129,7 @@ def test_cache_will_not_return_from_cache_if_param_is_different():
 
 
 @patch('chaiverse.utils.time')
-@patch('os.path.getmtime')
-def test_cache_will_auto_invalidate_after_set_time(getmtime_mock, time_mock):
+def test_cache_will_auto_invalidate_after_set_time(time_mock):
     mock_function = Mock()
 
     def my_func(a):
@@ -106,10 +139,10 @@ def test_cache_will_auto_invalidate_after_set_time(getmtime_mock, time_mock):
         return utils.cache(my_func, regenerate)(a)
 
     timestamp = 1704096000
-    getmtime_mock.return_value = timestamp
     time_mock.return_value = timestamp
     mock_function.return_value = 1
     assert cached_my_func(1) == 1
+    os.utime(utils._get_cache_file_path(my_func, (1,), {}), (timestamp, timestamp))
     mock_function.return_value = 2
     assert cached_my_func(1) == 1
 
@@ -120,6 +153,44 @@ def test_cache_will_auto_invalidate_after_set_time(getmtime_mock, time_mock):
     assert cached_my_func(1) == 2
 
 
+@patch('chaiverse.utils.time')
+def test_cache_records_hits_stale_entries_and_misses(time_mock):
+    timestamp = 1704096000
+    time_mock.return_value = timestamp
+    assert utils.cache(add)(1, 2) == 3
+    os.utime(utils._get_cache_file_path(add, (1, 2), {}), (timestamp, timestamp))
+    assert utils.cache(add)(1, 2) == 3
+    time_mock.return_value = timestamp + 6 * 3600
+    assert utils.cache(add)(1, 2) == 3
+    stats = utils.get_cache_stats().as_dict()['add']
+    assert (stats['hits'], stats['stale'], stats['misses']) == (1, 1, 1)
+    assert stats['bytes_written'] > 0
+
+
+def test_load_from_cache_records_bytes_read_and_memory_hits():
+    file_path = os.path.join(utils.guanaco_data_dir(), 'cache', 'cache-add-key.pkl')
+    utils._save_to_cache(file_path, 'value')
+    utils._memory_cache.clear()
+    utils._load_from_cache(file_path)
+    utils._load_from_cache(file_path)
+    stats = utils.get_cache_stats().as_dict()['add']
+    assert stats['bytes_read'] == os.path.getsize(file_path)
+    assert stats['load_time']['count'] == 1
+    assert stats['memory_hits'] == 1
+
+
+def test_get_cache_usage_summarises_entries_by_cache():
+    cache_dir = os.path.join(utils.guanaco_data_dir(), 'cache')
+    for name in ['cache-add-key.pkl', 'http-digest.pkl', 'submission-id.pkl']:
+        utils._save_to_cache(os.path.join(cache_dir, name), 'value')
+    os.utime(os.path.join(cache_dir, 'http-digest.pkl'), (0, 0))
+    usage = utils.get_cache_usage()
+    assert sorted(usage) == ['add', 'feedback', 'http']
+    assert usage['http']['expired'] == 1
+    assert usage['add']['entries'] == 1 and usage['add']['expired'] == 0
+    assert [os.path.basename(entry.key) for entry in utils.list_cache_entries()][-1] == 'http-digest.pkl'
+
+
 def test_get_hex_digest():
     digest1 = utils.get_hexdigest('1')
     digest2 = utils.get_hexdigest('2')
@@ -191,3 +262,264 @@ class TestDistributeToWorkers:
         assert list(utils.distribute_to_workers(sorted, [[2,1,3], [5,3,4]], max_workers=1, worker_type=worker_type, reverse=True)) == [[3,2,1], [5,4,3]]
         assert list(utils.distribute_to_workers(sorted, [[2,1,3], [5,3,4]], max_workers=1, worker_type=worker_type, reverse=False)) == [[1,2,3], [3,4,5]]
 
+
+
+def test_load_from_cache_serves_repeated_reads_from_memory(tmpdir):
+    file_path = os.path.join(tmpdir, 'entry.pkl')
+    utils._save_to_cache(file_path, {'some': 'data'})
+    with patch('chaiverse.lib.cache_tools.pickle.load') as load_mock:
+        assert utils._load_from_cache(file_path) == {'some': 'data'}
+        assert utils._load_from_cache(file_path) == {'some': 'data'}
+    load_mock.assert_not_called()
+
+
+def test_load_from_cache_reloads_when_file_is_rewritten(tmpdir):
+    file_path = os.path.join(tmpdir, 'entry.pkl')
+    utils._save_to_cache(file_path, {'some': 'data'})
+    assert utils._load_from_cache(file_path) == {'some': 'data'}
+    with open(file_path, 'wb') as f:
+        pickle.dump({'other': 'process'}, f)
+    os.utime(file_path, ns=(0, 0))
+    assert utils._load_from_cache(file_path) == {'other': 'process'}
+
+
+def test_touch_cache_keeps_memory_entry(tmpdir):
+    file_path = os.path.join(tmpdir, 'entry.pkl')
+    utils._save_to_cache(file_path, {'some': 'data'})
+    os.utime(file_path, ns=(0, 0))
+    utils._load_from_cache(file_path)
+    utils._touch_cache(file_path)
+    assert time.time() - os.path.getmtime(file_path) < 60
+    with patch('chaiverse.lib.cache_tools.pickle.load') as load_mock:
+        assert utils._load_from_cache(file_path) == {'some': 'data'}
+    load_mock.assert_not_called()
+
+
+def test_save_to_cache_evicts_least_recently_used_entries(tmpdir):
+    paths = [os.path.join(tmpdir, f'entry-{i}.pkl') for i in range(3)]
+    with patch('chaiverse.utils.CACHE_MAX_BYTES', 10 ** 6):
+        for path in paths[:2]:
+            utils._save_to_cache(path, b'x' * 1000)
+        os.utime(paths[0], (1, 1))
+        os.utime(paths[1], (0, 0))
+        utils._load_from_cache(paths[0])
+    entry_size = os.path.getsize(paths[0])
+    with patch('chaiverse.utils.CACHE_MAX_BYTES', 2 * entry_size):
+        utils._save_to_cache(paths[2], b'x' * 1000)
+    assert os.path.exists(paths[0])
+    assert not os.path.exists(paths[1])
+    assert os.path.exists(paths[2])
+
+
+def test_save_to_cache_prunes_only_when_tracked_size_exceeds_budget(tmpdir):
+    backend = utils.get_cache_backend()
+    with patch.object(backend, 'list_entries', wraps=backend.list_entries) as list_entries_mock, \
+            patch.object(backend, 'prune', wraps=backend.prune) as prune_mock:
+        with patch('chaiverse.utils.CACHE_MAX_BYTES', 10 ** 6):
+            for i in range(5):
+                utils._save_to_cache(os.path.join(tmpdir, f'entry-{i}.pkl'), b'x' * 1000)
+            utils._save_to_cache(os.path.join(tmpdir, 'entry-0.pkl'), b'x' * 1000)
+        assert list_entries_mock.call_count == 1
+        prune_mock.assert_not_called()
+        with patch('chaiverse.utils.CACHE_MAX_BYTES', 5500):
+            utils._save_to_cache(os.path.join(tmpdir, 'entry-5.pkl'), b'x' * 1000)
+        prune_mock.assert_called_once()
+    assert len(os.listdir(tmpdir)) == 5
+
+
+def test_memory_cache_is_charged_uncompressed_size(tmpdir):
+    file_path = os.path.join(tmpdir, 'entry.pkl')
+    data = {'feedback': ['some repeated conversation text'] * 100}
+    pickled_size = len(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+    utils._save_to_cache(file_path, data, codec='zlib')
+    assert os.path.getsize(file_path) < pickled_size
+    assert utils._memory_cache.nbytes == pickled_size
+    utils._memory_cache.clear()
+    utils._load_from_cache(file_path)
+    assert utils._memory_cache.nbytes == pickled_size
+    utils._touch_cache(file_path)
+    assert utils._memory_cache.nbytes == pickled_size
+
+
+def test_load_from_cache_keeps_modification_time(tmpdir):
+    file_path = os.path.join(tmpdir, 'entry.pkl')
+    utils._save_to_cache(file_path, 'data')
+    os.utime(file_path, (0, 0))
+    utils._load_from_cache(file_path)
+    assert os.path.getmtime(file_path) == 0
+    assert os.path.getatime(file_path) > 0
+
+
+def test_prune_cache_reports_removed_entries(tmpdir):
+    for i in range(3):
+        utils._save_to_cache(os.path.join(tmpdir, f'entry-{i}.pkl'), 'data')
+    total_bytes = sum(os.path.getsize(os.path.join(tmpdir, name)) for name in os.listdir(tmpdir))
+    assert utils.prune_cache(0, cache_dir=str(tmpdir)) == (3, total_bytes)
+    assert os.listdir(tmpdir) == []
+
+
+def test_save_to_cache_replaces_entry_atomically(tmpdir):
+    file_path = os.path.join(tmpdir, 'entry.pkl')
+    utils._save_to_cache(file_path, 'old')
+    with patch('chaiverse.lib.file_tools.os.replace', side_effect=RuntimeError('interrupted')):
+        with pytest.raises(RuntimeError):
+            utils._save_to_cache(file_path, 'new')
+    assert os.listdir(tmpdir) == ['entry.pkl']
+    utils._memory_cache.clear()
+    assert utils._load_from_cache(file_path) == 'old'
+
+
+def test_cache_concurrent_callers_wait_for_first_writer():
+    calls = []
+
+    @utils.cache
+    def slow_func(a):
+        calls.append(a)
+        time.sleep(0.2)
+        return a * 2
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(slow_func(21))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [42] * 4
+    assert calls == [21]
+
+
+def test_cache_regenerate_reuses_entry_refreshed_while_waiting(tmpdir):
+    mock_function = Mock(return_value=1)
+
+    def my_func(a):
+        return mock_function(a)
+
+    file_path = utils._get_cache_file_path(my_func, (1,), {})
+    with utils.cache_lock(file_path):
+        thread = threading.Thread(target=lambda: utils.cache(my_func, regenerate=True)(1))
+        thread.start()
+        time.sleep(0.1)
+        utils._save_to_cache(file_path, 2)
+    thread.join()
+    mock_function.assert_not_called()
+
+
+@pytest.fixture()
+def sqlite_cache_backend(tmpdir):
+    backend = utils.SQLiteCacheBackend(os.path.join(tmpdir, 'cache.sqlite3'))
+    previous_backend = utils.set_cache_backend(backend)
+    yield backend
+    utils.set_cache_backend(previous_backend)
+
+
+def test_cache_with_sqlite_backend_stores_entries_in_database(sqlite_cache_backend, tmpdir):
+    mock_function = Mock(return_value=1)
+
+    @utils.cache
+    def my_func(a):
+        return mock_function(a)
+
+    assert my_func(1) == 1
+    utils._memory_cache.clear()
+    assert my_func(1) == 1
+    assert mock_function.call_count == 1
+    assert not [name for name in os.listdir(os.path.join(tmpdir, 'cache')) if name.endswith('.pkl')]
+
+
+@patch.dict(os.environ, {'GUANACO_CACHE_BACKEND': 'sqlite'})
+def test_default_cache_backend_is_selected_from_environment(tmpdir):
+    backend = utils._create_default_cache_backend()
+    assert isinstance(backend, utils.SQLiteCacheBackend)
+    assert backend.db_path == os.path.join(tmpdir, 'cache.sqlite3')
+
+
+def _make_stale(file_path, hours):
+    stale_time = time.time() - hours * 3600
+    os.utime(file_path, (stale_time, stale_time))
+
+
+def test_cache_stale_while_revalidate_returns_stale_value_and_refreshes():
+    release = threading.Event()
+    mock_function = Mock(return_value=1)
+
+    def my_func(a):
+        release.wait(5)
+        return mock_function(a)
+
+    cached_my_func = utils.cache(my_func, stale_while_revalidate=True)
+    release.set()
+    assert cached_my_func(1) == 1
+    _make_stale(utils._get_cache_file_path(my_func, (1,), {}), utils.CACHE_UPDATE_HOURS + 1)
+
+    release.clear()
+    mock_function.return_value = 2
+    assert cached_my_func(1) == 1
+    refresh = cached_my_func.get_pending_refresh(1)
+    assert refresh is not None
+    release.set()
+    assert refresh.result(timeout=5) == 2
+    assert cached_my_func(1) == 2
+    assert mock_function.call_count == 2
+
+
+def test_cache_stale_while_revalidate_blocks_past_max_staleness():
+    mock_function = Mock(return_value=1)
+
+    def my_func(a):
+        return mock_function(a)
+
+    cached_my_func = utils.cache(my_func, stale_while_revalidate=True, max_stale_hours=1)
+    assert cached_my_func(1) == 1
+    _make_stale(utils._get_cache_file_path(my_func, (1,), {}), utils.CACHE_UPDATE_HOURS + 2)
+    mock_function.return_value = 2
+    assert cached_my_func(1) == 2
+    assert cached_my_func.get_pending_refresh(1) is None
+
+
+def test_wait_for_cache_refreshes_waits_for_background_refresh():
+    mock_function = Mock(return_value=1)
+
+    def my_func(a):
+        time.sleep(0.1)
+        return mock_function(a)
+
+    cached_my_func = utils.cache(my_func, stale_while_revalidate=True)
+    cached_my_func(1)
+    _make_stale(utils._get_cache_file_path(my_func, (1,), {}), utils.CACHE_UPDATE_HOURS + 1)
+    mock_function.return_value = 2
+    assert cached_my_func(1) == 1
+    utils.wait_for_cache_refreshes(timeout=5)
+    assert cached_my_func.get_pending_refresh(1) is None
+    assert utils.cache(my_func)(1) == 2
+
+
+def get_rows(submission_ids, params=None, limit=10):
+    return submission_ids, params, limit
+
+
+def test_cache_key_merges_positional_keyword_and_default_arguments():
+    expected = utils._get_cache_file_path(get_rows, (['a'],), {})
+    assert utils._get_cache_file_path(get_rows, (), {'submission_ids': ['a']}) == expected
+    assert utils._get_cache_file_path(get_rows, (['a'], None), {'limit': 10}) == expected
+    assert utils._get_cache_file_path(get_rows, (['a'],), {'limit': 11}) != expected
+
+
+def test_cache_key_is_independent_of_mapping_order():
+    params_a = {'start_date': 'from', 'end_date': 'to', 'filters': {'a': 1, 'b': {2, 3}}}
+    params_b = {'filters': {'b': {3, 2}, 'a': 1}, 'end_date': 'to', 'start_date': 'from'}
+    key_a = utils._get_cache_file_path(get_rows, (['a'], params_a), {})
+    assert key_a == utils._get_cache_file_path(get_rows, (['a'], params_b), {})
+    assert key_a != utils._get_cache_file_path(get_rows, (['a'], {**params_a, 'end_date': 'later'}), {})
+
+
+def test_cache_key_keeps_sequence_order_and_type():
+    key = utils._get_cache_file_path(get_rows, (['a', 'b'],), {})
+    assert key != utils._get_cache_file_path(get_rows, (['b', 'a'],), {})
+    assert key != utils._get_cache_file_path(get_rows, (('a', 'b'),), {})
+
+
+def test_cache_binds_signature_once_per_function():
+    utils._get_signature.cache_clear()
+    for i in range(3):
+        utils._get_cache_file_path(get_rows, ([i],), {})
+    assert utils._get_signature.cache_info().misses == 1
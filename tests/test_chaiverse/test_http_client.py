@@ -1,3 +1,9 @@
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
 import pytest
 import requests
 from unittest.mock import patch
@@ -5,9 +11,25 @@ from unittest.mock import patch
 import vcr
 import os
 
-from chaiverse.http_client import SubmitterClient, FeedbackClient
+from chaiverse.http_client import (
+    SubmitterClient,
+    FeedbackClient,
+    SessionPool,
+    RetryPolicy,
+    CircuitBreaker,
+    CircuitOpenError,
+    RequestMetrics,
+    SingleFlight,
+    configure_rate_limit,
+    get_request_metrics,
+    remove_rate_limit,
+)
+from chaiverse.utils import CachedResponse
+from chaiverse import http_client as http_client_module
 from chaiverse.login_cli import auto_authenticate
 
+from mock_responses import MockJSONResponse
+
 
 filtered_vcr = vcr.VCR(filter_headers = ["Authorization", "developer_key"])
 current_dir = os.path.dirname(os.path.realpath(__file__))
@@ -15,12 +37,20 @@ current_dir = os.path.dirname(os.path.realpath(__file__))
 
 @pytest.fixture()
 def mock_post():
-    with patch("chaiverse.http_client.requests.post") as func:
-        func.return_value.status_code = 200
+    with patch("chaiverse.http_client.requests.Session.post") as func:
+        func.return_value = MockJSONResponse()
         func.return_value.json.return_value = {"submission_id": "name_123456"}
         yield func
 
 
+@pytest.fixture()
+def mock_get():
+    with patch("chaiverse.http_client.requests.Session.get") as func:
+        func.return_value = MockJSONResponse()
+        func.return_value.json.return_value = {}
+        yield func
+
+
 @pytest.fixture()
 def mock_submission():
     submission = {
@@ -193,3 +223,465 @@ def test_submitter_client_post_raises_with_bad_developer_key(mock_submission):
         response = http_client.post(endpoint, data=data)
 
 
+def test_session_pool_reuses_session_for_same_hostname():
+    with SessionPool() as session_pool:
+        session = session_pool.get_session("https://guanaco-submitter.chai-research.com")
+        assert session is session_pool.get_session("https://guanaco-submitter.chai-research.com/")
+        assert session is not session_pool.get_session("https://guanaco-feedback.chai-research.com")
+
+
+def test_session_pool_configures_pool_size():
+    with SessionPool(pool_size=32) as session_pool:
+        session = session_pool.get_session("https://guanaco-submitter.chai-research.com")
+        adapter = session.get_adapter("https://guanaco-submitter.chai-research.com")
+        assert adapter._pool_maxsize == 32
+
+
+def test_session_pool_close_closes_sessions():
+    session_pool = SessionPool()
+    session = session_pool.get_session("https://guanaco-submitter.chai-research.com")
+    with patch.object(session, "close") as close:
+        session_pool.close()
+    close.assert_called_once()
+    assert session is not session_pool.get_session("https://guanaco-submitter.chai-research.com")
+
+
+class SetCookieHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps({"cookie": self.headers.get("Cookie")}).encode()
+        self.send_response(200)
+        self.send_header("Set-Cookie", "session=CR_test; Path=/")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_session_pool_does_not_share_cookies_between_developer_keys():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SetCookieHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    hostname = f"http://127.0.0.1:{server.server_port}"
+    try:
+        with SessionPool() as session_pool:
+            SubmitterClient(developer_key="CR_test", hostname=hostname, session_pool=session_pool).get("/models")
+            response = SubmitterClient(developer_key="CR_other", hostname=hostname, session_pool=session_pool).get("/models")
+            assert response == {"cookie": None}
+            assert len(session_pool.get_session(hostname).cookies) == 0
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_clients_share_default_session_pool():
+    submitter_client = SubmitterClient(developer_key="CR_test")
+    other_submitter_client = SubmitterClient(developer_key="CR_other")
+    feedback_client = FeedbackClient(developer_key="CR_test")
+    default_session_pool = http_client_module.get_default_session_pool()
+    assert submitter_client.session is other_submitter_client.session
+    assert submitter_client.session is default_session_pool.get_session(submitter_client.hostname)
+    assert feedback_client.session is default_session_pool.get_session(feedback_client.hostname)
+
+
+def test_client_uses_given_session_pool(mock_post):
+    with SessionPool() as session_pool:
+        http_client = SubmitterClient(developer_key="CR_test", session_pool=session_pool)
+        assert http_client.session is session_pool.get_session(http_client.hostname)
+        response = http_client.post(endpoint="/models/submit", data={})
+    assert response == {"submission_id": "name_123456"}
+
+
+def mock_response(status_code, payload=None, headers=None):
+    return MockJSONResponse(status_code, payload, headers)
+
+
+@pytest.fixture()
+def mock_sleep():
+    with patch("chaiverse.http_client.time.sleep") as func:
+        yield func
+
+
+@patch("chaiverse.http_client.requests.Session.get")
+def test_client_retries_transient_server_errors(mock_get, mock_sleep):
+    mock_get.side_effect = [mock_response(502), mock_response(503), mock_response(200, {"status": "ok"})]
+    http_client = SubmitterClient(developer_key="CR_test")
+    assert http_client.get("/models/{submission_id}", submission_id="test_model") == {"status": "ok"}
+    assert mock_get.call_count == 3
+    assert mock_sleep.call_count == 2
+
+
+@patch("chaiverse.http_client.requests.Session.get")
+def test_client_closes_retried_streamed_responses(mock_get, mock_sleep):
+    responses = [mock_response(502), mock_response(503), mock_response(404, {"error": "not found"})]
+    mock_get.side_effect = responses
+    http_client = FeedbackClient(developer_key="CR_test")
+    with pytest.raises(AssertionError):
+        http_client.stream_mapping("/feedback/{submission_id}", "feedback", print, submission_id="test_model")
+    assert [response.close.call_count for response in responses] == [1, 1, 1]
+
+
+@patch("chaiverse.http_client.requests.Session.get")
+def test_client_retries_connection_errors(mock_get, mock_sleep):
+    mock_get.side_effect = [requests.ConnectionError(), mock_response(200, {"status": "ok"})]
+    http_client = SubmitterClient(developer_key="CR_test")
+    assert http_client.get("/models/{submission_id}", submission_id="test_model") == {"status": "ok"}
+    assert mock_get.call_count == 2
+
+
+@patch("chaiverse.http_client.requests.Session.get")
+def test_client_does_not_retry_client_errors(mock_get, mock_sleep):
+    mock_get.return_value = mock_response(404, {"error": "not found"})
+    http_client = SubmitterClient(developer_key="CR_test")
+    with pytest.raises(AssertionError) as ex:
+        http_client.get("/models/{submission_id}", submission_id="test_model")
+    assert "not found" in str(ex)
+    assert mock_get.call_count == 1
+    mock_sleep.assert_not_called()
+
+
+@patch("chaiverse.http_client.requests.Session.get")
+def test_client_gives_up_after_max_attempts(mock_get, mock_sleep):
+    mock_get.return_value = mock_response(502, {"error": "bad gateway"})
+    http_client = SubmitterClient(developer_key="CR_test", retry_policy=RetryPolicy(max_attempts=3))
+    with pytest.raises(AssertionError) as ex:
+        http_client.get("/models/{submission_id}", submission_id="test_model")
+    assert "bad gateway" in str(ex)
+    assert mock_get.call_count == 3
+
+
+@patch("chaiverse.http_client.requests.Session.get")
+def test_client_raises_error_text_for_non_json_error(mock_get, mock_sleep):
+    response = mock_response(404)
+    response.json.side_effect = ValueError()
+    response.text = "<html>not found</html>"
+    mock_get.return_value = response
+    http_client = SubmitterClient(developer_key="CR_test")
+    with pytest.raises(AssertionError) as ex:
+        http_client.get("/models/bad_endpoint")
+    assert "<html>not found</html>" in str(ex)
+
+
+@patch("chaiverse.http_client.requests.Session.post")
+def test_client_does_not_retry_post_when_request_may_have_been_processed(mock_post, mock_sleep):
+    mock_post.side_effect = [mock_response(502), requests.ReadTimeout()]
+    http_client = SubmitterClient(developer_key="CR_test")
+    with pytest.raises(AssertionError):
+        http_client.post("/models/submit", data={})
+    with pytest.raises(requests.ReadTimeout):
+        http_client.post("/models/submit", data={})
+    assert mock_post.call_count == 2
+
+
+@patch("chaiverse.http_client.requests.Session.post")
+def test_client_retries_post_when_request_was_not_processed(mock_post, mock_sleep):
+    mock_post.side_effect = [mock_response(429, headers={"Retry-After": "2"}), mock_response(200, {"ok": True})]
+    http_client = SubmitterClient(developer_key="CR_test")
+    assert http_client.post("/models/submit", data={}) == {"ok": True}
+    assert mock_sleep.call_args[0][0] >= 2
+
+
+def test_retry_policy_backoff_is_bounded():
+    retry_policy = RetryPolicy(max_attempts=10, backoff_base=1, backoff_max=4, deadline=1000)
+    delays = [retry_policy.get_delay(attempt, elapsed=0) for attempt in range(9)]
+    assert all(0 <= delay <= 4 for delay in delays)
+    assert retry_policy.get_delay(9, elapsed=0) is None
+
+
+def test_retry_policy_respects_deadline():
+    retry_policy = RetryPolicy(max_attempts=10, backoff_base=1, backoff_max=4, deadline=10)
+    assert retry_policy.get_delay(0, elapsed=5) is not None
+    assert retry_policy.get_delay(0, elapsed=10) is None
+
+
+def test_circuit_breaker_opens_after_consecutive_failures():
+    circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    circuit_breaker.record_failure()
+    circuit_breaker.before_request()
+    circuit_breaker.record_failure()
+    assert circuit_breaker.state == 'open'
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.before_request()
+
+
+@patch("chaiverse.http_client.time.monotonic")
+def test_circuit_breaker_lets_single_trial_through_after_reset_timeout(mock_monotonic):
+    mock_monotonic.return_value = 100
+    circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    circuit_breaker.record_failure()
+    mock_monotonic.return_value = 130
+    assert circuit_breaker.state == 'half-open'
+    circuit_breaker.before_request()
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.before_request()
+    circuit_breaker.record_success()
+    assert circuit_breaker.state == 'closed'
+
+
+@patch("chaiverse.http_client.requests.Session.get")
+def test_client_fails_fast_while_circuit_is_open(mock_get, mock_sleep):
+    mock_get.return_value = mock_response(503, {"error": "unavailable"})
+    http_client = SubmitterClient(developer_key="CR_test", retry_policy=RetryPolicy(max_attempts=5))
+    with pytest.raises(AssertionError):
+        http_client.get("/models/{submission_id}", submission_id="test_model")
+    assert mock_get.call_count == 5
+    with pytest.raises(CircuitOpenError):
+        http_client.get("/models/{submission_id}", submission_id="test_model")
+    assert mock_get.call_count == 5
+
+
+@patch("chaiverse.http_client.requests.Session.get")
+def test_client_get_conditional_returns_cached_response_when_not_modified(mock_get):
+    mock_get.return_value = mock_response(304)
+    cached_response = CachedResponse({"feedback": {}}, etag='"v1"')
+    http_client = FeedbackClient(developer_key="CR_test")
+    response = http_client.get_conditional("/feedback/{submission_id}", cached_response, submission_id="test_model")
+    assert response is cached_response
+    mock_get.assert_called_once_with(
+        url="https://guanaco-feedback.chai-research.com/feedback/test_model",
+        headers={"Authorization": "Bearer CR_test", "If-None-Match": '"v1"'},
+    )
+    mock_get.return_value.json.assert_not_called()
+
+
+@patch("chaiverse.http_client.requests.Session.get")
+def test_client_get_conditional_returns_new_response_with_validators(mock_get):
+    headers = {"ETag": '"v2"', "Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"}
+    mock_get.return_value = mock_response(200, {"feedback": {"a": 1}}, headers=headers)
+    cached_response = CachedResponse({"feedback": {}}, etag='"v1"')
+    http_client = FeedbackClient(developer_key="CR_test")
+    response = http_client.get_conditional("/feedback/{submission_id}", cached_response, submission_id="test_model")
+    assert response == CachedResponse({"feedback": {"a": 1}}, '"v2"', "Wed, 21 Oct 2015 07:28:00 GMT")
+
+
+class GzipFeedbackHandler(BaseHTTPRequestHandler):
+    payload = {"feedback": {"convo_1": {"thumbs_up": True}, "convo_2": {"thumbs_up": False}}, "thumbs_up": 1, "thumbs_down": 1}
+
+    def do_GET(self):
+        assert "gzip" in self.headers["Accept-Encoding"]
+        body = gzip.compress(json.dumps(self.payload).encode())
+        self.send_response(200)
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def gzip_feedback_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), GzipFeedbackHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_client_stream_mapping_decodes_compressed_items_one_at_a_time(gzip_feedback_server):
+    items = []
+    http_client = FeedbackClient(developer_key="CR_test", hostname=gzip_feedback_server)
+    fields = http_client.stream_mapping("/feedback/{submission_id}", "feedback", lambda *item: items.append(item), submission_id="test_model")
+    assert items == [("convo_1", {"thumbs_up": True}), ("convo_2", {"thumbs_up": False})]
+    assert fields == {"thumbs_up": 1, "thumbs_down": 1}
+
+
+@patch("chaiverse.http_client.requests.Session.get")
+def test_client_stream_mapping_raises_for_bad_request(mock_get):
+    mock_get.return_value = mock_response(404, {"error": "not found"})
+    http_client = FeedbackClient(developer_key="CR_test")
+    with pytest.raises(AssertionError) as ex:
+        http_client.stream_mapping("/feedback/{submission_id}", "feedback", print, submission_id="test_model")
+    assert "not found" in str(ex)
+
+
+@pytest.fixture()
+def rate_limits(tmpdir):
+    with patch("chaiverse.http_client.guanaco_data_dir", return_value=str(tmpdir)):
+        yield
+    remove_rate_limit("https://guanaco-feedback.chai-research.com")
+    remove_rate_limit("https://guanaco-feedback.chai-research.com", endpoint="/feedback/{submission_id}")
+
+
+@patch("chaiverse.lib.rate_limit_tools.TokenBucket.acquire", autospec=True)
+def test_client_acquires_host_and_endpoint_rate_limits(mock_acquire, rate_limits, mock_get):
+    configure_rate_limit("https://guanaco-feedback.chai-research.com", rate=10)
+    configure_rate_limit("https://guanaco-feedback.chai-research.com", rate=2, endpoint="/feedback/{submission_id}")
+    http_client = FeedbackClient(developer_key="CR_test")
+    http_client.get("/feedback/{submission_id}", submission_id="test_model")
+    assert sorted(call[0][0].rate for call in mock_acquire.call_args_list) == [2, 10]
+
+    mock_acquire.reset_mock()
+    http_client.get("/models/")
+    assert [call[0][0].rate for call in mock_acquire.call_args_list] == [10]
+
+
+@patch("chaiverse.lib.rate_limit_tools.TokenBucket.acquire", autospec=True)
+def test_client_is_not_rate_limited_by_other_hosts(mock_acquire, rate_limits, mock_get):
+    configure_rate_limit("https://guanaco-feedback.chai-research.com", rate=10)
+    http_client = SubmitterClient(developer_key="CR_test")
+    http_client.get("/models/")
+    mock_acquire.assert_not_called()
+
+
+def test_shared_rate_limit_keeps_state_under_data_dir(rate_limits, tmpdir, mock_get):
+    configure_rate_limit("https://guanaco-feedback.chai-research.com", rate=10)
+    FeedbackClient(developer_key="CR_test").get("/feedback/{submission_id}", submission_id="test_model")
+    assert len(os.listdir(os.path.join(tmpdir, "rate_limits"))) == 1
+
+
+@patch("chaiverse.http_client.requests.Session.get")
+def test_client_records_request_metrics_per_endpoint_template(mock_get, mock_sleep):
+    mock_get.side_effect = [mock_response(502), mock_response(200, {"status": "ok"})]
+    SubmitterClient(developer_key="CR_test").get("/models/{submission_id}", submission_id="test_model")
+    metrics = get_request_metrics().as_dict()["/models/{submission_id}"]["GET"]
+    assert metrics["requests"] == 2
+    assert metrics["status_codes"] == {"502": 1, "200": 1}
+    assert metrics["retries"] == 1
+    assert metrics["response_bytes"] == len(b'{"status": "ok"}')
+    assert metrics["decode_time"]["count"] == 1
+    assert metrics["latency"]["count"] == 2
+
+
+@patch("chaiverse.http_client.requests.Session.get")
+def test_client_records_failed_requests_as_errors(mock_get):
+    mock_get.side_effect = ValueError("boom")
+    with pytest.raises(ValueError):
+        SubmitterClient(developer_key="CR_test").get("/models/")
+    assert get_request_metrics().as_dict()["/models/"]["GET"]["status_codes"] == {"error": 1}
+
+
+def test_client_records_streamed_response_bytes(gzip_feedback_server):
+    http_client = FeedbackClient(developer_key="CR_test", hostname=gzip_feedback_server)
+    http_client.stream_mapping("/feedback/{submission_id}", "feedback", lambda *item: None, submission_id="test_model")
+    metrics = get_request_metrics().as_dict()["/feedback/{submission_id}"]["GET"]
+    assert metrics["status_codes"] == {"200": 1}
+    assert metrics["response_bytes"] > 0
+
+
+def test_request_metrics_latency_histogram_is_cumulative():
+    metrics = RequestMetrics(latency_buckets=(0.1, 1.0))
+    metrics.record_response("GET", "/models/", 200, 0.05)
+    metrics.record_response("GET", "/models/", 200, 0.5)
+    metrics.record_response("GET", "/models/", 200, 5.0)
+    latency = metrics.as_dict()["/models/"]["GET"]["latency"]
+    assert latency["buckets"] == {0.1: 1, 1.0: 2}
+    assert latency["count"] == 3
+    assert latency["sum"] == pytest.approx(5.55)
+
+
+def test_request_metrics_to_prometheus():
+    metrics = RequestMetrics(latency_buckets=(0.1, 1.0))
+    metrics.record_response("GET", "/models/", 200, 0.5)
+    metrics.record_decode("GET", "/models/", 128, 0.25)
+    metrics.record_retry("GET", "/models/")
+    lines = metrics.to_prometheus().splitlines()
+    labels = 'endpoint="/models/",method="GET"'
+    assert "# TYPE chaiverse_http_request_duration_seconds histogram" in lines
+    assert f'chaiverse_http_requests_total{{{labels},status="200"}} 1' in lines
+    assert f'chaiverse_http_request_duration_seconds_bucket{{{labels},le="0.1"}} 0' in lines
+    assert f'chaiverse_http_request_duration_seconds_bucket{{{labels},le="1.0"}} 1' in lines
+    assert f'chaiverse_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 1' in lines
+    assert f'chaiverse_http_response_bytes_total{{{labels}}} 128' in lines
+    assert f'chaiverse_http_decode_duration_seconds_sum{{{labels}}} 0.25' in lines
+    assert f'chaiverse_http_retries_total{{{labels}}} 1' in lines
+
+
+def test_request_metrics_escapes_prometheus_label_values():
+    metrics = RequestMetrics()
+    metrics.record_retry("GET", '/models/"quoted"')
+    assert 'endpoint="/models/\\"quoted\\""' in metrics.to_prometheus()
+
+
+def _run_in_threads(func, num_threads):
+    results = [None] * num_threads
+    errors = [None] * num_threads
+
+    def run(i):
+        try:
+            results[i] = func()
+        except Exception as ex:
+            errors[i] = ex
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def func():
+        calls.append(1)
+        release.wait(5)
+        return {"status": "ok"}
+
+    threads, results, errors = _run_in_threads(lambda: single_flight.do("key", func), 5)
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == [{"status": "ok"}] * 5
+    assert single_flight.do("key", lambda: "new call") == "new call"
+
+
+def test_single_flight_shares_exceptions():
+    single_flight = SingleFlight()
+    release = threading.Event()
+
+    def func():
+        release.wait(5)
+        raise ValueError("boom")
+
+    threads, results, errors = _run_in_threads(lambda: single_flight.do("key", func), 3)
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert all(isinstance(error, ValueError) for error in errors)
+
+
+@patch("chaiverse.http_client.requests.Session.get")
+def test_client_coalesces_concurrent_identical_gets(mock_get):
+    release = threading.Event()
+
+    def slow_get(**kwargs):
+        release.wait(5)
+        return mock_response(200, {"status": "deployed"})
+
+    mock_get.side_effect = slow_get
+    http_client = SubmitterClient(developer_key="CR_test")
+    get_info = lambda: http_client.get("/models/{submission_id}", submission_id="test_model")
+    threads, results, errors = _run_in_threads(get_info, 4)
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert mock_get.call_count == 1
+    assert results == [{"status": "deployed"}] * 4
+
+
+@patch("chaiverse.http_client.requests.Session.get")
+def test_client_does_not_coalesce_requests_with_other_developer_keys(mock_get):
+    release = threading.Event()
+
+    def slow_get(**kwargs):
+        release.wait(5)
+        return mock_response(200, {"status": "deployed"})
+
+    mock_get.side_effect = slow_get
+    get_info = lambda key: SubmitterClient(developer_key=key).get("/models/{submission_id}", submission_id="test_model")
+    threads_a, _, _ = _run_in_threads(lambda: get_info("CR_a"), 1)
+    threads_b, _, _ = _run_in_threads(lambda: get_info("CR_b"), 1)
+    time.sleep(0.1)
+    release.set()
+    for thread in threads_a + threads_b:
+        thread.join()
+    assert mock_get.call_count == 2
@@ -0,0 +1,292 @@
+import os
+import pickle
+import threading
+import time
+
+import pytest
+
+from chaiverse.lib import cache_tools
+from chaiverse.lib.cache_tools import CacheStats, LRUCache, PickleCacheBackend, SQLiteCacheBackend, CacheFileLocks
+
+
+def test_lru_cache_evicts_least_recently_used_entry():
+    cache = LRUCache(max_bytes=100, max_entries=2)
+    cache.put('a', 1, 10)
+    cache.put('b', 2, 10)
+    assert cache.get('a') == 1
+    cache.put('c', 3, 10)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+
+
+def test_lru_cache_is_bounded_by_bytes():
+    cache = LRUCache(max_bytes=25, max_entries=10)
+    cache.put('a', 1, 10)
+    cache.put('b', 2, 10)
+    cache.put('c', 3, 10)
+    assert cache.get('a') is None
+    assert cache.nbytes == 20
+
+
+def test_lru_cache_skips_values_larger_than_budget():
+    cache = LRUCache(max_bytes=10, max_entries=10)
+    cache.put('a', 1, 5)
+    cache.put('b', 2, 11)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+
+
+def test_lru_cache_replaces_and_pops_entries():
+    cache = LRUCache(max_bytes=100, max_entries=10)
+    cache.put('a', 1, 10)
+    cache.put('a', 2, 20)
+    assert cache.get('a') == 2
+    assert cache.nbytes == 20
+    cache.pop('a')
+    assert cache.get('a', 'missing') == 'missing'
+    assert cache.nbytes == 0
+
+
+def test_cache_stats_counts_lookups_and_io_per_cache():
+    stats = CacheStats()
+    stats.record_hit('leaderboard')
+    stats.record_hit('leaderboard')
+    stats.record_stale('leaderboard')
+    stats.record_miss('feedback')
+    stats.record_read('leaderboard', 100, 0.5)
+    stats.record_write('feedback', 40)
+    metrics = stats.as_dict()
+    assert metrics['leaderboard']['hits'] == 2
+    assert metrics['leaderboard']['stale'] == 1
+    assert metrics['leaderboard']['bytes_read'] == 100
+    assert metrics['leaderboard']['load_time'] == {'count': 1, 'sum': 0.5}
+    assert metrics['feedback']['misses'] == 1
+    assert metrics['feedback']['bytes_written'] == 40
+    stats.reset()
+    assert stats.as_dict() == {}
+
+
+def test_cache_file_locks_do_not_block_unrelated_keys(tmpdir):
+    locks = CacheFileLocks(str(tmpdir))
+    acquired = threading.Event()
+
+    def lock_other_key():
+        with locks.lock('other-entry'):
+            acquired.set()
+
+    with locks.lock('entry'):
+        thread = threading.Thread(target=lock_other_key)
+        thread.start()
+        assert acquired.wait(5)
+    thread.join()
+
+
+def test_cache_file_locks_exclude_other_threads(tmpdir):
+    locks = CacheFileLocks(str(tmpdir))
+    events = []
+
+    def hold_lock(name):
+        with locks.lock('entry'):
+            events.append(f'{name} acquired')
+            time.sleep(0.05)
+            events.append(f'{name} released')
+
+    threads = [threading.Thread(target=hold_lock, args=(name,)) for name in ('a', 'b')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [event.split()[1] for event in events] == ['acquired', 'released', 'acquired', 'released']
+
+
+def test_cache_file_locks_remove_lock_files_of_unused_keys_only(tmpdir):
+    locks = CacheFileLocks(str(tmpdir))
+    for key in ('kept', 'removed', 'held'):
+        with locks.lock(key):
+            pass
+    with locks.lock('held'):
+        locks.remove_unused_lock_files(['kept'])
+        assert len(os.listdir(tmpdir)) == 2
+    with locks.lock('removed'):
+        pass
+    assert len(os.listdir(tmpdir)) == 3
+
+
+def test_cache_stats_flush_merges_counts_of_every_process(tmpdir):
+    path = os.path.join(tmpdir, 'cache_stats.json')
+    for _ in range(2):
+        stats = CacheStats(lambda: path)
+        stats.record_hit('feedback')
+        stats.record_read('feedback', 100, 0.5)
+        stats.flush()
+        stats.flush()
+    stored = cache_tools.read_cache_stats(path)
+    assert stored['feedback']['hits'] == 2
+    assert stored['feedback']['bytes_read'] == 200
+    assert stored['feedback']['load_time'] == {'count': 2, 'sum': 1.0}
+    assert stats.as_dict()['feedback']['hits'] == 1
+
+
+def test_cache_stats_flush_every_interval(tmpdir):
+    path = os.path.join(tmpdir, 'cache_stats.json')
+    stats = CacheStats(lambda: path, flush_interval=0)
+    stats.record_miss('http')
+    assert cache_tools.read_cache_stats(path)['http']['misses'] == 1
+
+
+@pytest.fixture(params=['pickle', 'sqlite'])
+def backend(request, tmpdir):
+    if request.param == 'sqlite':
+        backend = SQLiteCacheBackend(os.path.join(tmpdir, 'cache.sqlite3'))
+    else:
+        backend = PickleCacheBackend()
+    return backend
+
+
+@pytest.fixture()
+def cache_dir(tmpdir):
+    cache_dir = os.path.join(tmpdir, 'cache')
+    os.makedirs(cache_dir)
+    return cache_dir
+
+
+def test_cache_backend_saves_and_loads_entries(backend, cache_dir):
+    key = os.path.join(cache_dir, 'entry.pkl')
+    with pytest.raises(FileNotFoundError):
+        backend.get_info(key)
+    info, _ = backend.save(key, {'some': 'data'})
+    assert backend.load(key)[0] == {'some': 'data'}
+    assert backend.get_info(key).version == info.version
+    assert info.size > 0
+    assert abs(info.mtime - time.time()) < 60
+
+
+def test_pickle_cache_backend_mark_access_keeps_replaced_entry_fresh(cache_dir):
+    backend = PickleCacheBackend()
+    key = os.path.join(cache_dir, 'entry.pkl')
+    backend.save(key, 'old data')
+    os.utime(key, (0, 0))
+    info = backend.get_info(key)
+    new_info, _ = backend.save(key, 'new data')
+    backend.mark_access(key, info)
+    assert backend.get_info(key).mtime_ns == new_info.mtime_ns
+    assert backend.get_info(key).atime_ns >= new_info.atime_ns
+
+
+def test_pickle_cache_backend_mark_access_keeps_modification_time(cache_dir):
+    backend = PickleCacheBackend()
+    key = os.path.join(cache_dir, 'entry.pkl')
+    backend.save(key, 'data')
+    os.utime(key, (0, 0))
+    backend.mark_access(key, backend.get_info(key))
+    assert backend.get_info(key).mtime_ns == 0
+    assert backend.get_info(key).atime_ns > 0
+
+
+def test_cache_backend_reports_uncompressed_size(backend, cache_dir):
+    key = os.path.join(cache_dir, 'entry.pkl')
+    data = {'feedback': ['some repeated conversation text'] * 100}
+    pickled_size = len(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+    info, nbytes = backend.save(key, data, codec='zlib')
+    assert info.size < nbytes == pickled_size
+    assert backend.load(key) == (data, pickled_size)
+
+
+def test_cache_backend_touch_changes_version(backend, cache_dir):
+    key = os.path.join(cache_dir, 'entry.pkl')
+    info, _ = backend.save(key, 'data')
+    time.sleep(0.01)
+    assert backend.touch(key).version != info.version
+
+
+def test_cache_backend_prunes_least_recently_used_entries(backend, cache_dir, monkeypatch):
+    monkeypatch.setattr(cache_tools, 'SQLITE_CACHE_ATIME_RESOLUTION_NS', 0)
+    keys = [os.path.join(cache_dir, f'entry-{i}.pkl') for i in range(3)]
+    for key in keys:
+        backend.save(key, b'x' * 100)
+        time.sleep(0.01)
+    backend.mark_access(keys[0], backend.get_info(keys[0]))
+    entry_size = backend.get_info(keys[0]).size
+    removed = backend.prune(2 * entry_size, cache_dir)
+    assert [entry.key for entry in removed] == [keys[1]]
+    assert sorted(entry.key for entry in backend.list_entries(cache_dir)) == [keys[0], keys[2]]
+
+
+def test_cache_backend_prune_is_scoped_to_cache_dir(backend, cache_dir, tmpdir):
+    other_dir = os.path.join(tmpdir, 'cache-other')
+    os.makedirs(other_dir)
+    other_key = os.path.join(other_dir, 'entry.pkl')
+    backend.save(other_key, 'data')
+    backend.save(os.path.join(cache_dir, 'entry.pkl'), 'data')
+    assert len(backend.prune(0, cache_dir)) == 1
+    assert backend.load(other_key)[0] == 'data'
+
+
+def test_cache_backend_prune_removes_lock_files_of_removed_entries(backend, cache_dir):
+    keys = [os.path.join(cache_dir, f'entry-{i}.pkl') for i in range(3)]
+    for key in keys:
+        with backend.lock(key):
+            backend.save(key, 'data')
+    with backend.lock(os.path.join(cache_dir, 'never-saved.pkl')):
+        pass
+    backend.prune(0, cache_dir)
+    lock_dir = os.path.join(cache_dir, 'locks') if isinstance(backend, PickleCacheBackend) else f'{backend.db_path}.locks'
+    assert os.listdir(lock_dir) == []
+
+
+def test_pickle_cache_backend_prune_removes_per_entry_lock_files(cache_dir):
+    backend = PickleCacheBackend()
+    os.makedirs(os.path.join(cache_dir, 'locks'))
+    open(os.path.join(cache_dir, 'locks', 'entry.pkl.lock'), 'w').close()
+    backend.prune(0, cache_dir)
+    assert os.listdir(os.path.join(cache_dir, 'locks')) == []
+
+
+def test_sqlite_cache_backend_ignores_entries_of_other_schema_versions(tmpdir, monkeypatch):
+    backend = SQLiteCacheBackend(os.path.join(tmpdir, 'cache.sqlite3'))
+    backend.save('entry', 'data')
+    monkeypatch.setattr(cache_tools, 'SQLITE_CACHE_SCHEMA_VERSION', cache_tools.SQLITE_CACHE_SCHEMA_VERSION + 1)
+    with pytest.raises(FileNotFoundError):
+        backend.get_info('entry')
+
+
+def test_sqlite_cache_backend_skips_recent_access_times(tmpdir):
+    backend = SQLiteCacheBackend(os.path.join(tmpdir, 'cache.sqlite3'))
+    info, _ = backend.save('entry', 'data')
+    backend.mark_access('entry', info)
+    assert backend.get_info('entry').atime_ns == info.atime_ns
+    stale_atime_ns = info.atime_ns - cache_tools.SQLITE_CACHE_ATIME_RESOLUTION_NS
+    backend._execute('UPDATE cache_entries SET atime_ns = ?', (stale_atime_ns,))
+    backend.mark_access('entry', backend.get_info('entry'))
+    assert backend.get_info('entry').atime_ns > info.atime_ns
+
+
+@pytest.mark.parametrize('codec', cache_tools.get_available_cache_codecs())
+def test_cache_entry_round_trips_with_codec(codec):
+    data = {'feedback': ['some repeated conversation text'] * 100}
+    blob = cache_tools.encode_cache_entry(data, codec)
+    assert cache_tools.decode_cache_entry(blob) == data
+    if codec != 'none':
+        assert blob.startswith(cache_tools.CACHE_ENTRY_MAGIC)
+        assert len(blob) < len(cache_tools.encode_cache_entry(data))
+
+
+def test_uncompressed_cache_entry_is_plain_pickle():
+    assert pickle.loads(cache_tools.encode_cache_entry({'some': 'data'})) == {'some': 'data'}
+
+
+def test_encode_cache_entry_rejects_unavailable_codec():
+    with pytest.raises(AssertionError):
+        cache_tools.encode_cache_entry('data', 'snappy')
+
+
+def test_cache_backend_loads_entries_written_with_other_codecs(backend, cache_dir):
+    backend.codec = 'lzma'
+    key = os.path.join(cache_dir, 'entry.pkl')
+    backend.save(key, 'lzma data')
+    backend.codec = 'zlib'
+    assert backend.load(key)[0] == 'lzma data'
+    backend.save(key, 'plain data', codec='none')
+    assert backend.load(key)[0] == 'plain data'
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+from chaiverse.lib import json_tools
+
+
+PAYLOAD = {
+    'thumbs_up': 12,
+    'feedback': {
+        'convo_1': {'text': 'héllo 👋', 'thumbs_up': True, 'score': 1234.5},
+        'convo_2': {'text': 'bye', 'thumbs_up': False, 'messages': [{'content': 'x'}]},
+    },
+    'thumbs_down': 345,
+}
+
+
+def _split_into_chunks(data, chunk_size):
+    return [data[i:i+chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+def _stream(data, chunk_size, key='feedback'):
+    items = []
+    chunks = _split_into_chunks(data, chunk_size)
+    fields = json_tools.stream_json_mapping(chunks, key, lambda name, value: items.append((name, value)))
+    return items, fields
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 10000])
+def test_stream_json_mapping_yields_each_item(chunk_size):
+    data = json.dumps(PAYLOAD, ensure_ascii=False, indent=2).encode('utf-8')
+    items, fields = _stream(data, chunk_size)
+    assert items == list(PAYLOAD['feedback'].items())
+    assert fields == {'thumbs_up': 12, 'thumbs_down': 345}
+
+
+def test_stream_json_mapping_handles_numbers_split_across_chunks():
+    data = b'{"feedback": {"a": 12345, "b": 678}, "total": 91011}'
+    items, fields = _stream(data, 1)
+    assert items == [('a', 12345), ('b', 678)]
+    assert fields == {'total': 91011}
+
+
+def test_stream_json_mapping_handles_empty_mapping():
+    items, fields = _stream(b'{"feedback": {}, "thumbs_up": 0, "thumbs_down": 0}', 5)
+    assert items == []
+    assert fields == {'thumbs_up': 0, 'thumbs_down': 0}
+
+
+def test_stream_json_mapping_without_key():
+    items, fields = _stream(b'{"thumbs_up": 0}', 5)
+    assert items == []
+    assert fields == {'thumbs_up': 0}
+
+
+@pytest.mark.parametrize("data", [
+    b'{"feedback": {"a": 1}',
+    b'{"feedback": {"a": 1} "b": 2}',
+    b'{"feedback": {"a" 1}}',
+    b'["feedback"]',
+])
+def test_stream_json_mapping_raises_for_malformed_json(data):
+    with pytest.raises(json.JSONDecodeError):
+        _stream(data, 3)
+
+
+def _get_codecs():
+    codecs = [json_tools.StdlibJSONCodec()]
+    if json_tools.orjson:
+        codecs.append(json_tools.OrjsonCodec())
+    return codecs
+
+
+@pytest.mark.parametrize('codec', _get_codecs(), ids=lambda codec: codec.name)
+def test_json_codec_round_trips_payload(codec):
+    data = codec.dumps(PAYLOAD)
+    assert isinstance(data, bytes)
+    assert codec.loads(data) == PAYLOAD
+    assert codec.loads(data.decode('utf-8')) == PAYLOAD
+    assert json.loads(data) == PAYLOAD
+
+
+def test_set_json_codec_replaces_module_codec():
+    previous_codec = json_tools.set_json_codec(json_tools.StdlibJSONCodec())
+    try:
+        assert json_tools.get_json_codec().name == 'json'
+        assert json_tools.loads(json_tools.dumps(PAYLOAD)) == PAYLOAD
+    finally:
+        json_tools.set_json_codec(previous_codec)
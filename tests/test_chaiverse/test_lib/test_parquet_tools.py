@@ -0,0 +1,33 @@
+from mock import patch
+import pytest
+
+from chaiverse.lib import parquet_tools
+
+pa = pytest.importorskip('pyarrow')
+
+
+COLUMN_TYPES = {'name': 'object', 'group': 'category', 'flag': 'bool', 'time': 'int64'}
+COLUMNS = {'name': ['a', 'b'], 'group': ['x', 'x'], 'flag': [True, False], 'time': [1, 2]}
+
+
+def test_parquet_table_round_trips_with_column_types(tmpdir):
+    path = str(tmpdir / 'table.parquet')
+    parquet_tools.write_parquet_table(path, COLUMNS, COLUMN_TYPES)
+    table = parquet_tools.read_parquet_table(path)
+    assert table.to_pydict() == COLUMNS
+    assert pa.types.is_dictionary(table.schema.field('group').type)
+    assert table.schema.field('time').type == pa.int64()
+
+
+def test_read_parquet_table_projects_columns(tmpdir):
+    path = str(tmpdir / 'table.parquet')
+    parquet_tools.write_parquet_table(path, COLUMNS, COLUMN_TYPES)
+    table = parquet_tools.read_parquet_table(path, columns=['flag'])
+    assert table.column_names == ['flag']
+
+
+def test_write_parquet_table_requires_pyarrow(tmpdir):
+    with patch('chaiverse.lib.parquet_tools.pq', None):
+        with pytest.raises(AssertionError) as ex:
+            parquet_tools.write_parquet_table(str(tmpdir / 'table.parquet'), COLUMNS, COLUMN_TYPES)
+    assert 'pip install pyarrow' in str(ex.value)
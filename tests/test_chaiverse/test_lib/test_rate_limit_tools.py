@@ -0,0 +1,79 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+from mock import patch
+import pytest
+
+from chaiverse.lib import rate_limit_tools
+from chaiverse.lib.rate_limit_tools import TokenBucket
+
+
+@pytest.fixture(autouse=True)
+def clear_rate_limits():
+    yield
+    rate_limit_tools.set_rate_limit_config({})
+
+
+@pytest.fixture()
+def mock_time():
+    with patch("chaiverse.lib.rate_limit_tools.time") as mock_time:
+        mock_time.time.return_value = 1000.0
+        yield mock_time
+
+
+def _count_granted(bucket, attempts):
+    return sum(bucket.try_acquire() == 0 for _ in range(attempts))
+
+
+def test_token_bucket_allows_burst_then_asks_to_wait(mock_time):
+    bucket = TokenBucket(rate=2, burst=3)
+    assert _count_granted(bucket, 5) == 3
+    assert bucket.try_acquire() == pytest.approx(0.5)
+
+
+def test_token_bucket_refills_at_rate(mock_time):
+    bucket = TokenBucket(rate=2, burst=3)
+    _count_granted(bucket, 3)
+    mock_time.time.return_value = 1001.0
+    assert _count_granted(bucket, 5) == 2
+
+
+def test_token_bucket_acquire_sleeps_until_token_is_available(mock_time):
+    bucket = TokenBucket(rate=4, burst=1)
+    bucket.acquire()
+
+    def sleep(seconds):
+        mock_time.time.return_value += seconds
+    mock_time.sleep.side_effect = sleep
+    bucket.acquire()
+    mock_time.sleep.assert_called_once_with(pytest.approx(0.25))
+
+
+def test_token_buckets_with_same_state_path_share_budget(mock_time, tmpdir):
+    state_path = os.path.join(tmpdir, 'bucket.lock')
+    bucket1 = TokenBucket(rate=1, burst=4, state_path=state_path)
+    bucket2 = TokenBucket(rate=1, burst=4, state_path=state_path)
+    assert _count_granted(bucket1, 3) + _count_granted(bucket2, 3) == 4
+
+
+def _count_granted_in_worker(key, attempts):
+    return _count_granted(rate_limit_tools.get_rate_limit(key), attempts)
+
+
+def test_token_bucket_budget_is_shared_across_process_pool(tmpdir):
+    state_path = os.path.join(tmpdir, 'bucket.lock')
+    rate_limit_tools.configure_rate_limit('host', rate=0.001, burst=6, state_path=state_path)
+    config = rate_limit_tools.get_rate_limit_config()
+    with ProcessPoolExecutor(3, initializer=rate_limit_tools.set_rate_limit_config, initargs=(config,)) as executor:
+        granted = list(executor.map(_count_granted_in_worker, ['host'] * 3, [5] * 3))
+    assert sum(granted) == 6
+
+
+def test_rate_limit_config_round_trip():
+    rate_limit_tools.configure_rate_limit('host', rate=5, burst=10)
+    config = rate_limit_tools.get_rate_limit_config()
+    assert config == {'host': dict(rate=5, burst=10, state_path=None)}
+    rate_limit_tools.set_rate_limit_config({})
+    assert rate_limit_tools.get_rate_limit('host') is None
+    rate_limit_tools.set_rate_limit_config(config)
+    assert rate_limit_tools.get_rate_limit('host').rate == 5
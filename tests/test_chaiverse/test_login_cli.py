@@ -2,9 +2,11 @@ import os
 
 import click
 from click.testing import CliRunner
+from mock import patch
 import pytest
 
-from chaiverse.login_cli import auto_authenticate, login, logout
+from chaiverse.lib.cache_tools import CacheStats
+from chaiverse.login_cli import auto_authenticate, cache_cli, login, logout
 
 
 @click.group()
@@ -91,5 +93,47 @@ class TestLoginCli:
         result = self.runner.invoke(print_cached_auth, env = RUNNER_ENVIRONMENT, input = 'gpt-j-6b\n')
         assert f'id=gpt-j-6b, key={DEVELOPER_KEY}' in str(result.stdout)
 
+    def test_chaiverse_cache_prune_removes_least_recently_used_entries(self):
+        cache_dir = os.path.join(TEMP_TEST_DIR, 'cache')
+        os.makedirs(cache_dir)
+        for i, name in enumerate(['old.pkl', 'new.pkl']):
+            path = os.path.join(cache_dir, name)
+            with open(path, 'wb') as f:
+                f.write(b'x' * 100)
+            os.utime(path, (i, i))
+        result = self.runner.invoke(cache_cli, ['prune', '--max-bytes', '150'], env = RUNNER_ENVIRONMENT)
+        assert result.exit_code == 0
+        assert 'Removed 1 cache entries' in result.stdout
+        assert os.listdir(cache_dir) == ['new.pkl']
+
+    def test_chaiverse_cache_stats_and_ls_describe_stored_entries(self):
+        cache_dir = os.path.join(TEMP_TEST_DIR, 'cache')
+        os.makedirs(cache_dir)
+        for name in ['cache-get_leaderboard-key.pkl', 'submission-id.pkl']:
+            with open(os.path.join(cache_dir, name), 'wb') as f:
+                f.write(b'x' * 100)
+        stats = CacheStats(lambda: os.path.join(cache_dir, 'cache_stats.json'))
+        stats.record_hit('feedback')
+        stats.record_memory_hit('feedback')
+        stats.record_read('feedback', 2 * 1024 ** 2, 0.02)
+        stats.flush()
+        result = self.runner.invoke(cache_cli, ['stats'], env = RUNNER_ENVIRONMENT)
+        assert result.exit_code == 0
+        assert 'get_leaderboard: 1 entries' in result.stdout
+        assert 'feedback: 1 entries (0.0 MB), 0 expired, 1 hits, 0 stale, 0 misses, 1 memory hits, 2.0 MB read, 0.0 MB written, 1 loads averaging 20.0 ms' in result.stdout
+        result = self.runner.invoke(cache_cli, ['ls'], env = RUNNER_ENVIRONMENT)
+        assert result.exit_code == 0
+        assert 'cache-get_leaderboard-key.pkl' in result.stdout
+        assert 'submission-id.pkl' in result.stdout
+
+    @patch('chaiverse.feedback.warm_feedback_cache')
+    def test_chaiverse_cache_warm_reports_refreshed_and_failed_submissions(self, warm_feedback_cache_mock):
+        warm_feedback_cache_mock.return_value = {'model_1': {'thumbs_up': 1}, 'model_2': ValueError('timed out')}
+        result = self.runner.invoke(cache_cli, ['warm', '--submission-id', 'model_1', '--submission-id', 'model_2'], env = RUNNER_ENVIRONMENT)
+        warm_feedback_cache_mock.assert_called_once_with(('model_1', 'model_2'), max_workers=10)
+        assert 'Refreshed feedback of 1 submissions' in result.stdout
+        assert 'Failed to refresh feedback of model_2: timed out' in result.stdout
+        assert result.exit_code == 1
+
 if __name__ == '__main__':
     cli()
@@ -26,3 +26,12 @@ def test_filter_for_date_range():
 
     assert len(feedback_metrics.feedbacks) == 1
     assert feedback_metrics.feedbacks[0]['id'] == 2
+
+
+def test_feedback_metrics_can_be_built_one_feedback_at_a_time():
+    feedback_metrics = FeedbackMetrics()
+    feedback_metrics.add_feedback(f'feedback_{TIMESTAMP_0101}', dict(id=1))
+    feedback_metrics.add_feedback(f'feedback_{TIMESTAMP_0103}', dict(id=2))
+    assert feedback_metrics.total_feedback_count == 2
+    feedback_metrics.filter_for_date_range(DATE_RANGE)
+    assert feedback_metrics.feedbacks == [dict(id=2, server_epoch_time=TIMESTAMP_0103)]
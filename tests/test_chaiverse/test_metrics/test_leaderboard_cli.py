@@ -2,6 +2,7 @@ import os
 
 from mock import ANY, mock, patch
 import numpy as np
+import pandas as pd
 import pytest
 import vcr
 
@@ -42,10 +43,21 @@ def test_display_leaderboard_will_call_display_competition_leaderboard(display_c
         detailed=False, 
         regenerate=False, 
         developer_key=ANY,
-        max_workers=ANY
+        max_workers=ANY,
+        stale_while_revalidate=False,
     )
 
 
+@mock.patch('chaiverse.metrics.leaderboard_cli.get_leaderboard')
+def test_display_competition_leaderboard_shares_cache_across_submission_orders(get_leaderboard_mock):
+    get_leaderboard_mock.__name__ = 'get_leaderboard'
+    get_leaderboard_mock.return_value = pd.DataFrame()
+    for submissions in (['sub-2', 'sub-1'], ['sub-1', 'sub-2']):
+        chai.display_competition_leaderboard(competition={'id': 'test', 'submissions': submissions}, developer_key='key')
+    get_leaderboard_mock.assert_called_once()
+    assert get_leaderboard_mock.call_args.kwargs['submission_ids'] == ['sub-1', 'sub-2']
+
+
 @vcr.use_cassette(os.path.join(RESOURCE_DIR, 'test_display_competition_leaderboard_does_not_regress_for_round_robin_competition.yaml'))
 def test_display_competition_leaderboard_does_not_regress_for_round_robin_competition(guanado_data_dir):
     competition = {
@@ -3,19 +3,23 @@ import pytest
 
 from chaiverse import submit, formatters, utils
 from chaiverse import config
+from chaiverse.lib import json_tools
+
+from mock_responses import MockJSONResponse
+
 
 @pytest.fixture(autouse="session")
 def mock_post():
-    with patch("chaiverse.http_client.requests.post") as func:
-        func.return_value.status_code = 200
+    with patch("chaiverse.http_client.requests.Session.post") as func:
+        func.return_value = MockJSONResponse()
         func.return_value.json.return_value = {"submission_id": "name_123456"}
         yield func
 
 
 @pytest.fixture(autouse="session")
 def mock_get():
-    with patch("chaiverse.http_client.requests.get") as func:
-        func.return_value.status_code = 200
+    with patch("chaiverse.http_client.requests.Session.get") as func:
+        func.return_value = MockJSONResponse()
         func.return_value.json.return_value = {'name_123456': {'status': 'pending'}}
         yield func
 
@@ -23,9 +27,8 @@ def mock_get():
 @pytest.fixture()
 def mock_get_pending_to_success():
     responses = [{'status': 'pending'}] * 2 + [{'status': 'deployed'}]
-    with patch("chaiverse.http_client.requests.get") as func:
-        func.return_value.status_code = 200
-        func.return_value.json.side_effect = responses
+    with patch("chaiverse.http_client.requests.Session.get") as func:
+        func.side_effect = [MockJSONResponse(payload=response) for response in responses]
         yield func
 
 
@@ -70,9 +73,9 @@ def test_model_submitter(mock_submission, mock_post, mock_get_pending_to_success
     }
     with patch('builtins.input', return_value='accept'):
         submission_id = model_submitter.submit(model_submitter_params)
-    headers = {"Authorization": "Bearer mock-key"}
+    headers = {"Authorization": "Bearer mock-key", "Content-Type": "application/json"}
     expected_url = utils.get_url(config.SUBMISSION_ENDPOINT)
-    mock_post.assert_called_once_with(url=expected_url, headers=headers, json=mock_submission)
+    mock_post.assert_called_once_with(url=expected_url, headers=headers, data=json_tools.dumps(mock_submission))
     assert mock_get_pending_to_success.call_count == 3
     assert submission_id == "name_123456"
 
@@ -94,9 +97,9 @@ def test_client(mock_post, mock_submission):
 
 def test_submit_client_posts_with_correct_payload(mock_post, mock_submission):
     submit.submit_model(mock_submission, developer_key="mock-key")
-    headers={"Authorization": "Bearer mock-key"}
+    headers={"Authorization": "Bearer mock-key", "Content-Type": "application/json"}
     expected_url = utils.get_url(config.SUBMISSION_ENDPOINT)
-    mock_post.assert_called_once_with(url=expected_url, json=mock_submission, headers=headers)
+    mock_post.assert_called_once_with(url=expected_url, data=json_tools.dumps(mock_submission), headers=headers)
 
 
 def test_submit_client_posts_raises_for_failed_post(mock_post, mock_submission):
@@ -121,6 +124,28 @@ def test_get_model_info(mock_get):
     assert expected == response
 
 
+def test_get_models_info_returns_info_per_submission(mock_get):
+    def get_info(url, headers):
+        submission_id = url.split('/')[-1]
+        if submission_id == 'bad_model':
+            return MockJSONResponse(404, {'error': 'not found'})
+        return MockJSONResponse(payload={'submission_id': submission_id, 'status': 'deployed', 'logs': ['...']})
+
+    mock_get.side_effect = get_info
+    response = submit.get_models_info(['model_1', 'bad_model', 'model_2'], developer_key='key')
+    assert list(response.keys()) == ['model_1', 'bad_model', 'model_2']
+    assert response['model_1'] == {'submission_id': 'model_1', 'status': 'deployed', 'logs': ['...']}
+    assert isinstance(response['bad_model'], AssertionError)
+    assert 'not found' in str(response['bad_model'])
+    assert mock_get.call_count == 3
+
+
+def test_get_models_info_keeps_only_selected_fields(mock_get):
+    mock_get.return_value.json.return_value = {'status': 'deployed', 'logs': ['...'], 'model_repo': 'repo'}
+    response = submit.get_models_info(['model_1'], fields=['status', 'model_repo'], max_workers=1, developer_key='key')
+    assert response == {'model_1': {'status': 'deployed', 'model_repo': 'repo'}}
+
+
 def test_evaluate_mode_get_called_with_correct_url(mock_get):
     submit.evaluate_model('name_123456', developer_key='key')
     url = utils.get_url(config.EVALUATE_ENDPOINT, submission_id='name_123456')